@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark for batched augmentation.
+
+Compares the per-image augment_image loop with augment_batch (LUT-based
+HSV, one warpAffine per sample, in-place flips, YOLO labels transformed
+too) on synthetic 640x640 batches, reporting images/s for each. Both use
+the same HSV/rotation/flip settings.
+
+Usage (from the ml/ directory):
+    python -m benchmarks.bench_augment --batch 16 64 --repeats 5
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from utils.preprocess import augment_batch, augment_image
+
+
+def make_batch(n_images: int, size: int, boxes_per_image: int, seed: int = 0):
+    """Smooth-noise images and random YOLO labels."""
+    rng = np.random.default_rng(seed)
+    images = np.empty((n_images, size, size, 3), dtype=np.uint8)
+    for i in range(n_images):
+        small = rng.integers(0, 256, (size // 16, size // 16, 3), dtype=np.uint8)
+        images[i] = cv2.resize(small, (size, size), interpolation=cv2.INTER_CUBIC)
+    labels = []
+    for _ in range(n_images):
+        wh = rng.uniform(0.05, 0.3, (boxes_per_image, 2))
+        xy = rng.uniform(wh / 2, 1 - wh / 2)
+        classes = rng.integers(0, 8, (boxes_per_image, 1))
+        labels.append(np.hstack([classes, xy, wh]))
+    return images, labels
+
+
+def time_it(fn, repeats: int) -> float:
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched augmentation")
+    parser.add_argument("--batch", type=int, nargs="+", default=[16, 64], help="Batch sizes")
+    parser.add_argument("--size", type=int, default=640, help="Image size")
+    parser.add_argument("--boxes", type=int, default=10, help="Labels per image")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed repeats per mode")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    # Both paths apply HSV and rotation with p=0.5 and the same ranges
+    settings = dict(hsv_h=0.015, hsv_s=0.7, hsv_v=0.4, rotation=10.0, flip_lr=0.5)
+
+    print(f"{'Batch':>6} {'augment_image img/s':>20} {'augment_batch img/s':>20} {'speedup':>8}")
+    for batch_size in args.batch:
+        images, labels = make_batch(batch_size, args.size, args.boxes, args.seed)
+        out = np.empty_like(images)
+        rng = np.random.default_rng(args.seed)
+        np.random.seed(args.seed)
+
+        def loop():
+            # augment_image draws p=0.5 per stage from the global RNG
+            return [augment_image(img, **settings) for img in images]
+
+        def batched():
+            return augment_batch(images, labels, rng, out=out, **settings)
+
+        loop_time = time_it(loop, args.repeats)
+        batch_time = time_it(batched, args.repeats)
+        print(f"{batch_size:>6} {batch_size / loop_time:>20.1f} {batch_size / batch_time:>20.1f} "
+              f"{loop_time / batch_time:>7.2f}x")
+
+    # Same seed, same output: batches are reproducible
+    first, _ = augment_batch(images, labels, rng=args.seed, **settings)
+    second, _ = augment_batch(images, labels, rng=args.seed, **settings)
+    assert np.array_equal(first, second)
+
+
+if __name__ == "__main__":
+    main()
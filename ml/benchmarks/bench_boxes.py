@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for utils.boxes.
+
+Times pairwise IoU, NMS (uncapped, as in the tiling merge, and capped at
+max_det=300, as in the ONNX engine) and WBF on dense synthetic detections
+against the implementations they replaced, which are kept here as
+reference_* functions; tests/test_boxes.py checks the kernels against
+the same references.
+
+Usage (from the ml/ directory):
+    python -m benchmarks.bench_boxes
+    python -m benchmarks.bench_boxes --boxes 2000 --classes 8 --repeats 20
+"""
+
+import argparse
+import time
+from typing import Callable, Tuple
+
+import numpy as np
+
+from utils.boxes import box_iou, non_max_suppression, pairwise_overlap, weighted_box_fusion
+from utils.evaluate import compute_iou
+
+
+def reference_iou_matrix(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """Previous compute_iou_matrix: explicit pairwise broadcast."""
+    b1 = boxes1[:, None, :]
+    b2 = boxes2[None, :, :]
+    x1 = np.maximum(b1[..., 0], b2[..., 0])
+    y1 = np.maximum(b1[..., 1], b2[..., 1])
+    x2 = np.minimum(b1[..., 2], b2[..., 2])
+    y2 = np.minimum(b1[..., 3], b2[..., 3])
+    intersection = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+    area1 = (b1[..., 2] - b1[..., 0]) * (b1[..., 3] - b1[..., 1])
+    area2 = (b2[..., 2] - b2[..., 0]) * (b2[..., 3] - b2[..., 1])
+    union = area1 + area2 - intersection
+    iou = np.zeros(union.shape, dtype=np.float64)
+    np.divide(intersection, union, out=iou, where=union > 0)
+    return iou
+
+
+def reference_nms(boxes, scores, iou_threshold=0.45, class_ids=None, max_det=300):
+    """Previous onnx_engine NMS: one global loop, classes shifted apart in float32."""
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    boxes = np.asarray(boxes, dtype=np.float32)
+    if class_ids is not None:
+        offset = boxes.max() + 1
+        boxes = boxes + (np.asarray(class_ids, dtype=np.float32) * offset)[:, None]
+
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    keep = []
+    while order.size and len(keep) < max_det:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        if not rest.size:
+            break
+        overlap = reference_iou_matrix(boxes[best:best + 1], boxes[rest])[0]
+        order = rest[overlap <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def reference_wbf(boxes, scores, class_ids, iou_threshold=0.55, metric="iou"):
+    """Previous tiling WBF: all classes in one pass, other classes masked out."""
+    n = len(boxes)
+    fused = np.zeros((n, 4))
+    box_sums = np.zeros((n, 4))
+    weights = np.zeros(n)
+    counts = np.zeros(n, dtype=np.int64)
+    labels = np.zeros(n, dtype=np.int64)
+    n_fused = 0
+
+    for i in np.argsort(-np.asarray(scores), kind="stable"):
+        target = -1
+        if n_fused:
+            overlap = pairwise_overlap(boxes[i:i + 1], fused[:n_fused], metric)[0]
+            overlap[labels[:n_fused] != class_ids[i]] = 0
+            best = int(overlap.argmax())
+            if overlap[best] > iou_threshold:
+                target = best
+        if target < 0:
+            target = n_fused
+            labels[target] = class_ids[i]
+            n_fused += 1
+        box_sums[target] += scores[i] * boxes[i]
+        weights[target] += scores[i]
+        counts[target] += 1
+        fused[target] = box_sums[target] / weights[target]
+
+    fused_scores = weights[:n_fused] / counts[:n_fused]
+    order = np.argsort(-fused_scores, kind="stable")
+    return fused[order], fused_scores[order], labels[order]
+
+
+def reference_giou(a: np.ndarray, b: np.ndarray) -> float:
+    """Scalar GIoU of two xyxy boxes."""
+    iou = compute_iou(a, b)
+    iw = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    ih = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - iw * ih
+    enclosing = (max(a[2], b[2]) - min(a[0], b[0])) * (max(a[3], b[3]) - min(a[1], b[1]))
+    return iou - (enclosing - union) / enclosing
+
+
+def make_detections(n: int, num_classes: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Clustered xyxy detections: jittered copies around n // 8 objects."""
+    rng = np.random.default_rng(seed)
+    n_objects = max(1, n // 8)
+    centers = rng.uniform(0, 640, (n_objects, 2))
+    sizes = rng.uniform(8, 60, (n_objects, 2))
+    pick = rng.integers(0, n_objects, n)
+    xy = centers[pick] + rng.normal(0, 3, (n, 2))
+    wh = sizes[pick] * rng.uniform(0.85, 1.15, (n, 2))
+    boxes = np.hstack([xy - wh / 2, xy + wh / 2])
+    scores = rng.uniform(0.25, 0.99, n)
+    class_ids = np.where(rng.random(n) < 0.9, pick % num_classes, rng.integers(0, num_classes, n))
+    return boxes, scores, class_ids
+
+
+def best_time(fn: Callable, repeats: int) -> float:
+    """Fastest of repeats calls, in milliseconds."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark utils.boxes")
+    parser.add_argument("--boxes", type=int, default=1000, help="Detections per timing scene")
+    parser.add_argument("--classes", type=int, default=8, help="Number of classes")
+    parser.add_argument("--repeats", type=int, default=10, help="Timing repeats (fastest counts)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    boxes, scores, class_ids = make_detections(args.boxes, args.classes, seed=args.seed)
+    cases = [
+        ("pairwise IoU", lambda: reference_iou_matrix(boxes, boxes), lambda: box_iou(boxes, boxes)),
+        ("NMS (class-aware)", lambda: reference_nms(boxes, scores, 0.45, class_ids, len(boxes)),
+         lambda: non_max_suppression(boxes, scores, 0.45, class_ids, len(boxes))),
+        ("NMS max_det=300", lambda: reference_nms(boxes, scores, 0.45, class_ids, 300),
+         lambda: non_max_suppression(boxes, scores, 0.45, class_ids, 300)),
+        ("WBF", lambda: reference_wbf(boxes, scores, class_ids), lambda: weighted_box_fusion(boxes, scores, class_ids)),
+    ]
+    print(f"{args.boxes} detections, {args.classes} classes, best of {args.repeats}")
+    print(f"{'Kernel':<18} {'Previous (ms)':>14} {'boxes (ms)':>11} {'Speedup':>8}")
+    for name, previous, current in cases:
+        t_prev = best_time(previous, args.repeats)
+        t_cur = best_time(current, args.repeats)
+        print(f"{name:<18} {t_prev:>14.2f} {t_cur:>11.2f} {t_prev / t_cur:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
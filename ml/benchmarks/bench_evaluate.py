@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the vectorized detection evaluator.
+
+Generates dense synthetic scenes (many small boxes per image, as in heavy
+aphid/thrips infestations), checks that evaluate_detections matches the
+original per-pair loop exactly, and reports the speedup. Also compares a
+single-pass mAP@0.5:0.95 run against ten separate single-threshold runs,
+and reports sharded process-pool scaling for the --workers counts given.
+
+Usage (from the ml/ directory):
+    python -m benchmarks.bench_evaluate --images 200 --boxes 60
+    python -m benchmarks.bench_evaluate --images 20000 --boxes 20 --workers 1 2 4 8
+"""
+
+import argparse
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import numpy as np
+
+from utils.evaluate import COCO_IOU_THRESHOLDS, compute_ap, compute_iou, evaluate_detections
+
+
+def reference_evaluate_detections(
+    predictions: List[Dict],
+    ground_truths: List[Dict],
+    iou_threshold: float = 0.5,
+    num_classes: int = 8,
+    class_names: List[str] = None,
+) -> Dict:
+    """Original nested-loop evaluator, kept as the correctness baseline."""
+    if class_names is None:
+        class_names = [f"class_{i}" for i in range(num_classes)]
+
+    all_detections = defaultdict(list)
+    all_annotations = defaultdict(int)
+
+    for pred, gt in zip(predictions, ground_truths):
+        gt_boxes = gt.get("boxes", [])
+        gt_labels = gt.get("labels", [])
+        pred_boxes = pred.get("boxes", [])
+        pred_scores = pred.get("scores", [])
+        pred_labels = pred.get("labels", [])
+
+        for label in gt_labels:
+            all_annotations[label] += 1
+
+        matched_gt = set()
+        for det_idx in np.argsort(-np.array(pred_scores)):
+            det_box = pred_boxes[det_idx]
+            det_label = pred_labels[det_idx]
+            best_iou = 0
+            best_gt_idx = -1
+            for gt_idx, (gt_box, gt_label) in enumerate(zip(gt_boxes, gt_labels)):
+                if gt_label != det_label or gt_idx in matched_gt:
+                    continue
+                iou = compute_iou(np.array(det_box), np.array(gt_box))
+                if iou > best_iou:
+                    best_iou = iou
+                    best_gt_idx = gt_idx
+            tp = 1 if best_iou >= iou_threshold and best_gt_idx >= 0 else 0
+            if tp:
+                matched_gt.add(best_gt_idx)
+            all_detections[det_label].append({"score": pred_scores[det_idx], "tp": tp})
+
+    results = {}
+    aps = []
+    for cls_id in range(num_classes):
+        dets = sorted(all_detections[cls_id], key=lambda x: -x["score"])
+        n_gt = all_annotations[cls_id]
+        if n_gt == 0:
+            results[class_names[cls_id]] = {"AP": 0.0, "precision": 0.0, "recall": 0.0}
+            continue
+        tp_cumsum = np.cumsum([d["tp"] for d in dets])
+        fp_cumsum = np.cumsum([1 - d["tp"] for d in dets])
+        recalls = tp_cumsum / n_gt
+        precisions = tp_cumsum / (tp_cumsum + fp_cumsum)
+        ap = compute_ap(recalls, precisions)
+        aps.append(ap)
+        results[class_names[cls_id]] = {
+            "AP": float(ap),
+            "precision": float(precisions[-1]) if len(precisions) > 0 else 0.0,
+            "recall": float(recalls[-1]) if len(recalls) > 0 else 0.0,
+            "n_predictions": len(dets),
+            "n_ground_truth": n_gt,
+        }
+
+    return {
+        "mAP@0.5": float(np.mean(aps) if aps else 0.0),
+        "per_class": results,
+        "total_predictions": sum(len(v) for v in all_detections.values()),
+        "total_ground_truth": sum(all_annotations.values()),
+    }
+
+
+def make_dense_scenes(
+    n_images: int,
+    boxes_per_image: int,
+    num_classes: int = 8,
+    seed: int = 0,
+):
+    """Synthesize images with many small GT boxes and jittered predictions."""
+    rng = np.random.default_rng(seed)
+    predictions, ground_truths = [], []
+
+    for _ in range(n_images):
+        n_gt = rng.integers(boxes_per_image // 2, boxes_per_image + 1)
+        xy = rng.uniform(0, 600, (n_gt, 2))
+        wh = rng.uniform(8, 40, (n_gt, 2))
+        gt_boxes = np.hstack([xy, xy + wh])
+        gt_labels = rng.integers(0, num_classes, n_gt)
+
+        # Jittered copies of most GTs plus pure false positives
+        keep = rng.random(n_gt) < 0.85
+        jitter = rng.normal(0, 4, (keep.sum(), 4))
+        n_fp = rng.integers(0, boxes_per_image // 4 + 1)
+        fp_xy = rng.uniform(0, 600, (n_fp, 2))
+        fp_boxes = np.hstack([fp_xy, fp_xy + rng.uniform(8, 40, (n_fp, 2))])
+
+        pred_boxes = np.vstack([gt_boxes[keep] + jitter, fp_boxes])
+        pred_labels = np.concatenate([gt_labels[keep], rng.integers(0, num_classes, n_fp)])
+        flip = rng.random(len(pred_labels)) < 0.05
+        pred_labels[flip] = rng.integers(0, num_classes, flip.sum())
+        pred_scores = rng.uniform(0.25, 0.99, len(pred_labels))
+
+        ground_truths.append({"boxes": gt_boxes.tolist(), "labels": gt_labels.tolist()})
+        predictions.append({
+            "boxes": pred_boxes.tolist(),
+            "scores": pred_scores.tolist(),
+            "labels": pred_labels.tolist(),
+        })
+
+    return predictions, ground_truths
+
+
+def run_scaling(predictions, ground_truths, worker_counts, shard_size):
+    """Time sharded evaluation at each worker count and check determinism."""
+    baseline = None
+    print(f"{'Workers':>7} {'Time (ms)':>10} {'Speedup':>8}")
+    for workers in worker_counts:
+        start = time.perf_counter()
+        results = evaluate_detections(
+            predictions, ground_truths, workers=workers, shard_size=shard_size
+        )
+        elapsed = time.perf_counter() - start
+        if baseline is None:
+            baseline = (results, elapsed)
+        assert results == baseline[0], f"results differ with {workers} workers"
+        print(f"{workers:>7d} {elapsed * 1000:>10.1f} {baseline[1] / elapsed:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark evaluate_detections")
+    parser.add_argument("--images", type=int, default=200, help="Number of synthetic images")
+    parser.add_argument("--boxes", type=int, default=60, help="Max GT boxes per image")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--workers", type=int, nargs="*", default=[],
+        help="Worker counts for the sharded scaling run (e.g. 1 2 4 8)",
+    )
+    parser.add_argument("--shard-size", type=int, default=2048, help="Images per worker shard")
+    args = parser.parse_args()
+
+    predictions, ground_truths = make_dense_scenes(args.images, args.boxes, seed=args.seed)
+    n_pred = sum(len(p["scores"]) for p in predictions)
+    n_gt = sum(len(g["labels"]) for g in ground_truths)
+    print(f"Scenes: {args.images} images, {n_pred} predictions, {n_gt} ground truths")
+
+    if args.workers:
+        run_scaling(predictions, ground_truths, args.workers, args.shard_size)
+        return
+
+    start = time.perf_counter()
+    expected = reference_evaluate_detections(predictions, ground_truths)
+    t_ref = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = evaluate_detections(predictions, ground_truths)
+    t_vec = time.perf_counter() - start
+
+    assert actual == expected, "vectorized results differ from reference"
+    print(f"Reference loop: {t_ref * 1000:9.1f} ms")
+    print(f"Vectorized:     {t_vec * 1000:9.1f} ms")
+    print(f"Speedup:        {t_ref / t_vec:9.1f}x  (results identical)")
+
+    start = time.perf_counter()
+    for threshold in COCO_IOU_THRESHOLDS:
+        evaluate_detections(predictions, ground_truths, iou_threshold=threshold, ap_method="101point")
+    t_sep = time.perf_counter() - start
+
+    start = time.perf_counter()
+    evaluate_detections(
+        predictions, ground_truths, iou_thresholds=COCO_IOU_THRESHOLDS, ap_method="101point"
+    )
+    t_multi = time.perf_counter() - start
+
+    print("\nmAP@0.5:0.95 (101-point)")
+    print(f"10 separate passes: {t_sep * 1000:9.1f} ms")
+    print(f"Single pass:        {t_multi * 1000:9.1f} ms  ({t_multi / t_vec:.1f}x one 0.5 pass)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Import-time budget check for the train.py CLI.
+
+Runs each command in a fresh interpreter under `python -X importtime`,
+sums the per-module import times and fails (exit code 1) when a command
+goes over its budget or imports a module it must not load:
+
+    train.py --help          no Ultralytics/torch, OpenCV, NumPy or onnxruntime
+    ONNX predict imports     train + utils.onnx_engine without Ultralytics/torch
+
+Each command is run --repeats times and the fastest run counts, so a
+cold page cache on the first run does not cause false alarms.
+
+Usage (from the ml/ directory):
+    python -m benchmarks.bench_import
+    python -m benchmarks.bench_import --budget-ms 150 --top 10
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ML_DIR = Path(__file__).resolve().parent.parent
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+# (name, python args, modules that must not be imported, held to --budget-ms)
+CHECKS = [
+    ("train.py --help", ["train.py", "--help"], ("ultralytics", "torch", "cv2", "numpy", "onnxruntime"), True),
+    ("onnx predict path", ["-c", "import train, utils.onnx_engine"], ("ultralytics", "torch"), False),
+]
+
+
+def run_importtime(args: List[str]) -> Tuple[float, float, Dict[str, int], List[Tuple[str, int]]]:
+    """
+    Run `python -X importtime <args>` in ml/.
+
+    Returns:
+        (wall seconds, total import ms, {module: self us}, [(top-level
+        module, cumulative us)])
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=ML_DIR, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed:\n{proc.stderr[-2000:]}")
+
+    modules, top_level = {}, []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = int(self_us)
+            if len(indent) == 1:
+                top_level.append((name, int(cumulative_us)))
+    return wall, sum(modules.values()) / 1000, modules, top_level
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check train.py import-time budget")
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="Max total import time of train.py --help")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per command (fastest counts)")
+    parser.add_argument("--top", type=int, default=8, help="Slowest top-level imports to list")
+    args = parser.parse_args()
+
+    failures = []
+    for name, command, forbidden, budgeted in CHECKS:
+        runs = [run_importtime(command) for _ in range(args.repeats)]
+        wall, total_ms, modules, top_level = min(runs, key=lambda run: run[1])
+        loaded = sorted(m for m in forbidden if m in modules)
+        print(f"{name}: {total_ms:.1f} ms imports, {wall * 1000:.0f} ms wall, {len(modules)} modules")
+        for module, cumulative_us in sorted(top_level, key=lambda item: -item[1])[:args.top]:
+            print(f"    {cumulative_us / 1000:>8.1f} ms  {module}")
+
+        if loaded:
+            failures.append(f"{name} imports {', '.join(loaded)}")
+        if budgeted and total_ms > args.budget_ms:
+            failures.append(f"{name} import time {total_ms:.1f} ms > budget {args.budget_ms:.0f} ms")
+
+    if failures:
+        print("\nFAIL: " + "\n      ".join(failures))
+        sys.exit(1)
+    print("\nOK: import budget met")
+
+
+if __name__ == "__main__":
+    main()
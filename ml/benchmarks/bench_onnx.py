@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Latency/throughput comparison of the ONNX Runtime engine and Ultralytics.
+
+Runs the same images through utils.onnx_engine.OnnxDetector (exported
+model) and YOLO(weights).predict, reporting per-image latency percentiles
+and images/s for each path, the batched ONNX throughput, and how many of
+the Ultralytics detections the ONNX path reproduces (same class, IoU >=
+0.9). Both paths are timed end to end from the image file: decode,
+letterbox, forward pass and NMS.
+
+Usage (from the ml/ directory):
+    python train.py --mode export --model runs/detect/peanutguard/weights/best.pt
+    python -m benchmarks.bench_onnx \\
+        --onnx runs/detect/peanutguard/weights/best.onnx \\
+        --weights runs/detect/peanutguard/weights/best.pt \\
+        --images dataset/images/test --limit 100
+
+Without --images, synthetic camera-sized JPEGs are generated. Without
+--weights (or without Ultralytics installed) only the ONNX path runs.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.bench_preprocess import write_synthetic_images
+from utils.evaluate import compute_iou_matrix
+from utils.onnx_engine import OnnxDetector
+from utils.preprocess import IMAGE_SUFFIXES
+
+
+def time_per_image(fn, paths, warmup: int = 3):
+    """Run fn(path) over paths; returns (per-image ms array, outputs)."""
+    for path in paths[:warmup]:
+        fn(path)
+    latencies, outputs = [], []
+    for path in paths:
+        start = time.perf_counter()
+        outputs.append(fn(path))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.asarray(latencies), outputs
+
+
+def report(label: str, latencies: np.ndarray):
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    print(f"{label:<24} {latencies.mean():>8.1f} {p50:>8.1f} {p90:>8.1f} {p99:>8.1f} "
+          f"{1000 / latencies.mean():>8.1f}")
+
+
+def agreement(reference, candidate, iou_threshold: float = 0.9) -> float:
+    """Fraction of reference detections matched by a same-class candidate box."""
+    matched = total = 0
+    for (ref_boxes, _ref_scores, ref_cls), (boxes, _scores, cls) in zip(reference, candidate):
+        total += len(ref_boxes)
+        if len(ref_boxes) and len(boxes):
+            iou = compute_iou_matrix(ref_boxes, boxes)
+            iou[ref_cls[:, None] != cls[None, :]] = 0
+            matched += int((iou.max(axis=1) >= iou_threshold).sum())
+    return matched / total if total else 1.0
+
+
+def ultralytics_runner(weights: str, imgsz: int, conf: float, iou: float):
+    """Return fn(path) -> (boxes, scores, class_ids) using Ultralytics, or None."""
+    try:
+        from ultralytics import YOLO
+    except ImportError:
+        print("Ultralytics not installed; skipping the PyTorch path")
+        return None
+    model = YOLO(weights)
+
+    def run(path):
+        result = model.predict(source=path, imgsz=imgsz, conf=conf, iou=iou, verbose=False)[0]
+        boxes = result.boxes
+        return (boxes.xyxy.cpu().numpy().astype(np.float64),
+                boxes.conf.cpu().numpy().astype(np.float64),
+                boxes.cls.cpu().numpy().astype(np.int64))
+
+    return run
+
+
+def run_benchmark(paths, args):
+    detector = OnnxDetector(
+        args.onnx, conf=args.conf, iou=args.iou, imgsz=args.size, num_threads=args.threads
+    )
+    print(f"{len(paths)} images, input {detector.imgsz}, "
+          f"{'dynamic' if detector.dynamic_batch else 'static'} batch ONNX model\n")
+    print(f"{'Backend':<24} {'mean ms':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'img/s':>8}")
+
+    onnx_latencies, onnx_outputs = time_per_image(detector.predict, paths)
+    report("onnxruntime", onnx_latencies)
+
+    run = ultralytics_runner(args.weights, detector.imgsz, args.conf, args.iou) if args.weights else None
+    if run is not None:
+        ul_latencies, ul_outputs = time_per_image(run, paths)
+        report("ultralytics", ul_latencies)
+
+    if args.batch > 1:
+        detector.predict_batch(paths[:args.batch])  # warm up
+        start = time.perf_counter()
+        for i in range(0, len(paths), args.batch):
+            detector.predict_batch(paths[i:i + args.batch])
+        elapsed = time.perf_counter() - start
+        label = f"onnxruntime batch {args.batch}"
+        print(f"{label:<24} {elapsed * 1000 / len(paths):>8.1f} {'-':>8} {'-':>8} {'-':>8} "
+              f"{len(paths) / elapsed:>8.1f}")
+
+    if run is not None:
+        speedup = ul_latencies.mean() / onnx_latencies.mean()
+        print(f"\nonnxruntime speedup: {speedup:.2f}x per image")
+        print(f"Detections reproduced (same class, IoU >= 0.9): "
+              f"{agreement(ul_outputs, onnx_outputs):.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ONNX Runtime and Ultralytics inference")
+    parser.add_argument("--onnx", required=True, help="Exported .onnx model")
+    parser.add_argument("--weights", default=None, help="Matching .pt weights for the Ultralytics path")
+    parser.add_argument("--images", default=None, help="Image directory (default: synthetic images)")
+    parser.add_argument("--limit", type=int, default=50, help="Number of images")
+    parser.add_argument("--size", type=int, default=640, help="Input size for dynamic-shape models")
+    parser.add_argument("--batch", type=int, default=8, help="Batch size for the batched ONNX run")
+    parser.add_argument("--threads", type=int, default=0, help="onnxruntime intra-op threads")
+    parser.add_argument("--conf", type=float, default=0.25, help="Confidence threshold")
+    parser.add_argument("--iou", type=float, default=0.45, help="NMS IoU threshold")
+    args = parser.parse_args()
+
+    if args.images:
+        paths = sorted(str(p) for p in Path(args.images).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+        run_benchmark(paths[:args.limit], args)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            run_benchmark(write_synthetic_images(Path(tmp), args.limit), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Benchmark for batch preprocessing.
+
+Writes synthetic field-sized JPEGs to a temporary directory and compares
+serial batch_preprocess with PrefetchBatchLoader at several worker
+counts, optionally simulating model time per batch to show how much of
+the decode cost the prefetch queue hides.
+
+It also compares the per-image allocate/normalize/stack path with
+filling a preallocated BatchBuffer (images decoded up front, so only
+letterboxing and normalization are timed), reporting throughput and
+peak traced memory per batch.
+
+Usage (from the ml/ directory):
+    python -m benchmarks.bench_preprocess --images 128 --batch 16 --workers 1 2 4
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from utils.preprocess import (
+    BatchBuffer,
+    PrefetchBatchLoader,
+    batch_preprocess,
+    load_image,
+    normalize,
+    resize_with_padding,
+)
+
+
+def write_synthetic_images(directory: Path, n_images: int, seed: int = 0):
+    """Write noisy JPEGs with varied camera-like resolutions."""
+    rng = np.random.default_rng(seed)
+    sizes = [(3000, 4000), (1080, 1920), (1200, 1600), (720, 1280)]
+    paths = []
+    for i in range(n_images):
+        h, w = sizes[i % len(sizes)]
+        # Smooth noise compresses like a real photo rather than pure noise
+        small = rng.integers(0, 256, (h // 16, w // 16, 3), dtype=np.uint8)
+        img = cv2.resize(small, (w, h), interpolation=cv2.INTER_CUBIC)
+        path = directory / f"synthetic_{i:05d}.jpg"
+        cv2.imwrite(str(path), img)
+        paths.append(str(path))
+    return paths
+
+
+def stack_batch(images, target_size):
+    """Previous batch_preprocess body: fresh canvas, float copy, then stack."""
+    batch = []
+    for img in images:
+        padded, _scale, _padding = resize_with_padding(img, target_size)
+        batch.append(np.transpose(normalize(padded), (2, 0, 1)))
+    return np.stack(batch, axis=0)
+
+
+def measure(fn, repeats: int):
+    """Return (seconds per call, peak traced bytes) for fn()."""
+    fn()  # warm up allocator and thread-local canvases
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeats
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def compare_buffer(paths, batch_size: int, target_size: int, repeats: int = 5):
+    """Time and memory of stacking vs filling a preallocated BatchBuffer."""
+    images = [load_image(p) for p in paths[:batch_size]]
+    buffer = BatchBuffer(len(images), target_size)
+
+    def fill_buffer(target=None):
+        target = target or buffer
+        for i, img in enumerate(images):
+            target.fill(i, img)
+        return target.data
+
+    assert np.array_equal(stack_batch(images, target_size), fill_buffer())
+    print(f"\n{'Batch assembly':<22} {'img/s':>8} {'peak MiB':>10}")
+    for label, fn in (("np.stack (previous)", lambda: stack_batch(images, target_size)),
+                      ("BatchBuffer (new)", lambda: fill_buffer(BatchBuffer(len(images), target_size))),
+                      ("BatchBuffer (reused)", fill_buffer)):
+        elapsed, peak = measure(fn, repeats)
+        print(f"{label:<22} {len(images) / elapsed:>8.1f} {peak / 2 ** 20:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch preprocessing")
+    parser.add_argument("--images", type=int, default=128, help="Number of synthetic images")
+    parser.add_argument("--batch", type=int, default=16, help="Batch size")
+    parser.add_argument("--size", type=int, default=640, help="Target input size")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts")
+    parser.add_argument("--queue-depth", type=int, default=4, help="Prefetch queue depth (batches)")
+    parser.add_argument("--model-ms", type=float, default=0.0, help="Simulated model time per batch")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_synthetic_images(Path(tmp), args.images)
+
+        start = time.perf_counter()
+        for i in range(0, len(paths), args.batch):
+            batch_preprocess(paths[i:i + args.batch], args.size)
+            time.sleep(args.model_ms / 1000)
+        serial = time.perf_counter() - start
+        print(f"{'Mode':<22} {'img/s':>8} {'starved (s)':>12}")
+        print(f"{'batch_preprocess':<22} {len(paths) / serial:>8.1f} {'-':>12}")
+
+        for workers in args.workers:
+            loader = PrefetchBatchLoader(
+                paths, batch_size=args.batch, target_size=args.size,
+                workers=workers, queue_depth=args.queue_depth,
+            )
+            for _batch, _metadata in loader:
+                time.sleep(args.model_ms / 1000)
+            stats = loader.stats
+            label = f"prefetch x{workers}"
+            print(f"{label:<22} {stats.images_per_sec:>8.1f} {stats.starved:>12.2f}")
+
+        compare_buffer(paths, args.batch, args.size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmark suite for the preprocessing, evaluation and
+inference hot paths.
+
+Every case runs on seeded synthetic data at each requested scale:
+
+    resize_with_padding   letterbox decoded camera-sized images
+    batch_preprocess      decode + letterbox JPEGs into one batch
+    augment_image         per-image HSV / rotation / flip
+    compute_iou           scalar IoU over all GT x prediction pairs
+    evaluate_detections   mAP@0.5 over jittered synthetic scenes
+    predict               OnnxDetector.predict per image (needs --onnx)
+
+Each (scale, case) runs in a fresh spawned process, so the reported peak
+RSS (resource.getrusage) belongs to that case alone and one case cannot
+warm caches for the next. Timings are the median and the best of
+--repeats runs after one warm-up run.
+
+Every run is appended to a JSON history (--history) together with the
+commit, Python/NumPy/OpenCV versions and CPU count. With --baseline (a
+history file, whose last run is used, or a file written by --output),
+cases whose best ms/op or peak RSS grew by more than --threshold /
+--rss-threshold are reported and the exit code is 1, so CI can gate on it:
+
+    python -m benchmarks.bench_suite --output benchmarks/baseline.json    # on main
+    python -m benchmarks.bench_suite --baseline benchmarks/baseline.json --threshold 0.15
+
+Compare runs from the same machine only; the environment block of both
+runs is printed when they differ.
+
+Usage (from the ml/ directory):
+    python -m benchmarks.bench_suite
+    python -m benchmarks.bench_suite --scales small medium large --repeats 7
+    python -m benchmarks.bench_suite --cases predict --onnx runs/detect/peanutguard/weights/best.onnx
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+ML_DIR = Path(__file__).resolve().parent.parent
+
+# images/shape/boxes drive the image cases, eval_images the evaluator
+SCALES = {
+    "small": {"images": 8, "shape": (480, 640), "boxes": 10, "eval_images": 200},
+    "medium": {"images": 16, "shape": (1080, 1920), "boxes": 30, "eval_images": 1000},
+    "large": {"images": 8, "shape": (3000, 4000), "boxes": 100, "eval_images": 5000},
+}
+CASES = ("resize_with_padding", "batch_preprocess", "augment_image", "compute_iou", "evaluate_detections", "predict")
+TARGET_SIZE = 640
+
+
+def synthetic_images(n_images: int, shape: Tuple[int, int], seed: int):
+    """Smooth-noise BGR images, which compress like photos rather than pure noise."""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    images = []
+    for _ in range(n_images):
+        small = rng.integers(0, 256, (max(h // 16, 1), max(w // 16, 1), 3), dtype=np.uint8)
+        images.append(cv2.resize(small, (w, h), interpolation=cv2.INTER_CUBIC))
+    return images
+
+
+def synthetic_scenes(n_images: int, n_boxes: int, seed: int):
+    """
+    Ground truths plus predictions that jitter, drop and add boxes, so the
+    evaluator sees true positives, misses and false positives.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    predictions, ground_truths = [], []
+    for _ in range(n_images):
+        xy = rng.uniform(0, 600, (n_boxes, 2))
+        wh = rng.uniform(8, 80, (n_boxes, 2))
+        gt_boxes = np.hstack([xy, xy + wh])
+        gt_labels = rng.integers(0, 8, n_boxes)
+
+        keep = rng.random(n_boxes) < 0.85
+        jitter = rng.normal(0, 3, (int(keep.sum()), 4))
+        n_extra = int(rng.integers(0, n_boxes // 5 + 1))
+        extra_xy = rng.uniform(0, 600, (n_extra, 2))
+        extra = np.hstack([extra_xy, extra_xy + rng.uniform(8, 80, (n_extra, 2))])
+        pred_boxes = np.vstack([gt_boxes[keep] + jitter, extra])
+        pred_labels = np.concatenate([gt_labels[keep], rng.integers(0, 8, n_extra)])
+
+        ground_truths.append({"boxes": gt_boxes, "labels": gt_labels})
+        predictions.append({
+            "boxes": pred_boxes,
+            "scores": rng.uniform(0.25, 1.0, len(pred_boxes)),
+            "labels": pred_labels,
+        })
+    return predictions, ground_truths
+
+
+def write_jpegs(images, directory: Path) -> List[str]:
+    import cv2
+
+    paths = []
+    for i, image in enumerate(images):
+        path = directory / f"bench_{i:05d}.jpg"
+        cv2.imwrite(str(path), image)
+        paths.append(str(path))
+    return paths
+
+
+def setup_case(case: str, scale: Dict, seed: int, tmp: Path, onnx: Optional[str]) -> Tuple[Callable, int, str]:
+    """Build the inputs for one case; returns (fn, ops per call, op unit)."""
+    import numpy as np
+
+    from utils.evaluate import compute_iou, evaluate_detections
+    from utils.preprocess import augment_image, batch_preprocess, resize_with_padding
+
+    if case in ("compute_iou", "evaluate_detections"):
+        n_images = scale["images"] if case == "compute_iou" else scale["eval_images"]
+        predictions, ground_truths = synthetic_scenes(n_images, scale["boxes"], seed)
+        if case == "evaluate_detections":
+            return lambda: evaluate_detections(predictions, ground_truths), n_images, "image"
+
+        pairs = [(p, g) for pred, gt in zip(predictions, ground_truths)
+                 for p in pred["boxes"] for g in gt["boxes"]]
+        return lambda: [compute_iou(p, g) for p, g in pairs], len(pairs), "pair"
+
+    images = synthetic_images(scale["images"], scale["shape"], seed)
+    if case == "resize_with_padding":
+        return lambda: [resize_with_padding(image, TARGET_SIZE) for image in images], len(images), "image"
+    if case == "augment_image":
+        def augment():
+            np.random.seed(seed)  # augment_image draws from the global RNG
+            return [augment_image(image) for image in images]
+        return augment, len(images), "image"
+
+    paths = write_jpegs(images, tmp)
+    if case == "batch_preprocess":
+        return lambda: batch_preprocess(paths, TARGET_SIZE), len(paths), "image"
+    if case == "predict":
+        from utils.onnx_engine import OnnxDetector
+
+        detector = OnnxDetector(onnx)
+        return lambda: [detector.predict(path) for path in paths], len(paths), "image"
+    raise ValueError(f"Unknown case: {case}")
+
+
+def peak_rss_mib() -> float:
+    """Peak resident set size of this process (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(case: str, scale_name: str, repeats: int, seed: int, onnx: Optional[str]) -> Dict:
+    """Time one case; runs inside a fresh worker process."""
+    sys.path.insert(0, str(ML_DIR))
+    with tempfile.TemporaryDirectory() as tmp:
+        fn, ops, unit = setup_case(case, SCALES[scale_name], seed, Path(tmp), onnx)
+        fn()  # warm up
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+
+    median, best = statistics.median(times), min(times)
+    return {
+        "ops": ops,
+        "unit": unit,
+        "repeats": repeats,
+        "median_s": median,
+        "best_s": best,
+        "ms_per_op": median / ops * 1000,
+        "best_ms_per_op": best / ops * 1000,
+        "ops_per_s": ops / median,
+        "peak_rss_mib": peak_rss_mib(),
+    }
+
+
+def environment() -> Dict:
+    import cv2
+    import numpy as np
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ML_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--", "."], cwd=ML_DIR, capture_output=True, text=True,
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def load_run(path: str) -> Dict:
+    """A run record: the last entry of a history file, or a single --output file."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        if not data:
+            raise ValueError(f"{path} has no runs")
+        return data[-1]
+    return data
+
+
+def append_history(path: Path, run: Dict):
+    history = []
+    if path.exists():
+        with open(path, "r") as f:
+            history = json.load(f)
+    history.append(run)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(history, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def compare(run: Dict, baseline: Dict, threshold: float, rss_threshold: float) -> List[str]:
+    """Print per-case change against baseline; returns the regressions."""
+    if baseline.get("environment", {}) != run["environment"]:
+        ignored = ("commit", "dirty")
+        for key in sorted(set(run["environment"]) | set(baseline.get("environment", {}))):
+            old, new = baseline.get("environment", {}).get(key), run["environment"].get(key)
+            if old != new and key not in ignored:
+                print(f"note: {key} differs from baseline ({old} -> {new})")
+
+    regressions = []
+    print(f"\n{'Case':<32} {'base ms/op':>12} {'ms/op':>12} {'change':>8} {'base MiB':>9} {'MiB':>9}")
+    for name, result in run["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<32} {'-':>12} {result['best_ms_per_op']:>12.4f} {'new':>8}")
+            continue
+        change = result["best_ms_per_op"] / base["best_ms_per_op"] - 1
+        rss_change = result["peak_rss_mib"] / base["peak_rss_mib"] - 1
+        print(f"{name:<32} {base['best_ms_per_op']:>12.4f} {result['best_ms_per_op']:>12.4f} {change:>+7.1%} "
+              f"{base['peak_rss_mib']:>9.1f} {result['peak_rss_mib']:>9.1f}")
+        if change > threshold:
+            regressions.append(f"{name}: {change:+.1%} ms/op (threshold {threshold:.0%})")
+        if rss_change > rss_threshold:
+            regressions.append(f"{name}: {rss_change:+.1%} peak RSS (threshold {rss_threshold:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing, evaluation and inference hot paths")
+    parser.add_argument("--scales", nargs="+", default=["small", "medium"], choices=list(SCALES),
+                        help="Synthetic data scales")
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=CASES, help="Cases to run")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per case")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic data seed")
+    parser.add_argument("--onnx", default=None, help="Exported model for the predict case (skipped without it)")
+    parser.add_argument("--label", default="", help="Free-form tag stored with the run")
+    parser.add_argument("--history", default="runs/benchmarks/history.json", help="JSON history to append to")
+    parser.add_argument("--output", default=None, help="Also write this run alone to a JSON file (e.g. a baseline)")
+    parser.add_argument("--baseline", default=None, help="History or --output file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed ms/op increase (fraction)")
+    parser.add_argument("--rss-threshold", type=float, default=0.20, help="Allowed peak RSS increase (fraction)")
+    args = parser.parse_args()
+
+    # Read before the history is appended to, which may be the same file
+    baseline = load_run(args.baseline) if args.baseline else None
+    cases = list(args.cases)
+    if "predict" in cases and not args.onnx:
+        print("No --onnx model given; skipping the predict case")
+        cases.remove("predict")
+
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "label": args.label,
+        "environment": environment(),
+        "config": {"seed": args.seed, "repeats": args.repeats, "target_size": TARGET_SIZE,
+                   "scales": {name: SCALES[name] for name in args.scales}},
+        "results": {},
+    }
+
+    print(f"{'Case':<32} {'ops':>7} {'ms/op':>10} {'best ms/op':>11} {'ops/s':>10} {'peak MiB':>9}")
+    context = multiprocessing.get_context("spawn")
+    for scale_name in args.scales:
+        for case in cases:
+            with context.Pool(1) as pool:
+                result = pool.apply(run_case, (case, scale_name, args.repeats, args.seed, args.onnx))
+            name = f"{scale_name}/{case}"
+            run["results"][name] = result
+            print(f"{name:<32} {result['ops']:>7} {result['ms_per_op']:>10.4f} {result['best_ms_per_op']:>11.4f} "
+                  f"{result['ops_per_s']:>10.1f} {result['peak_rss_mib']:>9.1f}  ({result['unit']}s)")
+
+    append_history(Path(args.history), run)
+    print(f"\nAppended to {args.history}")
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if baseline is not None:
+        regressions = compare(run, baseline, args.threshold, args.rss_threshold)
+        if regressions:
+            print("\nREGRESSION: " + "\n            ".join(regressions))
+            sys.exit(1)
+        print("\nOK: no regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
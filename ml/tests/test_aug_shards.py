@@ -0,0 +1,79 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils.aug_shards import AugmentedShards, build_shards
+
+AUGMENTATION = {"hsv_h": 0.015, "hsv_s": 0.7, "hsv_v": 0.4, "degrees": 10.0, "translate": 0.1,
+                "scale": 0.5, "fliplr": 0.5, "flipud": 0.0, "mosaic": 1.0, "mixup": 0.1}
+
+
+def make_dataset(root, n=6):
+    images, labels = root / "images" / "train", root / "labels" / "train"
+    images.mkdir(parents=True)
+    labels.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    for i in range(n):
+        noise = rng.integers(0, 255, (48, 64, 3), dtype=np.uint8)
+        cv2.imwrite(str(images / f"leaf_{i}.jpg"), cv2.GaussianBlur(noise, (9, 9), 3))
+        (labels / f"leaf_{i}.txt").write_text(f"{i % 3} 0.5 0.5 0.4 0.3\n")
+    return images
+
+
+@pytest.mark.parametrize("encoding", ["jpeg", "raw"])
+def test_build_shards_skips_bad_images(tmp_path, encoding):
+    images = make_dataset(tmp_path / "dataset")
+    (images / "truncated.jpg").write_bytes(b"\xff\xd8\xff\xe0 truncated")
+    cv2.imwrite(str(images / "bad_label.jpg"), np.zeros((48, 64, 3), np.uint8))
+    (tmp_path / "dataset" / "labels" / "train" / "bad_label.txt").write_text("0 0.5 0.5\n1 0.2 0.2 0.1 0.1\n")
+
+    manifest = build_shards(str(images), str(tmp_path / "shards"), AUGMENTATION, variants=2, target_size=64,
+                            cache_dir=str(tmp_path / "cache"), chunk_size=4, workers=2, encoding=encoding)
+    assert manifest["count"] == 6
+    assert sorted(p.rsplit("/", 1)[1] for p in manifest["skipped"]) == ["bad_label.jpg", "truncated.jpg"]
+
+    shards = AugmentedShards(str(tmp_path / "shards"))
+    assert len(shards) == 6 and shards.encoding == encoding
+    for k in range(2):
+        for i in range(6):
+            image, labels = shards.sample(i, k)
+            assert image.shape == (64, 64, 3) and image.dtype == np.uint8
+            assert labels.shape[1] == 5
+            assert np.array_equal(labels, shards.labels(i, k))
+
+
+def test_jpeg_and_raw_shards_hold_the_same_samples(tmp_path):
+    images = make_dataset(tmp_path / "dataset")
+    shards = {}
+    for encoding in ("jpeg", "raw"):
+        build_shards(str(images), str(tmp_path / encoding), AUGMENTATION, variants=1, target_size=64,
+                     cache_dir=str(tmp_path / "cache"), workers=1, encoding=encoding, quality=100)
+        shards[encoding] = AugmentedShards(str(tmp_path / encoding))
+    jpeg_bytes = (tmp_path / "jpeg" / "variant_000.jpg").stat().st_size
+    assert jpeg_bytes < (tmp_path / "raw" / "variant_000.u8").stat().st_size
+    for i in range(6):
+        jpeg_image, jpeg_labels = shards["jpeg"].sample(i, 0)
+        raw_image, raw_labels = shards["raw"].sample(i, 0)
+        assert np.array_equal(jpeg_labels, raw_labels)
+        assert np.abs(jpeg_image.astype(int) - raw_image.astype(int)).mean() < 4
+
+
+def test_make_shard_trainer_builds_train_dataset(tmp_path):
+    torch = pytest.importorskip("torch")
+    pytest.importorskip("ultralytics")
+    from utils.aug_shards import make_shard_trainer
+
+    images = make_dataset(tmp_path / "dataset")
+    build_shards(str(images), str(tmp_path / "shards"), AUGMENTATION, variants=2, target_size=64,
+                 cache_dir=str(tmp_path / "cache"), workers=1)
+    trainer_class = make_shard_trainer(str(tmp_path / "shards"))
+
+    # build_dataset only needs self for the validation branch
+    dataset = trainer_class.build_dataset(None, str(images), mode="train")
+    assert len(dataset) == 6 and len(dataset.labels) == 6
+    assert dataset.labels[0]["bboxes"].shape[1] == 4
+    items = [dataset[i] for i in range(3)]
+    assert items[0]["img"].shape == (3, 64, 64) and items[0]["img"].dtype == torch.uint8
+    batch = dataset.collate_fn(items)
+    assert batch["img"].shape == (3, 3, 64, 64)
+    assert batch["bboxes"].shape[0] == batch["cls"].shape[0] == batch["batch_idx"].shape[0]
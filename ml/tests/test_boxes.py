@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from benchmarks.bench_boxes import make_detections, reference_giou, reference_iou_matrix, reference_nms, reference_wbf
+from utils.boxes import (
+    batched_nms,
+    box_giou,
+    box_iou,
+    letterbox_boxes,
+    non_max_suppression,
+    unletterbox_boxes,
+    weighted_box_fusion,
+    xywhn_to_xyxy,
+    xyxy_to_xywhn,
+)
+from utils.evaluate import compute_iou
+
+METAS = [
+    {"original_shape": (720, 1280), "scale": 0.5, "padding": (0, 140)},
+    {"original_shape": (3000, 4000), "scale": 0.16, "padding": (0, 80)},
+]
+
+
+def random_xywhn(n=50, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(0.1, 0.9, (n, 2)), rng.uniform(0.01, 0.3, (n, 2))])
+
+
+def test_box_iou_and_giou_match_scalar_formulas():
+    boxes1, _, _ = make_detections(60, 1, seed=1)
+    boxes2, _, _ = make_detections(45, 1, seed=2)
+    iou = box_iou(boxes1, boxes2)
+    giou = box_giou(boxes1, boxes2)
+    for i in range(len(boxes1)):
+        for j in range(len(boxes2)):
+            assert iou[i, j] == compute_iou(boxes1[i], boxes2[j])
+            assert giou[i, j] == pytest.approx(reference_giou(boxes1[i], boxes2[j]), abs=1e-12)
+    assert np.all(giou <= iou) and np.all(giou >= -1)
+
+
+@pytest.mark.parametrize("n, m", [(1, 7), (300, 300), (1500, 900), (40, 0)])
+def test_box_iou_blocked_path_is_bit_identical(n, m):
+    boxes1, _, _ = make_detections(max(n, 1), 8, seed=3)
+    boxes2, _, _ = make_detections(max(m, 1), 8, seed=4)
+    boxes1, boxes2 = boxes1[:n], boxes2[:m]
+    assert np.array_equal(box_iou(boxes1, boxes2), reference_iou_matrix(boxes1, boxes2))
+
+
+def test_box_iou_batched():
+    boxes1, _, _ = make_detections(60, 1, seed=1)
+    boxes2, _, _ = make_detections(45, 1, seed=2)
+    batched = box_iou(np.stack([boxes1[:40], boxes1[20:60]]), boxes2)
+    assert batched.shape == (2, 40, 45)
+    assert np.array_equal(batched[1], box_iou(boxes1[20:60], boxes2))
+
+
+def test_xywhn_round_trip():
+    xywhn = random_xywhn()
+    xyxy = xywhn_to_xyxy(xywhn, 1280, 720)
+    assert np.allclose(xyxy_to_xywhn(xyxy, 1280, 720), xywhn)
+    assert np.allclose(xyxy[:, 2] - xyxy[:, 0], xywhn[:, 2] * 1280)
+
+
+def test_letterbox_round_trip_single_and_batched():
+    xywhn = random_xywhn()
+    for meta in METAS:
+        h, w = meta["original_shape"]
+        boxes = xywhn_to_xyxy(xywhn, w, h)
+        assert np.allclose(unletterbox_boxes(letterbox_boxes(boxes, meta), meta), np.clip(boxes, 0, [w, h, w, h]))
+
+    stacked = np.stack([xywhn_to_xyxy(xywhn, m["original_shape"][1], m["original_shape"][0]) for m in METAS])
+    mapped = letterbox_boxes(stacked, METAS)
+    for i, meta in enumerate(METAS):
+        assert np.allclose(mapped[i], letterbox_boxes(stacked[i], meta))
+    assert np.allclose(unletterbox_boxes(mapped, METAS, clip=False), stacked)
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("threshold", [0.3, 0.45, 0.7])
+def test_nms_matches_previous_implementation(seed, threshold):
+    n = 20 + 60 * seed
+    boxes, scores, class_ids = make_detections(n, 8, seed=seed)
+    for labels in (None, class_ids):
+        for max_det in (n, 25, 1):
+            expected = reference_nms(boxes, scores, threshold, labels, max_det)
+            assert np.array_equal(non_max_suppression(boxes, scores, threshold, labels, max_det), expected)
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("threshold", [0.3, 0.55])
+def test_wbf_matches_previous_implementation(seed, threshold):
+    boxes, scores, class_ids = make_detections(20 + 37 * seed, 8, seed=seed)
+    actual = weighted_box_fusion(boxes, scores, class_ids, threshold)
+    expected = reference_wbf(boxes, scores, class_ids, threshold)
+    for a, b in zip(actual, expected):
+        assert a.shape == b.shape and np.allclose(a, b)
+
+
+def test_batched_nms_matches_per_image():
+    batch = [make_detections(120, 8, seed=100 + i) for i in range(4)]
+    boxes, scores, class_ids = (np.stack([b[i] for b in batch]) for i in range(3))
+    valid = scores > 0.4
+    for i, keep in enumerate(batched_nms(boxes, scores, 0.45, class_ids, 50, valid=valid)):
+        idx = np.flatnonzero(valid[i])
+        assert np.array_equal(keep, idx[non_max_suppression(boxes[i, idx], scores[i, idx], 0.45, class_ids[i, idx], 50)])
+
+
+def test_empty_inputs():
+    assert non_max_suppression(np.zeros((0, 4)), np.zeros(0)).shape == (0,)
+    fused = weighted_box_fusion(np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=np.int64))
+    assert [a.shape for a in fused] == [(0, 4), (0,), (0,)]
+
+
+
+def test_wbf_zero_score_cluster_is_plain_mean():
+    boxes = np.array([[10, 10, 50, 50], [12, 12, 52, 52], [200, 200, 240, 240], [202, 202, 242, 242]], dtype=np.float64)
+    scores = np.array([0.0, 0.0, 0.9, 0.3])
+    fused_boxes, fused_scores, _ = weighted_box_fusion(boxes, scores, np.zeros(4, dtype=np.int64))
+    assert np.isfinite(fused_boxes).all()
+    assert np.allclose(fused_boxes[1], [11, 11, 51, 51])
+    assert np.allclose(fused_boxes[0], (0.9 * boxes[2] + 0.3 * boxes[3]) / 1.2)
+    assert np.allclose(fused_scores, [0.6, 0.0])
@@ -0,0 +1,34 @@
+import cv2
+import numpy as np
+import yaml
+
+from utils.dataset_index import print_report, validate_dataset
+
+
+def test_missing_val_directory_is_reported_not_raised(tmp_path, capsys):
+    root = tmp_path / "dataset"
+    (root / "images" / "train").mkdir(parents=True)
+    (root / "labels" / "train").mkdir(parents=True)
+    for i in range(3):
+        cv2.imwrite(str(root / "images" / "train" / f"leaf_{i}.jpg"), np.full((40, 60, 3), 90, np.uint8))
+        (root / "labels" / "train" / f"leaf_{i}.txt").write_text("1 0.5 0.5 0.2 0.2\n")
+    data_yaml = root / "data.yaml"
+    data_yaml.write_text(yaml.safe_dump({
+        "path": str(root), "train": "images/train", "val": "images/val", "names": ["early_leaf_spot", "late_leaf_spot"],
+    }))
+
+    report = validate_dataset(str(data_yaml), cache_dir=str(tmp_path / "cache"), workers=1)
+    assert report["missing_splits"] == {"val": str(root / "images" / "val")}
+    assert report["splits"] == {"train": {"images": 3, "boxes": 3, "background": 0}}
+    assert not report["errors"]
+
+    print_report(report)
+    assert "val split not found" in capsys.readouterr().out
+
+    # The val directory appearing later is picked up on the next run
+    (root / "images" / "val").mkdir()
+    cv2.imwrite(str(root / "images" / "val" / "leaf_9.jpg"), np.full((40, 60, 3), 90, np.uint8))
+    report = validate_dataset(str(data_yaml), cache_dir=str(tmp_path / "cache"), workers=1)
+    assert report["missing_splits"] == {}
+    assert report["splits"]["val"]["images"] == 1
+    assert report["scan"] == {"reused": 3, "scanned": 1, "removed": 0}
@@ -0,0 +1,223 @@
+import json
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmarks.bench_evaluate import make_dense_scenes, reference_evaluate_detections
+from utils import evaluate
+from utils.boxes import xyxy_to_xywhn
+from utils.evaluate import (
+    AP_METHODS,
+    COCO_IOU_THRESHOLDS,
+    IncrementalEvaluator,
+    compute_iou,
+    evaluate_detections,
+    evaluate_pairs,
+    iter_yolo_txt_pairs,
+    match_detections,
+    read_yolo_txt,
+    save_evaluation,
+)
+
+WIDTH, HEIGHT = 640, 480
+
+
+def reference_match(predictions, ground_truths, thresholds):
+    """
+    Per-pair greedy matching: predictions by descending score with ties in
+    input order, each taking the unmatched same-class GT of highest IoU
+    (first index on ties). Returns labels, scores and (N, T) TP flags in
+    the order of match_detections.
+    """
+    labels, scores, tp = [], [], []
+    for pred, gt in zip(predictions, ground_truths):
+        matched = [set() for _ in thresholds]
+        for det in np.argsort(-np.asarray(pred["scores"], dtype=np.float64), kind="stable"):
+            labels.append(pred["labels"][det])
+            scores.append(pred["scores"][det])
+            row = []
+            for t, threshold in enumerate(thresholds):
+                best_iou, best_gt = 0.0, -1
+                for g, (box, label) in enumerate(zip(gt["boxes"], gt["labels"])):
+                    if label != pred["labels"][det] or g in matched[t]:
+                        continue
+                    iou = compute_iou(np.asarray(pred["boxes"][det]), np.asarray(box))
+                    if iou > best_iou:
+                        best_iou, best_gt = iou, g
+                hit = best_gt >= 0 and best_iou >= threshold
+                if hit:
+                    matched[t].add(best_gt)
+                row.append(hit)
+            tp.append(row)
+    return np.array(labels), np.array(scores), np.array(tp, dtype=bool).reshape(-1, len(thresholds))
+
+
+def tied_scenes(n_images, seed):
+    """Dense scenes with coarse scores and duplicated GT boxes, so ties are common."""
+    predictions, ground_truths = make_dense_scenes(n_images, 30, seed=seed)
+    rng = np.random.default_rng(seed)
+    for pred, gt in zip(predictions, ground_truths):
+        pred["scores"] = np.round(pred["scores"], 1).tolist()
+        dup = rng.random(len(gt["labels"])) < 0.2
+        gt["boxes"] = gt["boxes"] + [box for box, d in zip(gt["boxes"], dup) if d]
+        gt["labels"] = gt["labels"] + [label for label, d in zip(gt["labels"], dup) if d]
+        # Exact copies of some predictions compete for the same GT
+        copies = np.flatnonzero(rng.random(len(pred["scores"])) < 0.2)
+        for key in ("boxes", "scores", "labels"):
+            pred[key] = pred[key] + [pred[key][i] for i in copies]
+    return predictions, ground_truths
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_matching_equals_reference_greedy_matcher(seed):
+    predictions, ground_truths = tied_scenes(20, seed)
+    thresholds = [0.3, 0.5, 0.75]
+    matches = match_detections(predictions, ground_truths, thresholds)
+    labels, scores, tp = reference_match(predictions, ground_truths, thresholds)
+    assert np.array_equal(matches["det_labels"], labels)
+    assert np.array_equal(matches["det_scores"], scores)
+    assert np.array_equal(matches["det_tp"], tp)
+
+
+def test_tie_break_keeps_input_order():
+    gt = {"boxes": [[0, 0, 10, 10], [0, 0, 10, 10]], "labels": [0, 0]}
+    pred = {"boxes": [[0, 0, 10, 9], [0, 0, 10, 10], [0, 0, 10, 10]], "scores": [0.5, 0.5, 0.5], "labels": [0, 0, 0]}
+    matches = match_detections([pred], [gt], 0.95)
+    # Equal scores: input order; the third prediction finds both GTs taken
+    assert matches["det_tp"][:, 0].tolist() == [False, True, True]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_evaluate_detections_equals_reference_loop(seed):
+    predictions, ground_truths = make_dense_scenes(40, 40, seed=seed)
+    assert evaluate_detections(predictions, ground_truths) == reference_evaluate_detections(predictions, ground_truths)
+
+
+@pytest.mark.parametrize("ap_method", AP_METHODS)
+def test_multi_threshold_ap_equals_single_threshold_runs(ap_method):
+    predictions, ground_truths = make_dense_scenes(40, 40, seed=7)
+    multi = evaluate_detections(predictions, ground_truths, iou_thresholds=COCO_IOU_THRESHOLDS, ap_method=ap_method)
+    assert multi["iou_thresholds"] == pytest.approx(list(COCO_IOU_THRESHOLDS))
+    for t, threshold in enumerate(COCO_IOU_THRESHOLDS):
+        single = evaluate_detections(predictions, ground_truths, iou_threshold=threshold, ap_method=ap_method)
+        assert multi["mAP_per_threshold"][t] == single["mAP@0.5"]
+        for name, metrics in single["per_class"].items():
+            if "n_ground_truth" in metrics:
+                assert multi["per_class"][name]["AP_per_threshold"][t] == metrics["AP"]
+    assert multi["mAP@0.5"] == multi["mAP_per_threshold"][0]
+    assert multi["mAP@0.5:0.95"] == pytest.approx(np.mean(multi["mAP_per_threshold"]))
+
+
+def write_yolo_dirs(tmp_path, predictions, ground_truths):
+    """Write scenes as YOLO txt dirs; returns the dirs and the pairs as read back."""
+    pred_dir, gt_dir = tmp_path / "pred", tmp_path / "gt"
+    pred_dir.mkdir()
+    gt_dir.mkdir()
+    for i, (pred, gt) in enumerate(zip(predictions, ground_truths)):
+        rows = [f"{label} {' '.join(map(repr, xywhn))}" for label, xywhn
+                in zip(gt["labels"], xyxy_to_xywhn(np.reshape(gt["boxes"], (-1, 4)), WIDTH, HEIGHT).tolist())]
+        (gt_dir / f"{i:04d}.txt").write_text("\n".join(rows))
+        rows = [f"{label} {' '.join(map(repr, xywhn))} {score!r}" for label, xywhn, score
+                in zip(pred["labels"], xyxy_to_xywhn(np.reshape(pred["boxes"], (-1, 4)), WIDTH, HEIGHT).tolist(),
+                       pred["scores"])]
+        if rows:
+            (pred_dir / f"{i:04d}.txt").write_text("\n".join(rows))
+    pairs = []
+    for i in range(len(predictions)):
+        gt = read_yolo_txt(gt_dir / f"{i:04d}.txt")
+        del gt["scores"]
+        pairs.append((read_yolo_txt(pred_dir / f"{i:04d}.txt"), gt))
+    return pred_dir, gt_dir, pairs
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 256])
+def test_incremental_evaluator_equals_single_pass(batch_size):
+    predictions, ground_truths = make_dense_scenes(30, 30, seed=3)
+    options = {"iou_thresholds": COCO_IOU_THRESHOLDS, "confusion_iou": 0.45, "curve_points": 21}
+    expected = evaluate_detections(predictions, ground_truths, **options)
+
+    evaluator = IncrementalEvaluator(batch_size=batch_size, **options)
+    for pred, gt in zip(predictions, ground_truths):
+        evaluator.update(pred, gt)
+    assert evaluator.compute() == expected
+
+    # Partial states of disjoint image ranges merge back in order
+    first, second = IncrementalEvaluator(**options), IncrementalEvaluator(batch_size=batch_size, **options)
+    first.update_batch(predictions[:11], ground_truths[:11])
+    for pred, gt in zip(predictions[11:], ground_truths[11:]):
+        second.update(pred, gt)
+    assert first.merge(second).compute() == expected
+
+
+def test_yolo_txt_stream_equals_in_memory(tmp_path):
+    predictions, ground_truths = make_dense_scenes(12, 20, seed=4)
+    predictions[3] = {"boxes": [], "scores": [], "labels": []}
+    pred_dir, gt_dir, pairs = write_yolo_dirs(tmp_path, predictions, ground_truths)
+    expected = evaluate_detections([p for p, _ in pairs], [g for _, g in pairs])
+    assert evaluate_pairs(iter_yolo_txt_pairs(pred_dir, gt_dir)) == expected
+    assert expected["total_ground_truth"] == sum(len(g["labels"]) for g in ground_truths)
+
+
+def run_cli(monkeypatch, tmp_path, *args):
+    out = tmp_path / "results.json"
+    monkeypatch.setattr(sys, "argv", ["evaluate", *map(str, args), "--save", str(out)])
+    evaluate.main()
+    return json.loads(out.read_text())
+
+
+def test_category_offset_flag(tmp_path, monkeypatch, capsys):
+    predictions, ground_truths = make_dense_scenes(6, 20, seed=5)
+    _pred_dir, gt_dir, _pairs = write_yolo_dirs(tmp_path, predictions, ground_truths)
+    images = tmp_path / "images"
+    images.mkdir()
+    rows = []
+    for i, pred in enumerate(predictions):
+        cv2.imwrite(str(images / f"{i:04d}.jpg"), np.zeros((HEIGHT, WIDTH, 3), np.uint8))
+        for box, score, label in zip(pred["boxes"], pred["scores"], pred["labels"]):
+            bbox = [box[0], box[1], box[2] - box[0], box[3] - box[1]]
+            rows.append({"image_id": i, "category_id": label, "bbox": bbox, "score": score})
+    zero_based = tmp_path / "zero.json"
+    zero_based.write_text(json.dumps(rows))
+    one_based = tmp_path / "one.json"
+    one_based.write_text(json.dumps([{**row, "category_id": row["category_id"] + 1} for row in rows]))
+
+    common = ["--labels", gt_dir, "--images", images, "--curve-points", 0]
+    expected = run_cli(monkeypatch, tmp_path, "--pred-json", zero_based, *common)
+    assert expected["mAP@0.5"] > 0.3
+    assert run_cli(monkeypatch, tmp_path, "--pred-json", one_based, "--category-offset", 1, *common) == expected
+    assert run_cli(monkeypatch, tmp_path, "--pred-json", one_based, *common)["mAP@0.5"] < expected["mAP@0.5"]
+    capsys.readouterr()
+
+
+def test_sharded_workers_equal_single_process():
+    predictions, ground_truths = make_dense_scenes(50, 20, seed=6)
+    options = {"iou_thresholds": COCO_IOU_THRESHOLDS, "confusion_iou": 0.45, "curve_points": 11}
+    expected = evaluate_detections(predictions, ground_truths, **options)
+    # Uneven last shard, more shards than workers
+    assert evaluate_detections(predictions, ground_truths, workers=2, shard_size=7, **options) == expected
+    assert evaluate_pairs(zip(predictions, ground_truths), workers=2, shard_size=7, **options) == expected
+
+
+def test_confusion_matrix_background_row_and_column(tmp_path):
+    gt = {"boxes": [[0, 0, 10, 10], [20, 20, 30, 30], [40, 40, 50, 50]], "labels": [0, 2, 1]}
+    pred = {
+        "boxes": [[0, 0, 10, 10], [60, 60, 70, 70], [80, 80, 90, 90], [40, 40, 50, 50], [40, 40, 50, 51]],
+        "scores": [0.9, 0.8, 0.1, 0.5, 0.6],
+        "labels": [1, 0, 2, 1, 2],
+    }
+    results = evaluate_detections([pred], [gt], num_classes=3, class_names=["a", "b", "c"], confusion_iou=0.45)
+    confusion = results["confusion_matrix"]
+    assert confusion["labels"] == ["a", "b", "c", "background"]
+    assert confusion["matrix"] == [
+        [0, 1, 0, 0],  # a predicted as b
+        [0, 1, 0, 0],  # b found by the exact box
+        [0, 0, 0, 1],  # c missed: background column
+        [1, 0, 1, 0],  # confident false positives: background row (the 0.1 score is below conf)
+    ]
+
+    save_evaluation(results, tmp_path / "results.npz")
+    saved = np.load(tmp_path / "results.npz")
+    assert saved["confusion_matrix"].tolist() == confusion["matrix"]
+    assert saved["confusion_labels"].tolist() == confusion["labels"]
@@ -0,0 +1,21 @@
+import os
+
+import pytest
+
+from benchmarks.bench_import import CHECKS, run_importtime
+
+
+@pytest.mark.parametrize("name, command, forbidden, budgeted", CHECKS, ids=[check[0] for check in CHECKS])
+def test_cli_paths_do_not_import_heavy_modules(name, command, forbidden, budgeted):
+    _wall, _total_ms, modules, _top_level = run_importtime(command)
+    assert not sorted(m for m in forbidden if m in modules), f"{name} imports heavy modules"
+
+
+@pytest.mark.skipif(not os.environ.get("PEANUTGUARD_IMPORT_BUDGET_MS"),
+                    reason="set PEANUTGUARD_IMPORT_BUDGET_MS to check import time")
+def test_help_import_time_within_budget():
+    budget_ms = float(os.environ["PEANUTGUARD_IMPORT_BUDGET_MS"])
+    name, command, _forbidden, _budgeted = CHECKS[0]
+    # Fastest of three runs, as in benchmarks/bench_import.py
+    total_ms = min(run_importtime(command)[1] for _ in range(3))
+    assert total_ms <= budget_ms, f"{name} import time {total_ms:.1f} ms > {budget_ms:.0f} ms"
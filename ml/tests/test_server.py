@@ -0,0 +1,112 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils import instrumentation
+from utils.server import InferenceClient, InferenceServer
+
+DETECTION = {
+    "class_id": 1,
+    "class": "late_leaf_spot",
+    "scientific_name": "Nothopassalora personata",
+    "category": "fungal",
+    "severity_range": [1, 9],
+    "confidence": 0.9,
+    "box": [1.0, 2.0, 3.0, 4.0],
+}
+
+
+def stub_infer(image):
+    return [{**DETECTION, "box": [0.0, 0.0, float(image.shape[1]), float(image.shape[0])]}]
+
+
+@pytest.fixture(params=["tcp", "unix"])
+def served(request, tmp_path):
+    if request.param == "tcp":
+        server = InferenceServer(stub_infer, port=0, max_body_bytes=1 << 16)
+        client = InferenceClient(server.address)
+    else:
+        path = str(tmp_path / "server.sock")
+        server = InferenceServer(stub_infer, unix_socket=path, max_body_bytes=1 << 16)
+        client = InferenceClient(unix_socket=path)
+    instrumentation.enable()
+    server.start_background()
+    yield server, client
+    server.shutdown()
+    server.httpd.server_close()
+    instrumentation.disable()
+    instrumentation.reset()
+
+
+def jpeg(width=64, height=48):
+    ok, buf = cv2.imencode(".jpg", np.full((height, width, 3), 90, np.uint8))
+    return buf.tobytes()
+
+
+def send(conn, method, path, body=b"", content_length=None):
+    """One request on an open connection with an explicit Content-Length."""
+    conn.putrequest(method, path)
+    if content_length is not None:
+        conn.putheader("Content-Length", content_length)
+    conn.endheaders(body)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def test_predict_health_and_metrics(served):
+    server, client = served
+    result = client.predict_bytes(jpeg())
+    assert set(result) == {"detections", "cached", "timing_ms"}
+    assert result["detections"] == [{**DETECTION, "box": [0.0, 0.0, 64.0, 48.0]}]
+    assert result["cached"] is False
+    assert set(result["timing_ms"]) == {"decode", "inference", "total"}
+
+    health = client.health()
+    assert health["status"] == "ok" and health["requests"] == 1 and health["errors"] == 0
+    assert "peanutguard_server_inference" in client.metrics()
+
+
+def test_bad_requests_get_client_errors(served):
+    server, client = served
+    with pytest.raises(RuntimeError, match="400"):
+        client.predict_bytes(b"not an image")
+    # The server answers oversized and unparseable lengths without reading a body
+    for content_length, expected in ((str(server.max_body_bytes + 1), 413), ("abc", 400), ("-5", 400), ("0", 400)):
+        conn = client._connection()
+        try:
+            status, _ = send(conn, "POST", "/predict", content_length=content_length)
+        finally:
+            conn.close()
+        assert status == expected
+    assert client.health()["status"] == "ok"
+
+
+def test_connection_is_reusable_after_error_responses(served):
+    _server, client = served
+    conn = client._connection()
+    try:
+        # Errors before the body was read drain it, so the next request parses cleanly
+        assert send(conn, "POST", "/unknown", b"leftover body", "13")[0] == 404
+        assert send(conn, "POST", "/predict", b"", "0")[0] == 400
+        assert send(conn, "POST", "/predict", b"garbage", "7")[0] == 400
+        assert send(conn, "GET", "/health")[0] == 200
+        status, _ = send(conn, "POST", "/predict", jpeg(), str(len(jpeg())))
+        assert status == 200
+    finally:
+        conn.close()
+
+
+def test_unparseable_length_closes_the_connection(served):
+    _server, client = served
+    conn = client._connection()
+    try:
+        conn.putrequest("POST", "/predict")
+        conn.putheader("Content-Length", "12abc")
+        conn.endheaders(b"12abc bytes!")
+        response = conn.getresponse()
+        assert response.status == 400
+        assert response.getheader("Connection") == "close"
+        response.read()
+    finally:
+        conn.close()
+    assert client.health()["status"] == "ok"
@@ -0,0 +1,89 @@
+import os
+from pathlib import Path
+
+from utils.split import read_existing, split_dataset
+
+
+def make_corpus(root: Path, names):
+    """Empty image files plus one-line YOLO labels under root/images."""
+    for name in names:
+        image = root / "images" / name
+        label = (root / "labels" / name).with_suffix(".txt")
+        image.parent.mkdir(parents=True, exist_ok=True)
+        label.parent.mkdir(parents=True, exist_ok=True)
+        image.write_bytes(b"")
+        label.write_text("0 0.5 0.5 0.1 0.1\n")
+
+
+def image_links(out: Path):
+    return sorted(p for p in (out / "images").rglob("*") if p.is_symlink())
+
+
+def test_symlinks_keep_duplicate_basenames_apart(tmp_path):
+    names = [f"field_{f}/img_{i}.jpg" for f in range(3) for i in range(4)]
+    make_corpus(tmp_path / "raw", names)
+    out = tmp_path / "dataset"
+
+    summary = split_dataset(str(tmp_path / "raw" / "images"), str(out), stratify=True)
+    assert sum(summary["images"].values()) == 12
+    assert summary["linked"] == 12 and summary["conflicts"] == 0
+
+    links = image_links(out)
+    assert len(links) == 12
+    assert len({os.path.realpath(p) for p in links}) == 12
+    for link in links:
+        split, *rest = link.relative_to(out / "images").parts
+        relative = Path(*rest)
+        assert os.path.realpath(link) == str((tmp_path / "raw" / "images" / relative).resolve())
+        label = out / "labels" / split / relative.with_suffix(".txt")
+        assert label.is_symlink() and label.read_text().startswith("0 ")
+    assert len(read_existing(str(out))) == 12
+
+    rerun = split_dataset(str(tmp_path / "raw" / "images"), str(out), stratify=True)
+    assert rerun["unchanged"] == 12 and rerun["linked"] == 0 and rerun["removed"] == 0
+
+
+def test_real_file_in_the_way_is_a_conflict(tmp_path):
+    make_corpus(tmp_path / "raw", ["a/x.jpg", "b/x.jpg"])
+    out = tmp_path / "dataset"
+    for split in ("train", "val", "test"):
+        for sub in ("a", "b"):
+            (out / "images" / split / sub).mkdir(parents=True, exist_ok=True)
+            (out / "images" / split / sub / "x.jpg").write_bytes(b"real")
+
+    summary = split_dataset(str(tmp_path / "raw" / "images"), str(out))
+    assert summary["conflicts"] == 2 and summary["linked"] == 0
+    assert not image_links(out)
+
+
+def test_list_mode_splits_are_readable_downstream(tmp_path):
+    import cv2
+    import numpy as np
+    import yaml
+
+    from utils.dataset_index import validate_dataset
+    from utils.quantize import resolve_split
+    from utils.tensor_cache import find_images
+
+    names = [f"field_{f}/img_{i}.jpg" for f in range(2) for i in range(5)]
+    make_corpus(tmp_path / "raw", names)
+    for name in names:
+        cv2.imwrite(str(tmp_path / "raw" / "images" / name), np.full((32, 48, 3), 128, np.uint8))
+    out = tmp_path / "dataset"
+    summary = split_dataset(str(tmp_path / "raw" / "images"), str(out), mode="list")
+
+    data_yaml = out / "data.yaml"
+    data_yaml.write_text(yaml.safe_dump({
+        "path": str(out), "train": "train.txt", "val": "val.txt", "test": "test.txt", "names": {0: "leaf_spot"},
+    }))
+    report = validate_dataset(str(data_yaml), cache_dir=str(tmp_path / "cache"), workers=1)
+    assert report["images"] == 10
+    assert {split: stats["images"] for split, stats in report["splits"].items()} == {
+        split: count for split, count in summary["images"].items() if count
+    }
+    assert not report["errors"] and not report["orphan_labels"]
+    assert sum(stats["boxes"] for stats in report["classes"].values()) == 10
+
+    train_list, class_names = resolve_split(str(data_yaml), "train")
+    assert class_names == ["leaf_spot"]
+    assert len(find_images([train_list])) == summary["images"]["train"]
@@ -0,0 +1,84 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.streaming import Checkpoint, JsonlSink, ParquetSink, iter_source, run_stream
+
+
+def fake_infer(items):
+    """One detection per image, sized by its mean; raises on undecodable files."""
+    detections = []
+    for item in items:
+        image = cv2.imread(item)
+        if image is None:
+            raise ValueError(f"Cannot load image: {item}")
+        detections.append([{"class_id": 0, "confidence": float(image.mean() / 255), "box": [0.0, 0.0, 1.0, 1.0]}])
+    return detections
+
+
+def make_source(directory, n=7, corrupt=(3,)):
+    directory.mkdir()
+    for i in range(n):
+        path = directory / f"img_{i:02d}.jpg"
+        if i in corrupt:
+            path.write_bytes(b"\xff\xd8 corrupt")
+        else:
+            cv2.imwrite(str(path), np.full((16, 16, 3), 10 * i, np.uint8))
+    return directory
+
+
+def run(source, output, batch_size=2, on_batch=None):
+    checkpoint = Checkpoint(str(output) + ".ckpt")
+    sink = JsonlSink(str(output), checkpoint.position)
+    return run_stream(iter_source(str(source), done=checkpoint.done), fake_infer, sink, checkpoint,
+                      batch_size=batch_size, on_batch=on_batch)
+
+
+def test_corrupt_image_gets_error_record_and_resume_finishes(tmp_path):
+    source = make_source(tmp_path / "images")
+    output = tmp_path / "out.jsonl"
+
+    # First run stops after two batches (e.g. the process is killed)
+    seen = []
+
+    def stop_after_two(keys, items, dets):
+        seen.append(keys)
+        if len(seen) == 2:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        run(source, output, on_batch=stop_after_two)
+    # The corrupt image shares the second batch; good items still reach on_batch
+    assert [len(keys) for keys in seen] == [2, 1]
+
+    stats = run(source, output)
+    assert stats["errors"] == 1
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(r["source"] for r in records) == sorted(str(p) for p in source.glob("*.jpg"))
+    errors = [r for r in records if "error" in r]
+    assert [r["source"] for r in errors] == [str(source / "img_03.jpg")]
+    assert "Cannot load image" in errors[0]["error"] and errors[0]["detections"] == []
+
+    # Nothing is left to do, and the failed image is not retried
+    stats = run(source, output)
+    assert stats["images"] == 0
+    assert len(output.read_text().splitlines()) == 7
+
+
+def test_single_item_batches_and_parquet_error_column(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    source = make_source(tmp_path / "images", n=4, corrupt=(0, 2))
+    checkpoint = Checkpoint(str(tmp_path / "out.parquet.ckpt"))
+    sink = ParquetSink(str(tmp_path / "out.parquet"), checkpoint.position, rows_per_file=3)
+    stats = run_stream(iter_source(str(source)), fake_infer, sink, checkpoint, batch_size=1)
+    assert stats["images"] == 4 and stats["errors"] == 2
+
+    table = pa.concat_tables([pq.read_table(p) for p in sorted((tmp_path / "out.parquet").glob("part-*.parquet"))])
+    rows = {row["source"]: row for row in table.to_pylist()}
+    assert rows[str(source / "img_00.jpg")]["error"].startswith("ValueError")
+    assert rows[str(source / "img_01.jpg")]["error"] is None
+    assert len(rows[str(source / "img_01.jpg")]["detections"]) == 1
@@ -0,0 +1,28 @@
+import pytest
+
+from utils.sweep import SWEEP_DEFAULTS, run_sweep
+
+
+def test_reused_sweep_name_is_refused(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    script = tmp_path / "fake_train.py"
+    script.write_text("")
+    sweep = {**SWEEP_DEFAULTS, "method": "grid", "epochs": 2, "space": {"training.learning_rate": [0.01]}}
+    config = {"training": {"workers": 1}}
+    sweep_dir = tmp_path / "runs" / "sweeps" / "lr"
+
+    board = run_sweep(sweep, config, str(sweep_dir), script=str(script))
+    assert [trial["status"] for trial in board] == ["complete"]
+    db = sweep_dir / "trials.sqlite"
+    before = db.read_bytes()
+
+    with pytest.raises(FileExistsError, match="not empty"):
+        run_sweep(sweep, config, str(sweep_dir), script=str(script))
+    assert db.read_bytes() == before
+    assert sorted(p.name for p in sweep_dir.iterdir() if p.suffix == ".yaml") == ["sweep.yaml", "trial_000.yaml"]
+
+    # Leftover trial weights under runs/detect block the name as well
+    (tmp_path / "runs" / "detect" / "sweeps" / "old" / "trial_000").mkdir(parents=True)
+    with pytest.raises(FileExistsError):
+        run_sweep(sweep, config, str(tmp_path / "runs" / "sweeps" / "old"), script=str(script))
+    assert not (tmp_path / "runs" / "sweeps" / "old").exists()
@@ -0,0 +1,75 @@
+import os
+
+import cv2
+import numpy as np
+
+from utils.preprocess import load_image, resize_with_padding
+from utils.tensor_cache import TensorCache
+
+
+def write_images(directory, n, shape=(30, 50, 3)):
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(n):
+        path = directory / f"img_{i}.jpg"
+        cv2.imwrite(str(path), np.full(shape, 20 * i, np.uint8))
+        paths.append(str(path))
+    return paths
+
+
+def test_corrupt_image_is_skipped_and_index_saved(tmp_path):
+    paths = write_images(tmp_path / "images", 4)
+    corrupt = tmp_path / "images" / "corrupt.jpg"
+    corrupt.write_bytes(b"\xff\xd8 not a jpeg")
+    cache = TensorCache(str(tmp_path / "cache"), target_size=32)
+
+    counts = cache.update(sorted(paths + [str(corrupt)]), workers=2)
+    assert counts["added"] == 4 and counts["failed"] == 1
+    assert list(cache.failed) == [str(corrupt)]
+    assert cache.get(str(corrupt)) is None
+    assert all(cache.get(p) is not None for p in paths)
+
+    # The index on disk matches: a fresh instance serves the same entries
+    reopened = TensorCache(str(tmp_path / "cache"), target_size=32)
+    assert len(reopened) == 4
+    canvas, metadata = reopened.get(paths[2])
+    assert canvas.shape == (32, 32, 3) and metadata["original_shape"] == (30, 50)
+
+
+def test_deleted_file_is_a_miss(tmp_path):
+    paths = write_images(tmp_path / "images", 3)
+    cache = TensorCache(str(tmp_path / "cache"), target_size=32)
+    cache.update(paths, workers=1)
+
+    os.remove(paths[1])
+    assert cache.get(paths[1]) is None
+    assert paths[1] not in cache
+    assert cache.get(paths[0]) is not None
+
+    counts = cache.update(paths, workers=1)
+    assert counts == {"reused": 2, "rebuilt": 0, "added": 0, "failed": 1}
+    assert len(TensorCache(str(tmp_path / "cache"), target_size=32)) == 2
+
+
+def test_slots_of_dropped_images_are_reused(tmp_path):
+    paths = write_images(tmp_path / "images", 4)
+    corrupt = tmp_path / "images" / "corrupt.jpg"
+    corrupt.write_bytes(b"\xff\xd8 not a jpeg")
+    cache = TensorCache(str(tmp_path / "cache"), target_size=32)
+    cache.update(sorted(paths + [str(corrupt)]), workers=2)
+    assert cache.capacity == 5
+
+    # The corrupt image's slot and a deleted image's slot go to new images
+    os.remove(paths[1])
+    extra = write_images(tmp_path / "more", 3, shape=(40, 20, 3))
+    counts = cache.update(sorted(paths + extra), workers=2)
+    assert counts == {"reused": 3, "rebuilt": 0, "added": 3, "failed": 1}
+    assert cache.capacity == 6
+    slots = sorted(entry["slot"] for entry in cache.entries.values())
+    assert slots == list(range(6))
+    for path in extra:
+        canvas, metadata = cache.get(path)
+        assert metadata["original_shape"] == (40, 20)
+        expected, _, _ = resize_with_padding(load_image(path), 32)
+        assert np.array_equal(canvas, expected)
+    assert os.path.getsize(cache.blob_path) == 6 * 32 * 32 * 3
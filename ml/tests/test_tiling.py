@@ -0,0 +1,28 @@
+import cv2
+import numpy as np
+
+from utils.tiling import TiledDetector
+
+
+def test_tiles_are_run_in_chunks_of_max_batch():
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 255, (1500, 2100, 3), dtype=np.uint8), (9, 9), 0)
+    batches = []
+
+    def infer_batch(batch, metadata_list):
+        batches.append(batch.shape)
+        # One box per input whose size and class depend on its pixels
+        means = batch.mean(axis=(1, 2, 3))
+        return [(np.array([[10, 10, 60 + v * 50, 80]]), np.array([v]), np.array([int(v * 10) % 3])) for v in means]
+
+    results = []
+    for max_batch in (1, 4, 32):
+        batches.clear()
+        detector = TiledDetector(infer_batch, tile_size=640, max_batch=max_batch)
+        results.append(detector.predict(image))
+        forward_images = detector.last_stats["forward_images"]
+        assert sum(shape[0] for shape in batches) == forward_images == 13
+        assert max(shape[0] for shape in batches) == min(max_batch, forward_images)
+    for result in results[1:]:
+        for actual, expected in zip(result, results[0]):
+            assert np.array_equal(actual, expected)
@@ -10,66 +10,47 @@ Usage:
 
 Requirements:
     pip install ultralytics opencv-python pandas matplotlib scikit-learn
+
+Heavy dependencies (Ultralytics/torch, OpenCV, NumPy, onnxruntime) are
+imported inside the functions that need them, so --help, config checks
+and the ONNX predict path start without loading the training stack.
+benchmarks/bench_import.py checks the import-time budget.
 """
 
+from __future__ import annotations
+
 import argparse
 import os
 import sys
+import threading
 import yaml
 from pathlib import Path
 from datetime import datetime
+from typing import TYPE_CHECKING
 
-try:
-    from ultralytics import YOLO
-    import cv2
+from utils import instrumentation
+from utils.config import load_config
+
+if TYPE_CHECKING:
     import numpy as np
-except ImportError:
-    print("Required packages not installed. Run:")
-    print("pip install ultralytics opencv-python numpy")
-    sys.exit(1)
+    from utils.result_cache import PredictionCache
+
+
+def load_yolo():
+    """Import Ultralytics' YOLO class on first use (it pulls in torch)."""
+    try:
+        from ultralytics import YOLO
+    except ImportError:
+        print("Required packages not installed. Run:")
+        print("pip install ultralytics opencv-python numpy")
+        sys.exit(1)
+    return YOLO
 
 
 # ============================================================
-# Configuration
+# Configuration (DEFAULT_CONFIG and load_config: utils/config.py)
 # ============================================================
 
-DEFAULT_CONFIG = {
-    "model": {
-        "architecture": "yolov8n",  # nano variant for edge deployment
-        "pretrained": True,
-        "input_size": 640,
-        "num_classes": 8,
-    },
-    "training": {
-        "epochs": 100,
-        "batch_size": 16,
-        "learning_rate": 0.01,
-        "optimizer": "SGD",
-        "momentum": 0.937,
-        "weight_decay": 0.0005,
-        "warmup_epochs": 3,
-        "patience": 20,  # early stopping patience
-    },
-    "augmentation": {
-        "hsv_h": 0.015,
-        "hsv_s": 0.7,
-        "hsv_v": 0.4,
-        "degrees": 10.0,
-        "translate": 0.1,
-        "scale": 0.5,
-        "fliplr": 0.5,
-        "flipud": 0.0,
-        "mosaic": 1.0,
-        "mixup": 0.1,
-    },
-    "dataset": {
-        "path": "dataset/data.yaml",
-        "train_split": 0.8,
-        "val_split": 0.1,
-        "test_split": 0.1,
-    },
-}
-
 # Class definitions matching our detection system
 CLASS_NAMES = [
     "early_leaf_spot",      # Cercospora arachidicola
@@ -130,27 +111,30 @@ CLASS_INFO = {
 # Training Pipeline
 # ============================================================
 
-def load_config(config_path: str = None) -> dict:
-    """Load training configuration from YAML or use defaults."""
-    if config_path and os.path.exists(config_path):
-        with open(config_path, 'r') as f:
-            user_config = yaml.safe_load(f)
-        # Merge with defaults
-        config = DEFAULT_CONFIG.copy()
-        for key in user_config:
-            if isinstance(user_config[key], dict) and key in config:
-                config[key].update(user_config[key])
-            else:
-                config[key] = user_config[key]
-        return config
-    return DEFAULT_CONFIG
-
-
-def setup_dataset(config: dict) -> str:
-    """Verify dataset structure and return data.yaml path."""
+def setup_dataset(config: dict, validate: bool = True) -> str:
+    """
+    Verify dataset structure and return data.yaml path.
+    
+    With validate, every image and label is checked (see
+    utils/dataset_index.py) before training starts; only files changed
+    since the last run are rescanned. Errors abort the run.
+    """
     data_yaml = config["dataset"]["path"]
     
-    if not os.path.exists(data_yaml):
+    if os.path.exists(data_yaml) and validate:
+        from utils.dataset_index import print_report, read_data_yaml, validate_dataset
+        
+        _root, _splits, yaml_names = read_data_yaml(data_yaml)
+        if yaml_names != CLASS_NAMES:
+            print(f"Warning: class names in {data_yaml} differ from CLASS_NAMES")
+        report = validate_dataset(data_yaml, class_names=CLASS_NAMES)
+        print_report(report)
+        if report["errors"]:
+            print(f"\nDataset has errors in {len(report['errors'])} image(s); fix them "
+                  "or rerun with --no-validate")
+            sys.exit(1)
+        print()
+    elif not os.path.exists(data_yaml):
         print(f"Warning: Dataset config not found at {data_yaml}")
         print("Creating template data.yaml...")
         
@@ -187,6 +171,9 @@ def preprocess_image(image_path: str, target_size: int = 640) -> np.ndarray:
     3. Pad to square
     4. Normalize pixel values to [0, 1]
     """
+    import cv2
+    import numpy as np
+    
     img = cv2.imread(image_path)
     if img is None:
         raise ValueError(f"Failed to read image: {image_path}")
@@ -209,7 +196,13 @@ def preprocess_image(image_path: str, target_size: int = 640) -> np.ndarray:
     return canvas
 
 
-def train(config: dict, resume: str = None):
+def train(
+    config: dict,
+    resume: str = None,
+    aug_shards: str = None,
+    validate: bool = True,
+    name: str = "peanutguard",
+):
     """
     Main training function.
     
@@ -219,6 +212,16 @@ def train(config: dict, resume: str = None):
     3. Fine-tune on peanut disease dataset
     4. Save best model weights
     5. Generate evaluation metrics
+    
+    With aug_shards (a directory built by utils/aug_shards.py), training
+    samples pre-augmented variants from the shards and online
+    augmentation is switched off; validation is unchanged. validate
+    runs the dataset checks of setup_dataset first. Weights go to
+    runs/detect/<name>.
+    
+    A "sweep" section in config (written by utils/sweep.py into trial
+    configs) reports validation mAP after every epoch and stops the run
+    when successive halving prunes the trial.
     """
     print("=" * 60)
     print("PeanutGuard YOLOv8 Training Pipeline")
@@ -226,9 +229,10 @@ def train(config: dict, resume: str = None):
     print("=" * 60)
     
     # Setup dataset
-    data_yaml = setup_dataset(config)
+    data_yaml = setup_dataset(config, validate=validate)
     
     # Load model
+    YOLO = load_yolo()
     model_arch = config["model"]["architecture"]
     if resume:
         print(f"Resuming training from: {resume}")
@@ -236,12 +240,30 @@ def train(config: dict, resume: str = None):
     else:
         print(f"Loading pretrained {model_arch} model...")
         model = YOLO(f"{model_arch}.pt")
+    if "sweep" in config:
+        from utils.sweep import make_pruning_callback
+        
+        model.add_callback("on_fit_epoch_end", make_pruning_callback(config["sweep"]))
     
     # Training parameters
     train_config = config["training"]
     aug_config = config["augmentation"]
+    trainer = None
+    if aug_shards:
+        from utils.aug_shards import AugmentedShards, make_shard_trainer
+        
+        shards = AugmentedShards(aug_shards)
+        if shards.target_size != config["model"]["input_size"]:
+            raise ValueError(
+                f"Shards in {aug_shards} are {shards.target_size}px, "
+                f"model input size is {config['model']['input_size']}"
+            )
+        print(f"Sampling from {shards.variants} pre-augmented variants of {len(shards)} images in {aug_shards}")
+        trainer = make_shard_trainer(aug_shards)
+        # Augmentation is already baked into the shards
+        aug_config = {key: 0.0 for key in aug_config}
     
-    print(f"\nTraining Configuration:")
+    print("\nTraining Configuration:")
     print(f"  Epochs:        {train_config['epochs']}")
     print(f"  Batch Size:    {train_config['batch_size']}")
     print(f"  Learning Rate: {train_config['learning_rate']}")
@@ -253,6 +275,7 @@ def train(config: dict, resume: str = None):
     # Start training
     results = model.train(
         data=data_yaml,
+        trainer=trainer,
         epochs=train_config["epochs"],
         batch=train_config["batch_size"],
         imgsz=config["model"]["input_size"],
@@ -262,6 +285,7 @@ def train(config: dict, resume: str = None):
         weight_decay=train_config["weight_decay"],
         warmup_epochs=train_config["warmup_epochs"],
         patience=train_config["patience"],
+        workers=train_config["workers"],
         
         # Augmentation
         hsv_h=aug_config["hsv_h"],
@@ -277,7 +301,7 @@ def train(config: dict, resume: str = None):
         
         # Output
         project="runs/detect",
-        name="peanutguard",
+        name=name,
         exist_ok=True,
         save=True,
         plots=True,
@@ -286,7 +310,7 @@ def train(config: dict, resume: str = None):
     
     print("\n" + "=" * 60)
     print("Training Complete!")
-    print(f"Best model saved to: runs/detect/peanutguard/weights/best.pt")
+    print(f"Best model saved to: runs/detect/{name}/weights/best.pt")
     print("=" * 60)
     
     return results
@@ -295,16 +319,19 @@ def train(config: dict, resume: str = None):
 def evaluate(model_path: str, data_yaml: str):
     """Evaluate trained model on test set."""
     print("Loading model for evaluation...")
-    model = YOLO(model_path)
+    with instrumentation.timer("evaluate.model_load"):
+        model = load_yolo()(model_path)
     
-    results = model.val(
-        data=data_yaml,
-        split="test",
-        imgsz=640,
-        batch=16,
-        plots=True,
-        save_json=True,
-    )
+    with instrumentation.timer("evaluate.val"):
+        results = model.val(
+            data=data_yaml,
+            split="test",
+            imgsz=640,
+            batch=16,
+            plots=True,
+            save_json=True,
+        )
+    record_ultralytics_speed([results], prefix="ultralytics.val")
     
     print("\nEvaluation Results:")
     print(f"  mAP@0.5:      {results.box.map50:.3f}")
@@ -315,47 +342,483 @@ def evaluate(model_path: str, data_yaml: str):
     return results
 
 
-def predict(model_path: str, image_path: str):
-    """Run inference on a single image."""
-    model = YOLO(model_path)
+def make_detection(cls_id: int, confidence: float, box: list) -> dict:
+    """Build the detection dict predict prints, with CLASS_INFO fields."""
+    class_name = CLASS_NAMES[cls_id]
+    info = CLASS_INFO[class_name]
+    return {
+        "class_id": cls_id,
+        "class": class_name,
+        "scientific_name": info["scientific_name"],
+        "category": info["category"],
+        "severity_range": info["severity_range"],
+        "confidence": confidence,
+        "box": box,
+    }
+
+
+def record_ultralytics_speed(results, prefix: str = "ultralytics"):
+    """Record Ultralytics' own per-image preprocess/inference/postprocess times."""
+    if instrumentation.is_enabled():
+        for result in results:
+            for stage, ms in (getattr(result, "speed", None) or {}).items():
+                instrumentation.observe_seconds(f"{prefix}.{stage}", ms / 1000)
+
+
+def results_to_detections(results) -> list:
+    """Convert Ultralytics results to the detection dicts predict prints."""
+    detections = []
+    for result in results:
+        for box in result.boxes:
+            detections.append(make_detection(int(box.cls[0]), float(box.conf[0]), box.xyxy[0].tolist()))
+    return detections
+
+
+def arrays_to_detections(boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray) -> list:
+    """Convert OnnxDetector (boxes, scores, class_ids) arrays to detection dicts."""
+    return [
+        make_detection(int(cls_id), float(score), box.tolist())
+        for box, score, cls_id in zip(boxes, scores, class_ids)
+    ]
+
+
+def print_detections(detections: list):
+    """Print detections in the predict report format."""
+    for det in detections:
+        print(f"\nDetected: {det['class']}")
+        print(f"  Scientific Name: {det['scientific_name']}")
+        print(f"  Category:        {det['category']}")
+        print(f"  Confidence:      {det['confidence']:.2%}")
+        print(f"  Bounding Box:    {det['box']}")
+
+
+def predict(
+    model_path: str,
+    image_path: str,
+    imgsz: int = 640,
+    conf: float = 0.25,
+    iou: float = 0.45,
+    cache: PredictionCache = None,
+    backend: str = "ultralytics",
+    tiling: dict = None,
+) -> list:
+    """
+    Run inference on a single image.
     
-    results = model.predict(
-        source=image_path,
-        imgsz=640,
-        conf=0.25,
-        iou=0.45,
-        save=True,
-        save_txt=True,
+    With a PredictionCache, results are keyed by the image content, the
+    weights file and (imgsz, conf, iou); a repeated image is answered from
+    the cache without loading the model.
+    
+    backend="onnx" runs an exported .onnx model with utils.onnx_engine
+    (NumPy + onnxruntime, no annotated copies saved) instead of Ultralytics.
+    
+    tiling enables sliced inference for high-resolution captures: a dict
+    of utils.tiling.TiledDetector options (overlap, merge, skip_std, ...),
+    with imgsz as the tile size. Annotated copies are not saved.
+    
+    Returns:
+        List of detections (class, CLASS_INFO fields, confidence, box)
+    """
+    instrumentation.count("predict.images")
+    key = None
+    if cache is not None:
+        with instrumentation.timer("predict.cache_lookup"):
+            with open(image_path, "rb") as f:
+                key = cache.make_key(f.read(), model_path, imgsz=imgsz, conf=conf, iou=iou, **(tiling or {}))
+            detections = cache.get(key)
+        if detections is not None:
+            instrumentation.count("predict.cache_hits")
+            print_detections(detections)
+            return detections
+    
+    if tiling is not None:
+        from utils.tiling import TiledDetector
+        
+        with instrumentation.timer("predict.model_load"):
+            if backend == "onnx":
+                from utils.onnx_engine import OnnxDetector
+                infer_batch = OnnxDetector(model_path, conf=conf, iou=iou, imgsz=imgsz).infer
+            else:
+                infer_batch = make_array_infer(load_yolo()(model_path), imgsz, conf, iou)
+        tiled = TiledDetector(infer_batch, tile_size=imgsz, **tiling)
+        with instrumentation.timer("predict.tiled"):
+            detections = arrays_to_detections(*tiled.predict(image_path))
+        stats = tiled.last_stats
+        print(f"Tiled: {stats['tiles']} tiles ({stats['skipped']} skipped), "
+              f"{stats['raw_detections']} detections before merge")
+    elif backend == "onnx":
+        # Slim path: NumPy + onnxruntime only, no Ultralytics/torch import
+        from utils.onnx_engine import OnnxDetector
+        
+        with instrumentation.timer("predict.model_load"):
+            detector = OnnxDetector(model_path, conf=conf, iou=iou, imgsz=imgsz)
+        detections = arrays_to_detections(*detector.predict(image_path))
+    else:
+        with instrumentation.timer("predict.model_load"):
+            model = load_yolo()(model_path)
+        
+        with instrumentation.timer("predict.forward"):
+            results = model.predict(
+                source=image_path,
+                imgsz=imgsz,
+                conf=conf,
+                iou=iou,
+                save=True,
+                save_txt=True,
+            )
+        record_ultralytics_speed(results)
+        
+        with instrumentation.timer("predict.postprocess"):
+            detections = results_to_detections(results)
+    instrumentation.observe("predict.detections", len(detections))
+    if cache is not None:
+        cache.put(key, detections)
+    print_detections(detections)
+    
+    return detections
+
+
+def save_annotated(keys: list, items: list, detections: list, save_dir: str):
+    """Draw detections on each image/frame and write it to save_dir as JPEG."""
+    import cv2
+    import numpy as np
+    
+    os.makedirs(save_dir, exist_ok=True)
+    for key, item, dets in zip(keys, items, detections):
+        image = item.copy() if isinstance(item, np.ndarray) else cv2.imread(item)
+        for det in dets:
+            x1, y1, x2, y2 = (int(round(v)) for v in det["box"])
+            cv2.rectangle(image, (x1, y1), (x2, y2), (0, 0, 255), 2)
+            cv2.putText(image, f"{det['class']} {det['confidence']:.2f}", (x1, max(y1 - 5, 12)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+        name = Path(key.replace("#", "_")).stem + ".jpg"
+        cv2.imwrite(os.path.join(save_dir, name), image)
+
+
+def bulk_predict(
+    model_path: str,
+    source: str,
+    output: str = "runs/predict/detections.jsonl",
+    batch_size: int = 16,
+    imgsz: int = 640,
+    conf: float = 0.25,
+    iou: float = 0.45,
+    backend: str = "ultralytics",
+    vid_stride: int = 1,
+    save_images: bool = False,
+) -> dict:
+    """
+    Predict over a directory, glob or video and stream detections to disk.
+    
+    Results are appended per batch to output (.jsonl file or .parquet
+    directory of part files), one {"source", "detections"} record per
+    image or frame. Progress is checkpointed to <output>.ckpt; rerunning
+    the same command after a crash resumes where it stopped without
+    reprocessing or duplicating finished images. Images that fail to load
+    or predict get a record with an "error" message and are not retried.
+    Annotated copies are only written with save_images (to
+    <output dir>/annotated).
+    
+    Returns:
+        Stats dict (images, detections, errors, elapsed, images_per_sec)
+    """
+    from utils.streaming import Checkpoint, iter_source, open_sink, run_stream
+    
+    checkpoint = Checkpoint(output.rstrip("/") + ".ckpt")
+    if checkpoint.done:
+        print(f"Resuming: {len(checkpoint.done)} items already done")
+    sink = open_sink(output, checkpoint.position)
+    
+    if backend == "onnx":
+        from utils.onnx_engine import OnnxDetector
+        
+        detector = OnnxDetector(model_path, conf=conf, iou=iou, imgsz=imgsz)
+        
+        def infer_batch(items: list) -> list:
+            return [arrays_to_detections(*arrays) for arrays in detector.predict_batch(items)]
+    else:
+        model = load_yolo()(model_path)
+        
+        def infer_batch(items: list) -> list:
+            results = model.predict(
+                source=items, imgsz=imgsz, conf=conf, iou=iou,
+                batch=len(items), stream=True, verbose=False,
+            )
+            detections = []
+            for result in results:
+                record_ultralytics_speed([result])
+                detections.append(results_to_detections([result]))
+            return detections
+    
+    on_batch = None
+    if save_images:
+        save_dir = os.path.join(os.path.dirname(output.rstrip("/")) or ".", "annotated")
+        on_batch = lambda keys, items, dets: save_annotated(keys, items, dets, save_dir)
+    
+    stats = run_stream(
+        iter_source(source, vid_stride, checkpoint.done),
+        infer_batch,
+        sink,
+        checkpoint,
+        batch_size=batch_size,
+        on_batch=on_batch,
     )
+    print(f"Processed {stats['images']} images ({stats['images_per_sec']:.1f} img/s), "
+          f"{stats['detections']} detections -> {output}")
+    if stats["errors"]:
+        print(f"{stats['errors']} image(s) failed; see the records with an \"error\" field")
+    return stats
+
+
+def make_array_infer(model, imgsz: int = 640, conf: float = 0.25, iou: float = 0.45):
+    """
+    Batched Ultralytics forward pass with the OnnxDetector.infer interface.
     
-    for result in results:
-        for box in result.boxes:
-            cls_id = int(box.cls[0])
-            conf = float(box.conf[0])
-            class_name = CLASS_NAMES[cls_id]
-            info = CLASS_INFO[class_name]
-            
-            print(f"\nDetected: {class_name}")
-            print(f"  Scientific Name: {info['scientific_name']}")
-            print(f"  Category:        {info['category']}")
-            print(f"  Confidence:      {conf:.2%}")
-            print(f"  Bounding Box:    {box.xyxy[0].tolist()}")
+    Runs one preprocessed (N, 3, S, S) batch through the model and returns
+    (boxes, scores, class_ids) per image, boxes mapped back to original
+    pixel coordinates with the letterbox metadata.
+    """
+    import numpy as np
+    import torch
+    from utils.onnx_engine import to_model_input
+    from utils.boxes import unletterbox_boxes
     
-    return results
+    def infer_batch(batch: np.ndarray, metadata_list: list) -> list:
+        # Tensor sources skip Ultralytics' own BGR->RGB step
+        results = model.predict(
+            source=torch.from_numpy(to_model_input(batch)), imgsz=imgsz, conf=conf, iou=iou, verbose=False
+        )
+        outputs = []
+        for result, meta in zip(results, metadata_list):
+            boxes = result.boxes
+            outputs.append((
+                unletterbox_boxes(boxes.xyxy.cpu().numpy(), meta),
+                boxes.conf.cpu().numpy().astype(np.float64),
+                boxes.cls.cpu().numpy().astype(np.int64),
+            ))
+        return outputs
+    
+    return infer_batch
+
+
+def make_batch_infer(model, imgsz: int = 640, conf: float = 0.25, iou: float = 0.45):
+    """Build the batched forward pass used by MicroBatcher (detection dicts per image)."""
+    infer_arrays = make_array_infer(model, imgsz, conf, iou)
+    
+    def infer_batch(batch: np.ndarray, metadata_list: list) -> list:
+        return [arrays_to_detections(*arrays) for arrays in infer_arrays(batch, metadata_list)]
+    
+    return infer_batch
+
+
+def export(model_path: str, imgsz: int = 640, opset: int = 12, dynamic: bool = True) -> str:
+    """
+    Export trained weights to ONNX for CPU inference (utils/onnx_engine.py).
+    
+    With dynamic=True the batch and image axes are left symbolic, so the
+    same file serves single images and batches.
+    
+    Returns:
+        Path of the written .onnx file (next to the weights)
+    """
+    print(f"Exporting {model_path} to ONNX (opset {opset}, imgsz {imgsz})")
+    model = load_yolo()(model_path)
+    onnx_path = model.export(format="onnx", imgsz=imgsz, opset=opset, dynamic=dynamic, simplify=True)
+    print(f"ONNX model saved to: {onnx_path}")
+    return onnx_path
+
+
+def serve(
+    model_path: str,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    unix_socket: str = None,
+    imgsz: int = 640,
+    conf: float = 0.25,
+    iou: float = 0.45,
+    cache_db: str = None,
+    max_batch: int = 1,
+    max_wait_ms: float = 10.0,
+):
+    """
+    Serve predictions from a model loaded once (see utils/server.py).
+    
+    The weights are loaded and warmed up at startup; each POST /predict
+    then only pays for decode and inference. Repeated images are answered
+    from a PredictionCache (persisted when cache_db is set). With
+    max_batch > 1, concurrent requests are grouped by a MicroBatcher
+    (see utils/batching.py) into one forward pass.
+    """
+    import numpy as np
+    from utils.batching import MicroBatcher
+    from utils.result_cache import PredictionCache
+    from utils.server import InferenceServer
+    
+    print(f"Loading model: {model_path}")
+    model = load_yolo()(model_path)
+    
+    # Warm-up pass: layer fusing and buffer allocation happen on first call
+    start = datetime.now()
+    warmup = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    model.predict(source=warmup, imgsz=imgsz, conf=conf, iou=iou, verbose=False)
+    print(f"Warm-up done in {(datetime.now() - start).total_seconds() * 1000:.0f} ms")
+    
+    batcher = None
+    if max_batch > 1:
+        batcher = MicroBatcher(
+            make_batch_infer(model, imgsz, conf, iou),
+            max_batch=max_batch,
+            max_wait_ms=max_wait_ms,
+            target_size=imgsz,
+        )
+        batcher.start_in_thread()
+        infer = batcher.submit_sync
+        print(f"Micro-batching up to {max_batch} images, {max_wait_ms:g} ms max wait")
+    else:
+        model_lock = threading.Lock()
+        
+        def infer(image: np.ndarray) -> list:
+            with model_lock:
+                results = model.predict(source=image, imgsz=imgsz, conf=conf, iou=iou, verbose=False)
+            return results_to_detections(results)
+    
+    cache = PredictionCache(db_path=cache_db)
+    server = InferenceServer(
+        infer,
+        host=host,
+        port=port,
+        unix_socket=unix_socket,
+        cache=cache,
+        cache_key=lambda body: cache.make_key(body, model_path, imgsz=imgsz, conf=conf, iou=iou),
+        extra_stats=(lambda: {"batching": batcher.stats()}) if batcher else None,
+    )
+    
+    print(f"Serving on {server.address} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping server")
+    finally:
+        cache.close()
 
 
 # ============================================================
 # CLI Entry Point
 # ============================================================
 
+def run_mode(args: argparse.Namespace, config: dict, parser: argparse.ArgumentParser):
+    """Dispatch the selected --mode."""
+    if args.mode == "train":
+        train(config, resume=args.resume, aug_shards=args.aug_shards, validate=not args.no_validate, name=args.name)
+    elif args.mode == "sweep":
+        from utils.sweep import load_sweep, run_sweep
+        
+        # Validate once here; trials skip the check
+        setup_dataset(config, validate=not args.no_validate)
+        sweep_name = args.name if args.name != "peanutguard" else datetime.now().strftime("%Y%m%d-%H%M%S")
+        try:
+            run_sweep(
+                load_sweep(args.sweep),
+                config,
+                os.path.join("runs", "sweeps", sweep_name),
+                parallel=args.parallel,
+                extra_args=["--aug-shards", args.aug_shards] if args.aug_shards else [],
+            )
+        except FileExistsError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    elif args.mode == "eval":
+        evaluate(args.model, config["dataset"]["path"])
+    elif args.mode == "predict" and args.source:
+        bulk_predict(
+            args.model,
+            args.source,
+            output=args.output,
+            batch_size=args.batch or 16,
+            imgsz=config["model"]["input_size"],
+            backend=args.backend,
+            vid_stride=args.vid_stride,
+            save_images=args.save_images,
+        )
+    elif args.mode == "predict":
+        if not args.image:
+            print("Error: --image or --source required for predict mode")
+            sys.exit(1)
+        cache = None
+        if args.cache_db:
+            from utils.result_cache import PredictionCache
+            cache = PredictionCache(db_path=args.cache_db)
+        tiling = None
+        if args.tile:
+            tiling = {
+                "overlap": args.tile_overlap,
+                "merge": args.tile_merge,
+                "skip_std": args.tile_skip_std,
+            }
+        predict(
+            args.model,
+            args.image,
+            imgsz=config["model"]["input_size"],
+            cache=cache,
+            backend=args.backend,
+            tiling=tiling,
+        )
+        if cache is not None:
+            print(f"\nCache: {cache.stats['hits'] + cache.stats['disk_hits']} hits, "
+                  f"{cache.stats['misses']} misses")
+            cache.close()
+    elif args.mode == "serve":
+        serve(
+            args.model,
+            host=args.host,
+            port=args.port,
+            unix_socket=args.unix_socket,
+            imgsz=config["model"]["input_size"],
+            cache_db=args.cache_db,
+            max_batch=args.max_batch,
+            max_wait_ms=args.max_wait_ms,
+        )
+    elif args.mode == "export":
+        export(args.model, imgsz=config["model"]["input_size"], opset=args.opset)
+    elif args.mode == "quantize":
+        from utils.quantize import quantize_and_compare
+        
+        onnx_path = args.model
+        if not onnx_path.endswith(".onnx"):
+            onnx_path = export(args.model, imgsz=config["model"]["input_size"], opset=args.opset)
+        quantize_and_compare(
+            onnx_path,
+            data_yaml=config["dataset"]["path"],
+            imgsz=config["model"]["input_size"],
+            report_path=str(Path(onnx_path).with_name("quantization_report.json")),
+        )
+    elif args.mode == "split":
+        if not args.source:
+            parser.error("split mode needs --source (directory of all images)")
+        from utils.split import split_dataset
+        
+        dataset_config = config["dataset"]
+        out_dir = os.path.dirname(dataset_config["path"]) or "."
+        summary = split_dataset(
+            args.source,
+            out_dir,
+            ratios=(dataset_config["train_split"], dataset_config["val_split"], dataset_config["test_split"]),
+            mode=args.split_mode,
+            stratify=args.stratify,
+        )
+        print("Split: " + ", ".join(f"{split} {count}" for split, count in summary["images"].items()))
+        if args.split_mode == "list":
+            print(f"Point data.yaml at the lists: train: train.txt, val: val.txt, test: test.txt (in {out_dir})")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="PeanutGuard YOLOv8 Training Pipeline"
     )
     parser.add_argument(
         "--mode", type=str, default="train",
-        choices=["train", "eval", "predict"],
-        help="Pipeline mode: train, eval, or predict"
+        choices=["train", "eval", "predict", "serve", "export", "quantize", "split", "sweep"],
+        help="Pipeline mode: train, eval, predict, serve, export, quantize, split, or sweep"
     )
     parser.add_argument(
         "--config", type=str, default="config.yaml",
@@ -367,12 +830,32 @@ def main():
     )
     parser.add_argument(
         "--batch", type=int, default=None,
-        help="Override batch size"
+        help="Override batch size (training, or bulk predict with --source)"
     )
     parser.add_argument(
         "--resume", type=str, default=None,
         help="Path to checkpoint to resume training"
     )
+    parser.add_argument(
+        "--name", type=str, default="peanutguard",
+        help="Run name: training output runs/detect/<name>; sweep output runs/sweeps/<name>"
+    )
+    parser.add_argument(
+        "--sweep", type=str, default="sweep.yaml",
+        help="Sweep mode: search space and successive-halving settings"
+    )
+    parser.add_argument(
+        "--parallel", type=int, default=None,
+        help="Sweep mode: concurrent trials (overrides the sweep file)"
+    )
+    parser.add_argument(
+        "--no-validate", action="store_true",
+        help="Skip the dataset image/label checks before training"
+    )
+    parser.add_argument(
+        "--aug-shards", type=str, default=None,
+        help="Train from pre-augmented shards built by utils/aug_shards.py"
+    )
     parser.add_argument(
         "--model", type=str, default="runs/detect/peanutguard/weights/best.pt",
         help="Path to trained model (for eval/predict)"
@@ -381,6 +864,86 @@ def main():
         "--image", type=str, default=None,
         help="Image path for prediction"
     )
+    parser.add_argument(
+        "--source", type=str, default=None,
+        help="Bulk predict over a directory, glob (quoted) or video file; split mode: the unsplit image pool"
+    )
+    parser.add_argument(
+        "--output", type=str, default="runs/predict/detections.jsonl",
+        help="Bulk predict output: .jsonl file or .parquet directory"
+    )
+    parser.add_argument(
+        "--save-images", action="store_true",
+        help="Bulk predict: also write annotated images"
+    )
+    parser.add_argument(
+        "--vid-stride", type=int, default=1,
+        help="Bulk predict: use every n-th video frame"
+    )
+    parser.add_argument(
+        "--split-mode", type=str, default="symlink", choices=["symlink", "list"],
+        help="Split mode: symlink images/labels into the dataset tree, or write <split>.txt lists"
+    )
+    parser.add_argument(
+        "--stratify", action="store_true",
+        help="Split mode: balance every split per rarest class in the labels"
+    )
+    parser.add_argument(
+        "--backend", type=str, default="ultralytics", choices=["ultralytics", "onnx"],
+        help="Predict mode: run --model with Ultralytics or an exported .onnx with onnxruntime"
+    )
+    parser.add_argument(
+        "--tile", action="store_true",
+        help="Predict mode: sliced inference over overlapping input-size tiles"
+    )
+    parser.add_argument(
+        "--tile-overlap", type=float, default=0.2,
+        help="Fraction of each tile shared with its neighbours"
+    )
+    parser.add_argument(
+        "--tile-merge", type=str, default="nms", choices=["nms", "wbf"],
+        help="How duplicate detections from overlapping tiles are merged"
+    )
+    parser.add_argument(
+        "--tile-skip-std", type=float, default=0.0,
+        help="Skip near-uniform tiles with grayscale std below this (0 = keep all)"
+    )
+    parser.add_argument(
+        "--opset", type=int, default=12,
+        help="ONNX opset for export mode"
+    )
+    parser.add_argument(
+        "--cache-db", type=str, default=None,
+        help="SQLite file caching predictions by image/weights hash (predict/serve)"
+    )
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1",
+        help="Bind address for serve mode"
+    )
+    parser.add_argument(
+        "--port", type=int, default=8765,
+        help="TCP port for serve mode"
+    )
+    parser.add_argument(
+        "--unix-socket", type=str, default=None,
+        help="Serve on this Unix domain socket instead of TCP"
+    )
+    parser.add_argument(
+        "--max-batch", type=int, default=1,
+        help="Serve mode: group up to this many concurrent requests per forward pass"
+    )
+    parser.add_argument(
+        "--metrics", type=str, default=None,
+        help="Record per-stage timings/counters and write them here (.json, or .prom for Prometheus text)"
+    )
+    parser.add_argument(
+        "--profile", type=str, default=None,
+        help="Run under cProfile and dump pstats data to this file"
+    )
+    parser.add_argument(
+        "--max-wait-ms", type=float, default=10.0,
+        help="Serve mode: longest a request waits for its batch to fill"
+    )
     
     args = parser.parse_args()
     config = load_config(args.config)
@@ -391,15 +954,26 @@ def main():
     if args.batch:
         config["training"]["batch_size"] = args.batch
     
-    if args.mode == "train":
-        train(config, resume=args.resume)
-    elif args.mode == "eval":
-        evaluate(args.model, config["dataset"]["path"])
-    elif args.mode == "predict":
-        if not args.image:
-            print("Error: --image required for predict mode")
-            sys.exit(1)
-        predict(args.model, args.image)
+    if args.metrics:
+        instrumentation.enable()
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run_mode(args, config, parser)
+    finally:
+        if profiler is not None:
+            import pstats
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+            print(f"Profile written to {args.profile} (view with: python -m pstats {args.profile})")
+        if args.metrics:
+            instrumentation.print_summary()
+            instrumentation.write_metrics(args.metrics)
+            print(f"Metrics written to {args.metrics}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+"""Preprocessing and evaluation utilities for the PeanutGuard pipeline."""
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Offline augmentation cache: pre-baked epoch shards for training.
+
+With mosaic and mixup on, every epoch re-decodes and re-augments every
+training image, which makes the CPU the bottleneck of a 100-epoch run
+on the shared training box. build_shards does that work once: it
+generates K augmented variants of each training image, using the
+`augmentation` section of config.yaml, and stores them in memory-mapped
+shards next to their YOLO labels. Training then reads a variant per
+sample from disk (page cache) instead of augmenting on the CPU.
+
+Files (in shard_dir):
+    shards.json                 manifest: size, variants, encoding, sources,
+                                skipped images, settings
+    variant_<k>.jpg             encoding="jpeg" (default): concatenated JPEG
+    variant_<k>.frames.npy      frames, (N + 1,) int64 byte offsets; about
+                                a tenth of the raw size, decoded per sample
+    variant_<k>.u8              encoding="raw": uint8 array (N, S, S, 3),
+                                BGR, read without decoding
+    variant_<k>.labels.npy      (M, 5) float32 [class, xc, yc, w, h] rows
+    variant_<k>.offsets.npy     (N + 1,) int64; labels of sample i are
+                                labels[offsets[i]:offsets[i + 1]]
+
+Decoding one 640 px JPEG costs a few milliseconds in a DataLoader
+worker, far less than decoding four source images for a mosaic and
+augmenting them; use raw when disk space is no concern.
+
+Source images are letterboxed once through the TensorCache, so mosaic
+reads its three extra images from the memory map rather than decoding
+them. Each chunk of samples draws from its own seeded Generator, so the
+shards are identical for any number of workers. Images that cannot be
+decoded, or whose label file cannot be parsed, are skipped and listed in
+the manifest.
+
+Usage (from the ml/ directory):
+    python -m utils.aug_shards dataset/images/train --variants 8 --config config.yaml
+"""
+
+import argparse
+import json
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from .boxes import letterbox_boxes, xywhn_to_xyxy, xyxy_to_xywhn
+from .config import load_config
+from .dataset_index import label_path_for
+from .evaluate import read_yolo_txt
+from .preprocess import augment_batch
+from .tensor_cache import TensorCache, find_images
+
+
+SHARD_ENCODINGS = ("jpeg", "raw")
+
+
+def letterbox_labels(path: str, metadata: dict) -> np.ndarray:
+    """Read an image's YOLO labels and map them into its letterboxed canvas."""
+    record = read_yolo_txt(label_path_for(path))
+    if len(record["labels"]) == 0:
+        return np.zeros((0, 5), dtype=np.float32)
+    h, w = metadata["original_shape"]
+    size = metadata["target_size"]
+    boxes = letterbox_boxes(record["boxes"] * [w, h, w, h], metadata)
+    return np.column_stack([record["labels"], xyxy_to_xywhn(boxes, size, size)]).astype(np.float32)
+
+
+def _mosaic(
+    canvases: List[np.ndarray],
+    labels: List[np.ndarray],
+    rng: np.random.Generator,
+    out: np.ndarray,
+) -> np.ndarray:
+    """
+    2x2 mosaic of four S x S canvases, cropped back to S x S at a random
+    offset so all four contribute at native scale. Returns the labels.
+    """
+    size = out.shape[0]
+    x0, y0 = rng.integers(size // 4, 3 * size // 4 + 1, 2)
+    crop = []
+    for quadrant, (canvas, lbl) in enumerate(zip(canvases, labels)):
+        qx, qy = (quadrant % 2) * size, (quadrant // 2) * size
+        # Intersection of this quadrant with the crop window, in mosaic pixels
+        left, top = max(qx, x0), max(qy, y0)
+        right, bottom = min(qx + size, x0 + size), min(qy + size, y0 + size)
+        out[top - y0:bottom - y0, left - x0:right - x0] = canvas[top - qy:bottom - qy, left - qx:right - qx]
+        
+        if len(lbl):
+            xyxy = xywhn_to_xyxy(lbl[:, 1:5], size, size) + [qx - x0, qy - y0, qx - x0, qy - y0]
+            clipped = np.clip(xyxy, 0, size)
+            area = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+            bw, bh = clipped[:, 2] - clipped[:, 0], clipped[:, 3] - clipped[:, 1]
+            keep = (bw > 2) & (bh > 2) & (bw * bh > 0.2 * area)
+            crop.append(np.column_stack([lbl[keep, 0], xyxy_to_xywhn(clipped[keep], size, size)]))
+    return np.concatenate(crop).astype(np.float32) if crop else np.zeros((0, 5), dtype=np.float32)
+
+
+def augment_chunk(
+    cache: TensorCache,
+    paths: List[str],
+    labels: List[np.ndarray],
+    indices: np.ndarray,
+    aug: Dict,
+    rng: np.random.Generator,
+    out: np.ndarray,
+) -> List[np.ndarray]:
+    """
+    Build one augmented sample per index into out (len(indices), S, S, 3).
+    
+    Mosaic (probability aug["mosaic"]) combines the sample with three
+    random images, then HSV/affine/flip run batched through augment_batch,
+    and mixup (probability aug["mixup"]) blends samples within the chunk
+    with a Beta(32, 32) ratio and concatenates their labels.
+    """
+    chunk_labels = []
+    for j, index in enumerate(indices):
+        if rng.random() < aug.get("mosaic", 0.0):
+            picks = [index, *rng.integers(0, len(paths), 3)]
+            canvases = [cache.get(paths[p])[0] for p in picks]
+            chunk_labels.append(_mosaic(canvases, [labels[p] for p in picks], rng, out[j]))
+        else:
+            out[j] = cache.get(paths[index])[0]
+            chunk_labels.append(labels[index])
+    
+    _, chunk_labels = augment_batch(
+        out,
+        chunk_labels,
+        rng,
+        hsv_h=aug.get("hsv_h", 0.0),
+        hsv_s=aug.get("hsv_s", 0.0),
+        hsv_v=aug.get("hsv_v", 0.0),
+        rotation=aug.get("degrees", 0.0),
+        scale=aug.get("scale", 0.0),
+        translate=aug.get("translate", 0.0),
+        flip_lr=aug.get("fliplr", 0.0),
+        flip_ud=aug.get("flipud", 0.0),
+        p_hsv=1.0,
+        p_affine=1.0,
+        out=out,
+    )
+    
+    partners = rng.permutation(len(indices))
+    for j in np.flatnonzero(rng.random(len(indices)) < aug.get("mixup", 0.0)):
+        k = partners[j]
+        if k == j:
+            continue
+        ratio = rng.beta(32.0, 32.0)
+        # Rounded and saturated, so blending does not darken the image
+        cv2.addWeighted(out[j], ratio, out[k], 1 - ratio, 0.0, dst=out[j])
+        chunk_labels[j] = np.concatenate([chunk_labels[j], chunk_labels[k]])
+    return [lbl.astype(np.float32) for lbl in chunk_labels]
+
+
+def build_shards(
+    image_dir: str,
+    shard_dir: str,
+    augmentation: Dict,
+    variants: int = 8,
+    target_size: int = 640,
+    cache_dir: str = "dataset/.cache",
+    chunk_size: int = 64,
+    workers: int = 4,
+    seed: int = 0,
+    encoding: str = "jpeg",
+    quality: int = 95,
+) -> Dict:
+    """
+    Pre-generate `variants` augmented copies of every image under image_dir
+    (a directory or a list file of image paths).
+    
+    Args:
+        image_dir: Training images (labels found via the images/labels
+            directory convention)
+        shard_dir: Output directory for variant_<k> files and shards.json
+        augmentation: The config.yaml `augmentation` section
+        variants: K augmented variants per image
+        target_size: Model input size S
+        cache_dir: TensorCache directory for letterboxed sources
+        chunk_size: Samples augmented per batch (and per seeded Generator)
+        workers: Threads; cv2 and numpy release the GIL
+        seed: Base seed
+        encoding: "jpeg" (compact, decoded per sample) or "raw" uint8
+        quality: JPEG quality for encoding="jpeg"
+    
+    Returns:
+        The manifest dict written to shards.json
+    """
+    if encoding not in SHARD_ENCODINGS:
+        raise ValueError(f"encoding must be one of {SHARD_ENCODINGS}, got {encoding!r}")
+    paths = find_images([image_dir])
+    if not paths:
+        raise FileNotFoundError(f"No images found in {image_dir}")
+    cache = TensorCache(cache_dir, target_size)
+    cache.update(paths, workers=workers)
+    
+    # Images the cache could not decode and unparseable label files are skipped
+    skipped = dict(cache.failed)
+    usable, labels = [], []
+    for path in paths:
+        cached = cache.get(path)
+        if cached is None:
+            skipped.setdefault(os.path.abspath(path), "not in the letterbox cache")
+            continue
+        try:
+            labels.append(letterbox_labels(path, cached[1]))
+        except (OSError, ValueError) as e:
+            skipped[os.path.abspath(path)] = f"bad label file: {e}"
+            continue
+        usable.append(path)
+    paths = usable
+    if skipped:
+        print(f"  skipping {len(skipped)} image(s):")
+        for path, error in sorted(skipped.items())[:10]:
+            print(f"    {path}: {error}")
+    if not paths:
+        raise ValueError(f"No readable images in {image_dir}")
+    
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    n = len(paths)
+    chunks = [np.arange(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+    
+    for k in range(variants):
+        blob = None
+        if encoding == "raw":
+            blob = np.memmap(shard_dir / f"variant_{k:03d}.u8", dtype=np.uint8, mode="w+",
+                             shape=(n, target_size, target_size, 3))
+        
+        def run(chunk_id: int) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+            indices = chunks[chunk_id]
+            rng = np.random.default_rng([seed, k, chunk_id])
+            if blob is not None:
+                out = blob[indices[0]:indices[-1] + 1]
+                return augment_chunk(cache, paths, labels, indices, augmentation, rng, out), []
+            out = np.empty((len(indices), target_size, target_size, 3), dtype=np.uint8)
+            chunk_labels = augment_chunk(cache, paths, labels, indices, augmentation, rng, out)
+            return chunk_labels, [cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1] for img in out]
+        
+        variant_labels, frame_sizes = [], []
+        frames_file = open(shard_dir / f"variant_{k:03d}.jpg", "wb") if blob is None else None
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                # A few chunks in flight at a time bounds the encoded frames held in memory
+                window = 4 * workers
+                for start in range(0, len(chunks), window):
+                    for chunk_labels, frames in pool.map(run, range(start, min(start + window, len(chunks)))):
+                        variant_labels.extend(chunk_labels)
+                        for frame in frames:
+                            frames_file.write(frame.tobytes())
+                            frame_sizes.append(len(frame))
+        finally:
+            if frames_file is not None:
+                frames_file.close()
+        if blob is not None:
+            blob.flush()
+            del blob
+        else:
+            frame_offsets = np.zeros(n + 1, dtype=np.int64)
+            frame_offsets[1:] = np.cumsum(frame_sizes)
+            np.save(shard_dir / f"variant_{k:03d}.frames.npy", frame_offsets)
+        
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(lbl) for lbl in variant_labels])
+        flat = np.concatenate(variant_labels) if offsets[-1] else np.zeros((0, 5), dtype=np.float32)
+        np.save(shard_dir / f"variant_{k:03d}.labels.npy", flat.astype(np.float32))
+        np.save(shard_dir / f"variant_{k:03d}.offsets.npy", offsets)
+        print(f"  variant {k + 1}/{variants}: {n} images, {offsets[-1]} boxes")
+    
+    manifest = {
+        "target_size": target_size,
+        "variants": variants,
+        "count": n,
+        "encoding": encoding,
+        "images": [os.path.abspath(p) for p in paths],
+        "skipped": skipped,
+        "augmentation": augmentation,
+        "seed": seed,
+    }
+    tmp_path = shard_dir / "shards.json.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, shard_dir / "shards.json")
+    return manifest
+
+
+class AugmentedShards:
+    """
+    Read-only view of pre-baked shards.
+    
+    sample(i, k) returns variant k of image i as a (S, S, 3) BGR array (a
+    view into the memory map for raw shards, a decoded frame for JPEG
+    shards) plus its (M, 5) labels; random_variant picks k
+    uniformly, which is how training draws a fresh augmentation per epoch.
+    """
+    
+    def __init__(self, shard_dir: str):
+        self.shard_dir = Path(shard_dir)
+        with open(self.shard_dir / "shards.json", "r") as f:
+            self.manifest = json.load(f)
+        self.target_size = self.manifest["target_size"]
+        self.variants = self.manifest["variants"]
+        self.encoding = self.manifest.get("encoding", "raw")
+        self.images = self.manifest["images"]
+        self._data = {}
+        self._labels = {}
+    
+    def __len__(self) -> int:
+        return len(self.images)
+    
+    def _variant(self, k: int) -> Tuple[np.memmap, np.ndarray, np.ndarray]:
+        # Opened lazily so DataLoader workers map files after fork
+        if k not in self._data:
+            size = self.target_size
+            if self.encoding == "jpeg":
+                self._data[k] = (
+                    np.memmap(self.shard_dir / f"variant_{k:03d}.jpg", dtype=np.uint8, mode="r"),
+                    np.load(self.shard_dir / f"variant_{k:03d}.frames.npy"),
+                )
+            else:
+                self._data[k] = np.memmap(self.shard_dir / f"variant_{k:03d}.u8", dtype=np.uint8, mode="r",
+                                          shape=(len(self.images), size, size, 3))
+            self._labels[k] = (
+                np.load(self.shard_dir / f"variant_{k:03d}.labels.npy", mmap_mode="r"),
+                np.load(self.shard_dir / f"variant_{k:03d}.offsets.npy"),
+            )
+        return self._data[k], *self._labels[k]
+    
+    def labels(self, index: int, variant: int) -> np.ndarray:
+        """(M, 5) labels of one sample, without reading its pixels."""
+        _, labels, offsets = self._variant(variant)
+        return np.asarray(labels[offsets[index]:offsets[index + 1]])
+    
+    def sample(self, index: int, variant: int) -> Tuple[np.ndarray, np.ndarray]:
+        data = self._variant(variant)[0]
+        if self.encoding == "jpeg":
+            frames, frame_offsets = data
+            image = cv2.imdecode(frames[frame_offsets[index]:frame_offsets[index + 1]], cv2.IMREAD_COLOR)
+        else:
+            image = data[index]
+        return image, self.labels(index, variant)
+    
+    def random_variant(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.sample(index, random.randrange(self.variants))
+
+
+def make_shard_trainer(shard_dir: str):
+    """
+    Ultralytics DetectionTrainer subclass whose train split reads from
+    pre-baked shards; validation keeps the regular dataset.
+    """
+    import torch
+    from ultralytics.data.dataset import YOLODataset
+    from ultralytics.models.yolo.detect import DetectionTrainer
+    
+    class ShardDataset(torch.utils.data.Dataset):
+        collate_fn = staticmethod(YOLODataset.collate_fn)
+        
+        def __init__(self):
+            self.shards = AugmentedShards(shard_dir)
+            size = self.shards.target_size
+            # Used by the trainer's label plots; the first variant suffices
+            self.labels = []
+            for i, path in enumerate(self.shards.images):
+                lbl = self.shards.labels(i, 0)
+                self.labels.append({"im_file": path, "cls": lbl[:, :1], "bboxes": lbl[:, 1:],
+                                    "shape": (size, size), "normalized": True, "bbox_format": "xywh"})
+        
+        def __len__(self):
+            return len(self.shards)
+        
+        def __getitem__(self, index):
+            image, lbl = self.shards.random_variant(index)
+            size = self.shards.target_size
+            # BGR HWC -> RGB CHW, as Ultralytics' Format transform does
+            img = torch.from_numpy(np.ascontiguousarray(image.transpose(2, 0, 1)[::-1]))
+            return {
+                "img": img,
+                "cls": torch.from_numpy(lbl[:, :1].copy()),
+                "bboxes": torch.from_numpy(lbl[:, 1:].copy()),
+                "batch_idx": torch.zeros(len(lbl)),
+                "im_file": self.shards.images[index],
+                "ori_shape": (size, size),
+                "resized_shape": (size, size),
+            }
+        
+        def close_mosaic(self, hyp):
+            """Shards are fixed; the final no-mosaic epochs are not emulated."""
+    
+    class ShardTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode="train", batch=None):
+            if mode == "train":
+                return ShardDataset()
+            return super().build_dataset(img_path, mode, batch)
+    
+    return ShardTrainer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate augmented training shards")
+    parser.add_argument("images", help="Training image directory or list file (e.g. dataset/images/train)")
+    parser.add_argument("--out", default="dataset/.shards", help="Shard directory")
+    parser.add_argument("--config", default="config.yaml", help="Config with an augmentation section")
+    parser.add_argument("--variants", type=int, default=8, help="Augmented variants per image")
+    parser.add_argument("--size", type=int, default=640, help="Model input size")
+    parser.add_argument("--cache-dir", default="dataset/.cache", help="Letterbox cache directory")
+    parser.add_argument("--workers", type=int, default=4, help="Worker threads")
+    parser.add_argument("--seed", type=int, default=0, help="Base seed")
+    parser.add_argument("--encoding", default="jpeg", choices=SHARD_ENCODINGS, help="Frame storage")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG quality")
+    args = parser.parse_args()
+    
+    augmentation = load_config(args.config)["augmentation"]
+    print(f"Building {args.variants} variants per image into {args.out}")
+    manifest = build_shards(
+        args.images,
+        args.out,
+        augmentation,
+        variants=args.variants,
+        target_size=args.size,
+        cache_dir=args.cache_dir,
+        workers=args.workers,
+        seed=args.seed,
+        encoding=args.encoding,
+        quality=args.quality,
+    )
+    size_gb = sum(p.stat().st_size for p in Path(args.out).glob("variant_*")) / 2 ** 30
+    print(f"Done: {manifest['count']} images x {args.variants} variants ({size_gb:.1f} GiB)"
+          + (f", {len(manifest['skipped'])} skipped" if manifest["skipped"] else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Dynamic micro-batching for concurrent PeanutGuard inference requests.
+
+Requests that arrive close together are grouped into one batch (up to
+max_batch images, waiting at most max_wait_ms after the first one),
+preprocessed together with batch_preprocess and sent through the model in
+a single forward pass; each caller then gets back its own detections.
+While a batch is running, new requests queue up and form the next batch.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .preprocess import batch_preprocess
+
+
+class MicroBatcher:
+    """
+    Asyncio request batcher in front of a batched model call.
+    
+    Args:
+        infer_batch: Function taking the (N, 3, S, S) batch and its
+            metadata list and returning one detection list per image
+        max_batch: Largest batch to form
+        max_wait_ms: How long the first request of a batch may wait for
+            others to join
+        target_size: Model input size for batch_preprocess
+        latency_window: Number of recent requests kept for percentiles
+    
+    Example (from asyncio code):
+        batcher = MicroBatcher(infer_batch, max_batch=8, max_wait_ms=10)
+        detections = await batcher.submit(image)
+    
+    From threads (e.g. InferenceServer handlers), call start_in_thread()
+    once and then submit_sync(image).
+    """
+    
+    def __init__(
+        self,
+        infer_batch: Callable[[np.ndarray, List[dict]], List[List[Dict]]],
+        max_batch: int = 8,
+        max_wait_ms: float = 10.0,
+        target_size: int = 640,
+        latency_window: int = 10000,
+    ):
+        self.infer_batch = infer_batch
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.target_size = target_size
+        
+        self._latencies = deque(maxlen=latency_window)
+        self._batch_sizes = deque(maxlen=latency_window)
+        # stats() runs on server handler threads while the loop appends
+        self._stats_lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._worker: Optional[asyncio.Task] = None
+        # One model thread: batches run one at a time, off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1)
+    
+    async def submit(self, image: np.ndarray) -> List[Dict]:
+        """Queue one decoded BGR image and wait for its detections."""
+        if self._worker is None:
+            self._start()
+        future = self._loop.create_future()
+        await self._queue.put((image, future, time.perf_counter()))
+        return await future
+    
+    def submit_sync(self, image: np.ndarray, timeout: Optional[float] = None) -> List[Dict]:
+        """Thread-safe blocking submit for use with start_in_thread()."""
+        if self._loop is None:
+            raise RuntimeError("Call start_in_thread() before submit_sync()")
+        return asyncio.run_coroutine_threadsafe(self.submit(image), self._loop).result(timeout)
+    
+    def start_in_thread(self) -> threading.Thread:
+        """Run the batcher's event loop in a daemon thread."""
+        ready = threading.Event()
+        
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._start()
+            ready.set()
+            self._loop.run_forever()
+        
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        ready.wait()
+        return thread
+    
+    def _start(self):
+        self._loop = self._loop or asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._worker = self._loop.create_task(self._run())
+    
+    async def _collect(self) -> list:
+        """Wait for one request, then gather more until full or timed out."""
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                # Still take anything that is already waiting
+                while len(batch) < self.max_batch and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+    
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            images = [item[0] for item in batch]
+            try:
+                outputs = await self._loop.run_in_executor(self._executor, self._forward, images)
+            except Exception as exc:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            
+            done = time.perf_counter()
+            with self._stats_lock:
+                self._batch_sizes.append(len(batch))
+                self._latencies.extend(done - enqueued for _, _, enqueued in batch)
+            for (_, future, _), detections in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(detections)
+    
+    def _forward(self, images: List[np.ndarray]) -> List[List[Dict]]:
+        batch, metadata_list = batch_preprocess(images, self.target_size)
+        outputs = self.infer_batch(batch, metadata_list)
+        if len(outputs) != len(images):
+            raise RuntimeError(f"infer_batch returned {len(outputs)} results for {len(images)} images")
+        return outputs
+    
+    def stats(self) -> Dict:
+        """Request latency percentiles (ms) and batch sizes over the window."""
+        with self._stats_lock:
+            latencies = list(self._latencies)
+            batch_sizes = list(self._batch_sizes)
+        if not latencies:
+            return {"requests": 0}
+        latencies = np.array(latencies) * 1000
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        return {
+            "requests": len(latencies),
+            "latency_ms": {
+                "p50": float(p50),
+                "p90": float(p90),
+                "p99": float(p99),
+                "max": float(latencies.max()),
+            },
+            "mean_batch_size": float(np.mean(batch_sizes)),
+        }
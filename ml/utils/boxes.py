@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Vectorized bounding-box kernels shared by the PeanutGuard pipeline.
+
+Every function works on NumPy arrays of boxes in the last axis, so the
+same call handles one (N, 4) set or a batched (B, N, 4) tensor:
+
+    xyxy      [x1, y1, x2, y2] corners (pixels unless noted)
+    xywh      [xc, yc, w, h] centre format
+    xywhn     xywh normalized by image width/height (YOLO labels)
+
+Coordinate transforms, letterbox mapping (the scale/padding metadata of
+preprocess_for_inference), pairwise IoU / IoS / GIoU, class-aware NMS
+and weighted box fusion live here; utils.evaluate, utils.onnx_engine,
+utils.tiling, utils.annotations and utils.aug_shards call into them.
+
+tests/test_boxes.py checks them against scalar references and the
+implementations they replaced; benchmarks/bench_boxes.py times them.
+"""
+
+import heapq
+from typing import Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+
+OVERLAP_METRICS = ("iou", "ios", "giou")
+
+# Pairs per block in box_iou (a few float64 temporaries fit in L2)
+IOU_BLOCK_ELEMENTS = 32768
+
+Metadata = Union[Dict, Sequence[Dict]]
+
+
+# ============================================================
+# Coordinate formats
+# ============================================================
+
+def xywh_to_xyxy(boxes: np.ndarray) -> np.ndarray:
+    """Convert [..., 4] centre-format boxes to [x1, y1, x2, y2]."""
+    boxes = np.asarray(boxes)
+    xy = boxes[..., :2]
+    half = boxes[..., 2:4] / 2
+    return np.concatenate([xy - half, xy + half], axis=-1)
+
+
+def xyxy_to_xywh(boxes: np.ndarray) -> np.ndarray:
+    """Convert [..., 4] corner boxes to [xc, yc, w, h]."""
+    boxes = np.asarray(boxes)
+    return np.concatenate([(boxes[..., :2] + boxes[..., 2:4]) / 2, boxes[..., 2:4] - boxes[..., :2]], axis=-1)
+
+
+def xywhn_to_xyxy(boxes: np.ndarray, width: float = 1, height: float = 1) -> np.ndarray:
+    """
+    Normalized YOLO [xc, yc, w, h] to xyxy in a width x height image
+    (normalized xyxy with the default 1 x 1). width/height may be arrays
+    broadcasting against the leading axes, e.g. (B, 1) for a batch.
+    """
+    scale = np.stack(np.broadcast_arrays(width, height, width, height), axis=-1)
+    return xywh_to_xyxy(boxes) * scale
+
+
+def xyxy_to_xywhn(boxes: np.ndarray, width: float = 1, height: float = 1) -> np.ndarray:
+    """Inverse of xywhn_to_xyxy: pixel xyxy to normalized [xc, yc, w, h]."""
+    scale = np.stack(np.broadcast_arrays(width, height, width, height), axis=-1)
+    return xyxy_to_xywh(boxes) / scale
+
+
+def box_area(boxes: np.ndarray) -> np.ndarray:
+    """Area of [..., 4] xyxy boxes (inverted boxes count as 0)."""
+    boxes = np.asarray(boxes)
+    return np.prod(np.clip(boxes[..., 2:4] - boxes[..., :2], 0, None), axis=-1)
+
+
+# ============================================================
+# Letterbox mapping
+# ============================================================
+
+def _letterbox_params(metadata: Metadata) -> Tuple:
+    """
+    (scale, [pad_w, pad_h, pad_w, pad_h], [w, h, w, h]) broadcasting
+    against (N, 4) boxes for one metadata dict, or (B, N, 4) for a list.
+    """
+    if isinstance(metadata, dict):
+        pad_w, pad_h = metadata["padding"]
+        h, w = metadata["original_shape"]
+        return (
+            metadata["scale"],
+            np.array([pad_w, pad_h, pad_w, pad_h], dtype=np.float64),
+            np.array([w, h, w, h], dtype=np.float64),
+        )
+    params = [_letterbox_params(m) for m in metadata]
+    return (
+        np.array([p[0] for p in params], dtype=np.float64)[:, np.newaxis, np.newaxis],
+        np.stack([p[1] for p in params])[:, np.newaxis, :],
+        np.stack([p[2] for p in params])[:, np.newaxis, :],
+    )
+
+
+def letterbox_boxes(boxes: np.ndarray, metadata: Metadata) -> np.ndarray:
+    """
+    Map xyxy boxes in original image pixels into the letterboxed input
+    (scale, then shift by the padding), e.g. labels onto a training canvas.
+    A list of metadata maps a (B, N, 4) batch image by image.
+    """
+    scale, pad, _limits = _letterbox_params(metadata)
+    return np.asarray(boxes, dtype=np.float64) * scale + pad
+
+
+def unletterbox_boxes(boxes: np.ndarray, metadata: Metadata, clip: bool = True) -> np.ndarray:
+    """
+    Map [x1, y1, x2, y2] boxes from letterboxed input coordinates back to
+    the original image, using the metadata from preprocess_for_inference,
+    clipped to the image. A list of metadata maps a (B, N, 4) batch.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if isinstance(metadata, dict):
+        boxes = boxes.reshape(-1, 4)
+    scale, pad, limits = _letterbox_params(metadata)
+    boxes = (boxes - pad) / scale
+    return np.clip(boxes, 0, limits) if clip else boxes
+
+
+# ============================================================
+# Overlap
+# ============================================================
+
+def aligned_iou(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """IoU of broadcast-aligned box arrays [..., 4], same arithmetic as evaluate.compute_iou."""
+    x1 = np.maximum(boxes1[..., 0], boxes2[..., 0])
+    y1 = np.maximum(boxes1[..., 1], boxes2[..., 1])
+    x2 = np.minimum(boxes1[..., 2], boxes2[..., 2])
+    y2 = np.minimum(boxes1[..., 3], boxes2[..., 3])
+    
+    intersection = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+    area1 = (boxes1[..., 2] - boxes1[..., 0]) * (boxes1[..., 3] - boxes1[..., 1])
+    area2 = (boxes2[..., 2] - boxes2[..., 0]) * (boxes2[..., 3] - boxes2[..., 1])
+    union = area1 + area2 - intersection
+    
+    iou = np.zeros(union.shape, dtype=np.float64)
+    np.divide(intersection, union, out=iou, where=union > 0)
+    return iou
+
+
+def _pairwise(boxes1: np.ndarray, boxes2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(..., N, 1, 4) and (..., 1, M, 4) views for pairwise kernels."""
+    boxes1 = np.asarray(boxes1, dtype=np.float64)
+    boxes2 = np.asarray(boxes2, dtype=np.float64)
+    return boxes1[..., :, np.newaxis, :], boxes2[..., np.newaxis, :, :]
+
+
+def box_iou(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """
+    Pairwise IoU between xyxy box sets: (N, 4) x (M, 4) gives (N, M);
+    leading batch dimensions broadcast, so (B, N, 4) x (B, M, 4) gives
+    (B, N, M).
+    
+    Large 2-D inputs are computed in row blocks of about
+    IOU_BLOCK_ELEMENTS pairs with in-place temporaries, so the working set
+    stays in cache; small ones (e.g. one row per NMS step) take the plain
+    broadcast, which has less per-call overhead. Both are bit-identical to
+    aligned_iou.
+    """
+    boxes1 = np.asarray(boxes1, dtype=np.float64)
+    boxes2 = np.asarray(boxes2, dtype=np.float64)
+    if boxes1.ndim != 2 or boxes2.ndim != 2 or len(boxes1) * len(boxes2) <= IOU_BLOCK_ELEMENTS // 8:
+        return aligned_iou(*_pairwise(boxes1, boxes2))
+    
+    x1a, y1a, x2a, y2a = boxes1.T[:, :, np.newaxis]
+    x1b, y1b, x2b, y2b = boxes2.T[:, np.newaxis, :]
+    area_a = (x2a - x1a) * (y2a - y1a)
+    area_b = (x2b - x1b) * (y2b - y1b)
+    iou = np.zeros((len(boxes1), len(boxes2)))
+    step = max(1, IOU_BLOCK_ELEMENTS // len(boxes2))
+    for start in range(0, len(boxes1), step):
+        rows = slice(start, start + step)
+        w = np.minimum(x2a[rows], x2b)
+        w -= np.maximum(x1a[rows], x1b)
+        np.maximum(w, 0, out=w)
+        h = np.minimum(y2a[rows], y2b)
+        h -= np.maximum(y1a[rows], y1b)
+        np.maximum(h, 0, out=h)
+        w *= h
+        union = area_a[rows] + area_b
+        union -= w
+        np.divide(w, union, out=iou[rows], where=union > 0)
+    return iou
+
+
+def box_ios(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """
+    Pairwise intersection over the smaller box, which also matches a box
+    cut off at a tile border to the complete box it is part of.
+    """
+    a, b = _pairwise(boxes1, boxes2)
+    wh = np.clip(np.minimum(a[..., 2:], b[..., 2:]) - np.maximum(a[..., :2], b[..., :2]), 0, None)
+    intersection = wh[..., 0] * wh[..., 1]
+    return intersection / np.maximum(np.minimum(box_area(a), box_area(b)), 1e-9)
+
+
+def box_giou(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """
+    Pairwise generalized IoU: IoU minus the share of the smallest
+    enclosing box not covered by the union, in [-1, 1].
+    """
+    a, b = _pairwise(boxes1, boxes2)
+    iou = aligned_iou(a, b)
+    wh = np.clip(np.minimum(a[..., 2:], b[..., 2:]) - np.maximum(a[..., :2], b[..., :2]), 0, None)
+    intersection = wh[..., 0] * wh[..., 1]
+    union = box_area(a) + box_area(b) - intersection
+    enclosing = np.prod(np.maximum(a[..., 2:], b[..., 2:]) - np.minimum(a[..., :2], b[..., :2]), axis=-1)
+    giou = iou.copy()
+    np.subtract(iou, (enclosing - union) / np.where(enclosing > 0, enclosing, 1), out=giou, where=enclosing > 0)
+    return giou
+
+
+def pairwise_overlap(boxes1: np.ndarray, boxes2: np.ndarray, metric: str = "iou") -> np.ndarray:
+    """Pairwise "iou", "ios" (intersection over the smaller box) or "giou"."""
+    if metric == "iou":
+        return box_iou(boxes1, boxes2)
+    if metric == "ios":
+        return box_ios(boxes1, boxes2)
+    if metric == "giou":
+        return box_giou(boxes1, boxes2)
+    raise ValueError(f"metric must be one of {OVERLAP_METRICS}, got {metric!r}")
+
+
+# ============================================================
+# Suppression and fusion
+# ============================================================
+
+def _class_groups(class_ids: np.ndarray, order: np.ndarray) -> List[np.ndarray]:
+    """Split a score order into per-class index runs, each still in score order."""
+    if class_ids is None:
+        return [order]
+    labels = np.asarray(class_ids)[order]
+    by_class = np.argsort(labels, kind="stable")
+    bounds = np.flatnonzero(np.diff(labels[by_class])) + 1
+    return np.split(order[by_class], bounds)
+
+
+def non_max_suppression(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    iou_threshold: float = 0.45,
+    class_ids: np.ndarray = None,
+    max_det: int = 300,
+    metric: str = "iou",
+) -> np.ndarray:
+    """
+    Greedy NMS over (N, 4) xyxy boxes.
+    
+    With class_ids, boxes of different classes never suppress each other,
+    so every class keeps its own score-ordered queue. Each step takes the
+    best head across the queues (a heap keyed by global score rank), keeps
+    it and drops everything in its queue overlapping it in one vectorized
+    call. The loop runs once per kept box, computes overlaps only within
+    one class, and stops as soon as max_det boxes are kept; the result is
+    the same as one global loop with classes shifted apart. metric="ios"
+    suppresses by intersection over the smaller box instead (see box_ios).
+    
+    Returns:
+        Indices of kept boxes, highest score first (ties in input order)
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    boxes = np.asarray(boxes, dtype=np.float64)
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    
+    queues = _class_groups(class_ids, order)
+    heads = [(rank[queue[0]], i) for i, queue in enumerate(queues)]
+    heapq.heapify(heads)
+    keep = []
+    while heads and len(keep) < max_det:
+        _, i = heapq.heappop(heads)
+        best, rest = queues[i][0], queues[i][1:]
+        keep.append(best)
+        if rest.size:
+            rest = rest[pairwise_overlap(boxes[best:best + 1], boxes[rest], metric)[0] <= iou_threshold]
+        if rest.size:
+            queues[i] = rest
+            heapq.heappush(heads, (rank[rest[0]], i))
+    return np.asarray(keep, dtype=np.int64)
+
+
+def batched_nms(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    iou_threshold: float = 0.45,
+    class_ids: np.ndarray = None,
+    max_det: int = 300,
+    metric: str = "iou",
+    valid: np.ndarray = None,
+) -> List[np.ndarray]:
+    """
+    Class-aware NMS for a padded batch: boxes (B, N, 4), scores and
+    class_ids (B, N), and an optional (B, N) mask of real entries (e.g.
+    scores above the confidence threshold).
+    
+    Returns:
+        Per image, the kept indices into its N entries, highest score first
+    """
+    boxes = np.asarray(boxes)
+    scores = np.asarray(scores)
+    if valid is None:
+        valid = np.ones(scores.shape, dtype=bool)
+    keeps = []
+    for i in range(len(boxes)):
+        idx = np.flatnonzero(valid[i])
+        labels = None if class_ids is None else np.asarray(class_ids[i])[idx]
+        keeps.append(idx[non_max_suppression(boxes[i, idx], scores[i, idx], iou_threshold, labels, max_det, metric)])
+    return keeps
+
+
+def weighted_box_fusion(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    class_ids: np.ndarray,
+    iou_threshold: float = 0.55,
+    metric: str = "iou",
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fuse overlapping same-class boxes into score-weighted averages.
+    
+    Each class is fused on its own: boxes are visited highest score
+    first, and each joins the best-matching fused box (overlap above
+    iou_threshold, computed against all clusters of the class at once) or
+    starts a new one. A fused box is the score-weighted mean of its
+    members (the plain mean when all member scores are 0) and scores the
+    mean member score.
+    
+    Returns:
+        (boxes, scores, class_ids) of the fused boxes, highest score first
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    scores = np.asarray(scores, dtype=np.float64)
+    class_ids = np.asarray(class_ids, dtype=np.int64)
+    if len(boxes) == 0:
+        return np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=np.int64)
+    order = np.argsort(-scores, kind="stable")
+    
+    fused_boxes, fused_scores, fused_labels, first_member = [], [], [], []
+    for group in _class_groups(class_ids, order):
+        n = len(group)
+        fused = np.zeros((n, 4))
+        box_sums = np.zeros((n, 4))
+        member_sums = np.zeros((n, 4))
+        weights = np.zeros(n)
+        counts = np.zeros(n, dtype=np.int64)
+        firsts = np.zeros(n, dtype=np.int64)
+        n_fused = 0
+        for position, i in enumerate(group):
+            target = -1
+            if n_fused:
+                overlap = pairwise_overlap(boxes[i:i + 1], fused[:n_fused], metric)[0]
+                best = int(overlap.argmax())
+                if overlap[best] > iou_threshold:
+                    target = best
+            if target < 0:
+                target = n_fused
+                firsts[target] = position
+                n_fused += 1
+            box_sums[target] += scores[i] * boxes[i]
+            member_sums[target] += boxes[i]
+            weights[target] += scores[i]
+            counts[target] += 1
+            if weights[target] > 0:
+                fused[target] = box_sums[target] / weights[target]
+            else:
+                fused[target] = member_sums[target] / counts[target]
+        fused_boxes.append(fused[:n_fused])
+        fused_scores.append(weights[:n_fused] / counts[:n_fused])
+        fused_labels.append(np.full(n_fused, class_ids[group[0]], dtype=np.int64))
+        first_member.append(group[firsts[:n_fused]])
+    
+    if not fused_boxes:
+        return np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=np.int64)
+    fused_boxes = np.concatenate(fused_boxes)
+    fused_scores = np.concatenate(fused_scores)
+    fused_labels = np.concatenate(fused_labels)
+    # Ties on fused score keep the order in which clusters were started
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    started = rank[np.concatenate(first_member)]
+    result = np.lexsort((started, -fused_scores))
+    return fused_boxes[result], fused_scores[result], fused_labels[result]
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Training configuration for the PeanutGuard pipeline.
+
+DEFAULT_CONFIG holds every setting; load_config overlays a YAML file
+(e.g. config.yaml) section by section. train.py and the offline tools in
+utils (e.g. utils.aug_shards) read their settings through load_config.
+"""
+
+import copy
+import os
+
+import yaml
+
+
+DEFAULT_CONFIG = {
+    "model": {
+        "architecture": "yolov8n",  # nano variant for edge deployment
+        "pretrained": True,
+        "input_size": 640,
+        "num_classes": 8,
+    },
+    "training": {
+        "epochs": 100,
+        "batch_size": 16,
+        "learning_rate": 0.01,
+        "optimizer": "SGD",
+        "momentum": 0.937,
+        "weight_decay": 0.0005,
+        "warmup_epochs": 3,
+        "patience": 20,  # early stopping patience
+        "workers": 8,  # dataloader workers
+    },
+    "augmentation": {
+        "hsv_h": 0.015,
+        "hsv_s": 0.7,
+        "hsv_v": 0.4,
+        "degrees": 10.0,
+        "translate": 0.1,
+        "scale": 0.5,
+        "fliplr": 0.5,
+        "flipud": 0.0,
+        "mosaic": 1.0,
+        "mixup": 0.1,
+    },
+    "dataset": {
+        "path": "dataset/data.yaml",
+        "train_split": 0.8,
+        "val_split": 0.1,
+        "test_split": 0.1,
+    },
+}
+
+
+def load_config(config_path: str = None) -> dict:
+    """
+    Load training configuration from YAML or use defaults.
+    
+    Always returns a fresh deep copy, so callers (e.g. sweep trials) can
+    modify it without touching DEFAULT_CONFIG or each other.
+    """
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if config_path and os.path.exists(config_path):
+        with open(config_path, 'r') as f:
+            user_config = yaml.safe_load(f) or {}
+        # Merge with defaults
+        for key in user_config:
+            if isinstance(user_config[key], dict) and isinstance(config.get(key), dict):
+                config[key].update(user_config[key])
+            else:
+                config[key] = user_config[key]
+    return config
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+Dataset indexer and validator for YOLO image/label directories.
+
+Scans dataset/images/<split> and the matching dataset/labels/<split> in a
+process pool and catches what would otherwise surface mid-training:
+truncated or unreadable images (checked from file headers and end
+markers, without decoding pixels), orphan label files, malformed rows,
+class IDs outside the class list and coordinates outside [0, 1]. It also
+summarizes per-class box counts and box-size histograms.
+
+Results are kept in a compact index next to the TensorCache:
+    dataset_index.json          per image: split, mtimes, width, height,
+                                label offset/count, errors, warnings
+    dataset_index.labels.npy    (M, 5) float32 label rows of all images
+
+Re-runs only rescan images whose image or label mtime changed.
+
+Usage (from the ml/ directory):
+    python -m utils.dataset_index --data dataset/data.yaml --workers 8
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import yaml
+
+from .tensor_cache import find_images
+
+
+# Box size (sqrt of area in original pixels) histogram edges
+SIZE_BINS = (0, 16, 32, 64, 128, 256, 512, np.inf)
+MIN_IMAGE_SIZE = 10
+
+
+def label_path_for(image_path: str) -> Path:
+    """YOLO convention: .../images/<split>/x.jpg -> .../labels/<split>/x.txt"""
+    parts = Path(image_path).with_suffix(".txt").parts
+    return Path(*("labels" if part == "images" else part for part in parts))
+
+
+def read_data_yaml(data_yaml: str) -> Tuple[Path, Dict[str, Path], List[str]]:
+    """
+    Parse a YOLO data.yaml.
+    
+    Returns:
+        (dataset root, {split: image_dir or list file}, class_names)
+    """
+    data_yaml = Path(data_yaml)
+    with open(data_yaml, "r") as f:
+        data = yaml.safe_load(f)
+    
+    root = Path(data.get("path", data_yaml.parent))
+    if not root.is_absolute() and not root.exists():
+        root = data_yaml.parent / root
+    splits = {split: root / data[split] for split in ("train", "val", "test") if data.get(split)}
+    names = data["names"]
+    class_names = [names[i] for i in sorted(names)] if isinstance(names, dict) else list(names)
+    return root, splits, class_names
+
+
+def inspect_image(path: str) -> Tuple[int, int, Optional[str]]:
+    """
+    Read an image's size from its header and check it is complete.
+    
+    JPEGs need a start-of-frame marker and an end-of-image marker near the
+    end of the file (a missing one means a truncated upload); PNGs need an
+    IHDR and a final IEND chunk. Other formats are decoded with cv2.
+    
+    Returns:
+        (width, height, error message or None)
+    """
+    with open(path, "rb") as f:
+        head = f.read(32)
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return 0, 0, "empty file"
+        f.seek(max(size - 1024, 0))
+        tail = f.read()
+        
+        if head[:8] == b"\x89PNG\r\n\x1a\n":
+            if head[12:16] != b"IHDR":
+                return 0, 0, "PNG without IHDR header"
+            width, height = struct.unpack(">II", head[16:24])
+            if tail[-8:-4] != b"IEND":
+                return width, height, "PNG truncated (no IEND chunk)"
+            return width, height, _check_size(width, height)
+        
+        if head[:2] == b"\xff\xd8":
+            f.seek(2)
+            while True:
+                marker = f.read(4)
+                if len(marker) < 4 or marker[0] != 0xFF:
+                    return 0, 0, "JPEG without a frame header"
+                code, length = marker[1], struct.unpack(">H", marker[2:4])[0]
+                # Start-of-frame markers carry the dimensions
+                if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack(">xHH", f.read(5))
+                    break
+                f.seek(length - 2, os.SEEK_CUR)
+            # Some cameras pad after the end marker, so search the tail
+            if b"\xff\xd9" not in tail:
+                return width, height, "JPEG truncated (no end-of-image marker)"
+            return width, height, _check_size(width, height)
+    
+    image = cv2.imread(path)
+    if image is None:
+        return 0, 0, "unreadable image"
+    height, width = image.shape[:2]
+    return width, height, _check_size(width, height)
+
+
+def _check_size(width: int, height: int) -> Optional[str]:
+    if width < MIN_IMAGE_SIZE or height < MIN_IMAGE_SIZE:
+        return f"image too small ({width}x{height})"
+    return None
+
+
+def inspect_labels(path: Path, num_classes: int) -> Tuple[np.ndarray, List[str], List[str]]:
+    """
+    Parse and check a YOLO label file ("cls xc yc w h" per row, normalized).
+    
+    Returns:
+        (rows (M, 5) float32, errors, warnings). Rows with errors are
+        dropped; a missing or empty file is a background image (warning).
+    """
+    empty = np.zeros((0, 5), dtype=np.float32)
+    try:
+        with open(path, "r") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return empty, [], ["no label file (background image)"]
+    
+    numbered = [(n, line.split()) for n, line in enumerate(lines, 1) if line.strip()]
+    if not numbered:
+        return empty, [], ["empty label file (background image)"]
+    
+    errors = [f"line {n}: expected 5 values, got {len(tokens)}" for n, tokens in numbered if len(tokens) != 5]
+    numbered = [(n, tokens) for n, tokens in numbered if len(tokens) == 5]
+    try:
+        values = np.array([tokens for _, tokens in numbered], dtype=np.float64).reshape(-1, 5)
+    except ValueError:
+        return empty, errors + ["non-numeric value"], []
+    line_numbers = np.array([n for n, _ in numbered], dtype=np.int64)
+    
+    cls, xc, yc, w, h = values.T
+    checks = [
+        ((cls != np.round(cls)) | (cls < 0) | (cls >= num_classes), f"class ID outside 0..{num_classes - 1}"),
+        ((values[:, 1:] < 0).any(axis=1) | (values[:, 1:] > 1).any(axis=1), "coordinates outside [0, 1]"),
+        ((w <= 0) | (h <= 0), "zero-size box"),
+    ]
+    bad = np.zeros(len(values), dtype=bool)
+    for mask, message in checks:
+        errors.extend(f"line {n}: {message}" for n in line_numbers[mask & ~bad])
+        bad |= mask
+    values = values[~bad]
+    
+    warnings = []
+    overhang = 1e-3
+    outside = (
+        (values[:, 1] - values[:, 3] / 2 < -overhang) | (values[:, 1] + values[:, 3] / 2 > 1 + overhang)
+        | (values[:, 2] - values[:, 4] / 2 < -overhang) | (values[:, 2] + values[:, 4] / 2 > 1 + overhang)
+    )
+    if outside.any():
+        warnings.append(f"{int(outside.sum())} box(es) extend past the image edge")
+    unique = np.unique(values, axis=0)
+    if len(unique) < len(values):
+        warnings.append(f"{len(values) - len(unique)} duplicate row(s)")
+    return values.astype(np.float32), errors, warnings
+
+
+def _scan_one(item: Tuple[str, str, int, int, int]) -> Tuple[str, dict, np.ndarray]:
+    """Worker: inspect one image and its label file."""
+    path, split, mtime_ns, label_mtime_ns, num_classes = item
+    width, height, image_error = inspect_image(path)
+    rows, errors, warnings = inspect_labels(label_path_for(path), num_classes)
+    if image_error:
+        errors.insert(0, image_error)
+    entry = {
+        "split": split,
+        "mtime_ns": mtime_ns,
+        "label_mtime_ns": label_mtime_ns,
+        "width": width,
+        "height": height,
+        "errors": errors,
+        "warnings": warnings,
+    }
+    return path, entry, rows
+
+
+def _mtime_ns(path: Path) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return -1
+
+
+class DatasetIndex:
+    """
+    Cached scan of a YOLO dataset, keyed by absolute image path.
+    
+    entries[path] holds split, width, height, offset and count into the
+    flat labels array, and the image's errors and warnings. update()
+    rescans new images and those whose image or label file changed, and
+    drops images that no longer exist. Splits whose image directory or
+    list file is missing are recorded in missing_splits and skipped.
+    """
+    
+    def __init__(self, cache_dir: str = "dataset/.cache"):
+        self.cache_dir = Path(cache_dir)
+        self.index_path = self.cache_dir / "dataset_index.json"
+        self.labels_path = self.cache_dir / "dataset_index.labels.npy"
+        self.class_names: List[str] = []
+        self.entries: Dict[str, dict] = {}
+        self.orphans: List[str] = []
+        self.missing_splits: Dict[str, str] = {}
+        self.labels = np.zeros((0, 5), dtype=np.float32)
+        
+        if self.index_path.exists() and self.labels_path.exists():
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            self.class_names = index["class_names"]
+            self.entries = index["entries"]
+            self.orphans = index["orphans"]
+            self.missing_splits = index.get("missing_splits", {})
+            self.labels = np.load(self.labels_path)
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def labels_for(self, path: str) -> np.ndarray:
+        """(M, 5) [class, xc, yc, w, h] rows of one image."""
+        entry = self.entries[os.path.abspath(path)]
+        return self.labels[entry["offset"]:entry["offset"] + entry["count"]]
+    
+    def update(
+        self,
+        splits: Dict[str, Path],
+        class_names: Sequence[str],
+        workers: int = None,
+    ) -> Dict[str, int]:
+        """
+        Scan {split: image_dir} and refresh the index.
+        
+        Args:
+            splits: Image directory or list file per split (labels via
+                label_path_for)
+            class_names: Valid classes; label class IDs index this list
+            workers: Scanner processes (default: CPU count)
+        
+        Returns:
+            Counts of reused, scanned and removed images
+        """
+        class_names = list(class_names)
+        if class_names != self.class_names:
+            # Class checks depend on the class list, so start over
+            self.entries, self.labels = {}, np.zeros((0, 5), dtype=np.float32)
+            self.class_names = class_names
+        
+        todo, keep = [], {}
+        label_files = set()
+        self.missing_splits = {}
+        for split, image_dir in splits.items():
+            image_dir = Path(image_dir)
+            if not image_dir.exists():
+                self.missing_splits[split] = str(image_dir)
+                continue
+            paths = [os.path.abspath(p) for p in find_images([image_dir])]
+            if image_dir.is_dir():
+                label_dirs = [label_path_for(str(image_dir / "x")).parent]
+            else:
+                label_dirs = sorted({label_path_for(path).parent for path in paths})
+            for label_dir in label_dirs:
+                label_files.update(os.path.abspath(p) for p in label_dir.rglob("*.txt"))
+            for path in paths:
+                mtime_ns = _mtime_ns(path)
+                if mtime_ns < 0:
+                    continue  # listed in a split file but gone
+                label_mtime_ns = _mtime_ns(label_path_for(path))
+                entry = self.entries.get(path)
+                if (
+                    entry is not None and entry["split"] == split
+                    and entry["mtime_ns"] == mtime_ns and entry["label_mtime_ns"] == label_mtime_ns
+                ):
+                    keep[path] = entry
+                else:
+                    todo.append((path, split, mtime_ns, label_mtime_ns, len(class_names)))
+        seen = set(keep) | {item[0] for item in todo}
+        counts = {"reused": len(keep), "scanned": len(todo), "removed": len(set(self.entries) - seen)}
+        
+        rows = {path: self.labels[entry["offset"]:entry["offset"] + entry["count"]] for path, entry in keep.items()}
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                scanned = list(pool.map(_scan_one, todo, chunksize=max(1, min(256, len(todo) // (4 * workers)))))
+        else:
+            scanned = [_scan_one(item) for item in todo]
+        for path, entry, labels in scanned:
+            keep[path] = entry
+            rows[path] = labels
+        
+        # Rebuild the flat label array in path order
+        self.entries = {}
+        offset = 0
+        for path in sorted(keep):
+            entry = keep[path]
+            entry["offset"], entry["count"] = offset, len(rows[path])
+            offset += entry["count"]
+            self.entries[path] = entry
+        self.labels = (
+            np.concatenate([rows[path] for path in self.entries]).astype(np.float32)
+            if self.entries else np.zeros((0, 5), dtype=np.float32)
+        )
+        expected = {os.path.abspath(label_path_for(path)) for path in self.entries}
+        self.orphans = sorted(label_files - expected)
+        self._save()
+        return counts
+    
+    def _save(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        np.save(self.labels_path.with_suffix(".tmp.npy"), self.labels)
+        os.replace(self.labels_path.with_suffix(".tmp.npy"), self.labels_path)
+        tmp_path = self.index_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "class_names": self.class_names,
+                "entries": self.entries,
+                "orphans": self.orphans,
+                "missing_splits": self.missing_splits,
+            }, f)
+        os.replace(tmp_path, self.index_path)
+    
+    def report(self) -> Dict:
+        """
+        Dataset summary: images per split, per-class box counts and box
+        size histograms (SIZE_BINS, sqrt of box area in original pixels),
+        and every error, warning, orphan label file and missing split.
+        """
+        num_classes = len(self.class_names)
+        entries = list(self.entries.values())
+        counts = np.array([e["count"] for e in entries], dtype=np.int64)
+        widths = np.repeat([e["width"] for e in entries], counts)
+        heights = np.repeat([e["height"] for e in entries], counts)
+        classes = self.labels[:, 0].astype(np.int64)
+        sizes = np.sqrt(self.labels[:, 3] * widths * self.labels[:, 4] * heights)
+        size_bins = np.digitize(sizes, SIZE_BINS[1:-1])
+        histograms = np.zeros((num_classes, len(SIZE_BINS) - 1), dtype=np.int64)
+        np.add.at(histograms, (classes, size_bins), 1)
+        
+        splits = {}
+        for entry in entries:
+            split = splits.setdefault(entry["split"], {"images": 0, "boxes": 0, "background": 0})
+            split["images"] += 1
+            split["boxes"] += entry["count"]
+            split["background"] += entry["count"] == 0
+        return {
+            "images": len(entries),
+            "boxes": int(len(self.labels)),
+            "splits": splits,
+            "size_bins": [f"{lo}-{hi}" if np.isfinite(hi) else f"{lo}+" for lo, hi in zip(SIZE_BINS[:-1], SIZE_BINS[1:])],
+            "classes": {
+                name: {"boxes": int(histograms[c].sum()), "size_histogram": histograms[c].tolist()}
+                for c, name in enumerate(self.class_names)
+            },
+            "errors": {path: e["errors"] for path, e in self.entries.items() if e["errors"]},
+            "warnings": {path: e["warnings"] for path, e in self.entries.items() if e["warnings"]},
+            "orphan_labels": self.orphans,
+            "missing_splits": self.missing_splits,
+        }
+
+
+def validate_dataset(
+    data_yaml: str,
+    class_names: Sequence[str] = None,
+    cache_dir: str = "dataset/.cache",
+    workers: int = None,
+) -> Dict:
+    """
+    Index and validate the dataset a data.yaml points at.
+    
+    class_names defaults to the names in data.yaml. Returns the report
+    of DatasetIndex.report() plus the update counts under "scan".
+    """
+    _root, splits, yaml_names = read_data_yaml(data_yaml)
+    index = DatasetIndex(cache_dir)
+    scan = index.update(splits, class_names or yaml_names, workers=workers)
+    report = index.report()
+    report["scan"] = scan
+    return report
+
+
+def print_report(report: Dict, max_problems: int = 20):
+    """Human-readable summary of a validate_dataset report."""
+    scan = report.get("scan")
+    for split, path in sorted(report.get("missing_splits", {}).items()):
+        print(f"Warning: {split} split not found at {path}; skipped")
+    if scan:
+        print(f"Indexed {report['images']} images ({scan['scanned']} scanned, "
+              f"{scan['reused']} unchanged, {scan['removed']} removed)")
+    for split, stats in sorted(report["splits"].items()):
+        print(f"  {split:<6} {stats['images']:>7} images {stats['boxes']:>8} boxes "
+              f"{stats['background']:>6} background")
+    
+    print(f"\n{'Class':<22} {'Boxes':>7}  " + " ".join(f"{b:>8}" for b in report["size_bins"]))
+    for name, stats in report["classes"].items():
+        print(f"{name:<22} {stats['boxes']:>7}  " + " ".join(f"{n:>8}" for n in stats["size_histogram"]))
+    
+    for title, problems in (("Errors", report["errors"]), ("Warnings", report["warnings"])):
+        if problems:
+            print(f"\n{title} in {len(problems)} image(s):")
+            for path, messages in list(problems.items())[:max_problems]:
+                print(f"  {path}: {'; '.join(messages)}")
+            if len(problems) > max_problems:
+                print(f"  ... and {len(problems) - max_problems} more")
+    if report["orphan_labels"]:
+        print(f"\n{len(report['orphan_labels'])} label file(s) without an image:")
+        for path in report["orphan_labels"][:max_problems]:
+            print(f"  {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index and validate a YOLO dataset")
+    parser.add_argument("--data", default="dataset/data.yaml", help="YOLO data.yaml")
+    parser.add_argument("--cache-dir", default="dataset/.cache", help="Index directory")
+    parser.add_argument("--workers", type=int, default=None, help="Scanner processes (default: CPU count)")
+    parser.add_argument("--json", default=None, help="Also write the full report to this file")
+    args = parser.parse_args()
+    
+    report = validate_dataset(args.data, cache_dir=args.cache_dir, workers=args.workers)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,24 @@ Model evaluation utilities for PeanutGuard detection pipeline.
 Computes mAP, precision, recall, F1, and per-class metrics.
 """
 
+import argparse
+import json
 import numpy as np
-from typing import List, Dict, Tuple
-from collections import defaultdict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, List, Dict, Optional, Sequence, Tuple, Union
+from itertools import chain, islice
+
+from .boxes import aligned_iou, box_iou, xywhn_to_xyxy
+from .instrumentation import timed
 
 
 def compute_iou(box1: np.ndarray, box2: np.ndarray) -> float:
-    """Compute IoU between two bounding boxes [x1, y1, x2, y2]."""
+    """
+    Compute IoU between two bounding boxes [x1, y1, x2, y2]; see
+    compute_iou_matrix / utils.boxes for whole box sets.
+    """
     x1 = max(box1[0], box2[0])
     y1 = max(box1[1], box2[1])
     x2 = min(box1[2], box2[2])
@@ -24,121 +35,875 @@ def compute_iou(box1: np.ndarray, box2: np.ndarray) -> float:
     return intersection / union if union > 0 else 0
 
 
-def compute_ap(recalls: np.ndarray, precisions: np.ndarray) -> float:
-    """Compute Average Precision using 11-point interpolation."""
-    ap = 0.0
-    for t in np.arange(0.0, 1.1, 0.1):
-        if np.sum(recalls >= t) == 0:
-            p = 0
-        else:
-            p = np.max(precisions[recalls >= t])
-        ap += p / 11.0
-    return ap
+# IoU thresholds used by COCO and Ultralytics for mAP@0.5:0.95
+COCO_IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
 
+AP_METHODS = ("11point", "101point", "all")
 
-def evaluate_detections(
+
+def compute_ap(recalls: np.ndarray, precisions: np.ndarray, method: str = "11point") -> float:
+    """
+    Compute Average Precision from a precision/recall curve.
+    
+    Methods:
+        11point:  Pascal VOC 2007 11-point interpolation
+        101point: COCO 101-point interpolation
+        all:      area under the interpolated curve at every recall change
+                  (VOC 2010+ / Ultralytics "continuous")
+    """
+    if method == "11point":
+        ap = 0.0
+        for t in np.arange(0.0, 1.1, 0.1):
+            if np.sum(recalls >= t) == 0:
+                p = 0
+            else:
+                p = np.max(precisions[recalls >= t])
+            ap += p / 11.0
+        return ap
+    
+    if method not in AP_METHODS:
+        raise ValueError(f"Unknown AP method '{method}', expected one of {AP_METHODS}")
+    if len(recalls) == 0:
+        return 0.0
+    
+    # Precision envelope: best precision at this recall or any higher one
+    envelope = np.maximum.accumulate(np.asarray(precisions, dtype=np.float64)[::-1])[::-1]
+    
+    if method == "101point":
+        idx = np.searchsorted(recalls, np.linspace(0.0, 1.0, 101), side="left")
+        p = np.zeros(101, dtype=np.float64)
+        p[idx < len(envelope)] = envelope[idx[idx < len(envelope)]]
+        return float(np.mean(p))
+    
+    mrec = np.concatenate(([0.0], recalls))
+    return float(np.sum(np.diff(mrec) * envelope))
+
+
+def compute_iou_matrix(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """
+    Compute pairwise IoU between two sets of boxes [x1, y1, x2, y2].
+    
+    (N, 4) x (M, 4) gives an (N, M) matrix; leading batch dimensions
+    broadcast, so (B, N, 4) x (B, M, 4) gives (B, N, M).
+    """
+    return box_iou(boxes1, boxes2)
+
+
+def _gather(items: List[Dict], key: str, counts: np.ndarray, dtype, width: int = 0) -> np.ndarray:
+    """Concatenate one field of many per-image dicts into a single flat array."""
+    shape = (int(counts.sum()), width) if width else (int(counts.sum()),)
+    if shape[0] == 0:
+        return np.empty(shape, dtype=dtype)
+    values = list(chain.from_iterable(item.get(key, []) for item in items))
+    return np.asarray(values, dtype=dtype).reshape(shape)
+
+
+def _match_agnostic(
+    det_image: np.ndarray,
+    det_scores: np.ndarray,
+    det_boxes: np.ndarray,
+    gt_counts: np.ndarray,
+    gt_boxes: np.ndarray,
+    iou_threshold: float,
+    conf_threshold: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Class-agnostic one-to-one matching of confident predictions to ground
+    truths, as in the Ultralytics confusion matrix: pairs of the same image
+    with IoU above iou_threshold are ranked by IoU, each prediction keeps
+    its best ground truth and each ground truth then its best prediction.
+    
+    Returns:
+        (det indices, gt indices) of the matched pairs
+    """
+    confident = np.flatnonzero(det_scores >= conf_threshold)
+    gt_end = np.cumsum(gt_counts)
+    run_len = gt_counts[det_image[confident]]
+    n_pairs = int(run_len.sum())
+    if n_pairs == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    
+    pair_start = np.cumsum(run_len) - run_len
+    gt_start = (gt_end - gt_counts)[det_image[confident]]
+    pair_det = np.repeat(confident, run_len)
+    pair_gt = np.repeat(gt_start - pair_start, run_len) + np.arange(n_pairs)
+    pair_iou = aligned_iou(det_boxes[pair_det], gt_boxes[pair_gt])
+    
+    keep = pair_iou > iou_threshold
+    order = np.argsort(-pair_iou[keep], kind="stable")
+    pair_det, pair_gt = pair_det[keep][order], pair_gt[keep][order]
+    
+    # Best ground truth per prediction, then best prediction per ground
+    # truth; first occurrences are taken in IoU order
+    _, first = np.unique(pair_det, return_index=True)
+    first.sort()
+    pair_det, pair_gt = pair_det[first], pair_gt[first]
+    _, first = np.unique(pair_gt, return_index=True)
+    return pair_det[first], pair_gt[first]
+
+
+def match_detections(
     predictions: List[Dict],
     ground_truths: List[Dict],
-    iou_threshold: float = 0.5,
-    num_classes: int = 8,
-    class_names: List[str] = None,
-) -> Dict:
+    iou_thresholds: Union[float, Sequence[float]] = 0.5,
+    agnostic_iou: Optional[float] = None,
+    agnostic_conf: float = 0.25,
+) -> Dict[str, np.ndarray]:
     """
-    Evaluate detection results against ground truth.
+    Greedily match predictions to ground truths for a batch of images.
     
-    Args:
-        predictions: List of {boxes, scores, labels} per image
-        ground_truths: List of {boxes, labels} per image
-        iou_threshold: IoU threshold for matching
-        num_classes: Number of classes
-        class_names: Optional class name mapping
+    Within each image, predictions are visited in descending score order
+    (ties keep input order); each takes the unmatched same-class ground
+    truth with the highest IoU and is a true positive if that IoU reaches
+    the threshold. Matching for every threshold in iou_thresholds is done
+    in the same pass over one set of IoUs.
+    
+    All images are matched together on flat arrays: IoU is computed only
+    for same-class (prediction, ground truth) pairs of the same image, and
+    the Python-level greedy loop runs only for images where two candidate
+    predictions compete for the same ground truth.
+    
+    With agnostic_iou, predictions scoring at least agnostic_conf are also
+    matched regardless of class (see _match_agnostic) on the same flat
+    arrays, for the confusion matrix.
     
     Returns:
-        Dictionary with mAP, per-class AP, precision, recall
+        Dictionary of flat arrays: det_labels, det_scores, det_tp of shape
+        (n_predictions, n_thresholds) (image by image in score order), and
+        gt_labels; with agnostic_iou also agnostic_det and agnostic_gt,
+        the indices of class-agnostic matched pairs into those arrays
     """
-    if class_names is None:
-        class_names = [f"class_{i}" for i in range(num_classes)]
+    thresholds = np.atleast_1d(np.asarray(iou_thresholds, dtype=np.float64))
     
-    all_detections = defaultdict(list)
-    all_annotations = defaultdict(int)
+    pred_counts = np.fromiter((len(p.get("scores", [])) for p in predictions), dtype=np.int64, count=len(predictions))
+    gt_counts = np.fromiter((len(g.get("labels", [])) for g in ground_truths), dtype=np.int64, count=len(ground_truths))
     
-    for img_idx, (pred, gt) in enumerate(zip(predictions, ground_truths)):
-        gt_boxes = gt.get("boxes", [])
-        gt_labels = gt.get("labels", [])
-        
-        pred_boxes = pred.get("boxes", [])
-        pred_scores = pred.get("scores", [])
-        pred_labels = pred.get("labels", [])
-        
-        # Count ground truth per class
-        for label in gt_labels:
-            all_annotations[label] += 1
+    det_image = np.repeat(np.arange(len(pred_counts)), pred_counts)
+    det_scores = _gather(predictions, "scores", pred_counts, np.float64)
+    order = np.lexsort((-det_scores, det_image))
+    det_scores = det_scores[order]
+    det_labels = _gather(predictions, "labels", pred_counts, np.int64)[order]
+    det_boxes = _gather(predictions, "boxes", pred_counts, np.float64, width=4)[order]
+    
+    gt_image = np.repeat(np.arange(len(gt_counts)), gt_counts)
+    gt_labels = _gather(ground_truths, "labels", gt_counts, np.int64)
+    gt_boxes = _gather(ground_truths, "boxes", gt_counts, np.float64, width=4)
+    det_tp = np.zeros((len(det_scores), len(thresholds)), dtype=bool)
+    
+    matches = {
+        "det_labels": det_labels,
+        "det_scores": det_scores,
+        "det_tp": det_tp,
+        "gt_labels": gt_labels,
+    }
+    if agnostic_iou is not None:
+        matches["agnostic_det"], matches["agnostic_gt"] = _match_agnostic(
+            det_image, det_scores, det_boxes, gt_counts, gt_boxes, agnostic_iou, agnostic_conf,
+        )
+    if len(det_scores) == 0 or len(gt_labels) == 0:
+        return matches
+    
+    # Key every box by (image, class) and find each prediction's run of
+    # same-class ground truths in the key-sorted GT order
+    low = min(det_labels.min(), gt_labels.min())
+    span = max(det_labels.max(), gt_labels.max()) - low + 1
+    gt_key = gt_image * span + (gt_labels - low)
+    gt_order = np.argsort(gt_key, kind="stable")
+    gt_key = gt_key[gt_order]
+    det_key = det_image * span + (det_labels - low)
+    run_start = np.searchsorted(gt_key, det_key, side="left")
+    run_len = np.searchsorted(gt_key, det_key, side="right") - run_start
+    
+    # Expand into one row per same-class pair, grouped by prediction with
+    # GTs in original index order inside each group
+    n_pairs = int(run_len.sum())
+    pair_start = np.cumsum(run_len) - run_len
+    pair_det = np.repeat(np.arange(len(det_scores)), run_len)
+    pair_gt = gt_order[np.repeat(run_start - pair_start, run_len) + np.arange(n_pairs)]
+    pair_iou = aligned_iou(det_boxes[pair_det], gt_boxes[pair_gt])
+    
+    # Each prediction's best GT if nothing had been matched yet (first
+    # index wins ties, as in a strict ">" scan)
+    has_pairs = run_len > 0
+    seg_start = pair_start[has_pairs]
+    best_iou = np.zeros(len(det_scores), dtype=np.float64)
+    best_iou[has_pairs] = np.maximum.reduceat(pair_iou, seg_start)
+    first_max = np.where(pair_iou == best_iou[pair_det], np.arange(n_pairs), n_pairs)
+    best_gt = np.full(len(det_scores), -1, dtype=np.int64)
+    best_gt[has_pairs] = pair_gt[np.minimum.reduceat(first_max, seg_start)]
+    
+    det_tp[:] = (best_iou[:, np.newaxis] > 0) & (best_iou[:, np.newaxis] >= thresholds)
+    
+    # Until two candidates compete for one GT, greedy matching agrees with
+    # the unconstrained choices; redo each contested image from its first
+    # contested prediction onwards
+    contested = np.zeros(len(det_scores), dtype=bool)
+    for t in range(len(thresholds)):
+        cand_idx = np.flatnonzero(det_tp[:, t])
+        _, first_seen = np.unique(best_gt[cand_idx], return_index=True)
+        repeat = np.ones(len(cand_idx), dtype=bool)
+        repeat[first_seen] = False
+        contested[cand_idx[repeat]] = True
+    
+    contested_dets = np.flatnonzero(contested)
+    _, first_in_image = np.unique(det_image[contested_dets], return_index=True)
+    image_end = np.cumsum(pred_counts)
+    gt_end = np.cumsum(gt_counts)
+    all_thresholds = np.arange(len(thresholds))
+    
+    for split in contested_dets[first_in_image]:
+        image = det_image[split]
+        start, end = image_end[image] - pred_counts[image], image_end[image]
+        gt_start = gt_end[image] - gt_counts[image]
         
-        # Match predictions to ground truths
-        matched_gt = set()
+        available = np.ones((len(thresholds), gt_counts[image]), dtype=bool)
+        prefix_det, prefix_t = np.nonzero(det_tp[start:split])
+        available[prefix_t, best_gt[start + prefix_det] - gt_start] = False
+        det_tp[split:end] = False
         
-        for det_idx in np.argsort(-np.array(pred_scores)):
-            det_box = pred_boxes[det_idx]
-            det_label = pred_labels[det_idx]
-            det_score = pred_scores[det_idx]
-            
-            best_iou = 0
-            best_gt_idx = -1
-            
-            for gt_idx, (gt_box, gt_label) in enumerate(zip(gt_boxes, gt_labels)):
-                if gt_label != det_label or gt_idx in matched_gt:
-                    continue
-                iou = compute_iou(np.array(det_box), np.array(gt_box))
-                if iou > best_iou:
-                    best_iou = iou
-                    best_gt_idx = gt_idx
-            
-            tp = 1 if best_iou >= iou_threshold and best_gt_idx >= 0 else 0
-            if tp:
-                matched_gt.add(best_gt_idx)
-            
-            all_detections[det_label].append({
-                "score": det_score,
-                "tp": tp,
-            })
-    
-    # Compute per-class AP
+        for det_idx in split + np.flatnonzero(best_iou[split:end] > 0):
+            seg = slice(pair_start[det_idx], pair_start[det_idx] + run_len[det_idx])
+            cols = pair_gt[seg] - gt_start
+            rows = np.where(available[:, cols], pair_iou[seg], 0.0)
+            k = np.argmax(rows, axis=1)
+            best = rows[all_thresholds, k]
+            hit = (best > 0) & (best >= thresholds)
+            det_tp[det_idx, hit] = True
+            available[hit, cols[k[hit]]] = False
+    
+    return matches
+
+
+def _summarize(
+    det_labels: np.ndarray,
+    det_tp: np.ndarray,
+    det_scores: np.ndarray,
+    gt_counts: np.ndarray,
+    total_predictions: int,
+    total_ground_truth: int,
+    class_names: List[str],
+    iou_thresholds: np.ndarray,
+    ap_method: str = "11point",
+) -> Dict:
+    """Turn accumulated matching results into per-class AP/precision/recall."""
+    num_classes = len(gt_counts)
+    
+    # Group by class, highest score first; stable so ties keep image order
+    order = np.lexsort((-det_scores, det_labels))
+    det_labels = det_labels[order]
+    det_tp = det_tp[order]
+    class_bounds = np.searchsorted(det_labels, np.arange(num_classes + 1))
+    multi = len(iou_thresholds) > 1
+    
     results = {}
     aps = []
     
     for cls_id in range(num_classes):
-        dets = sorted(all_detections[cls_id], key=lambda x: -x["score"])
-        n_gt = all_annotations[cls_id]
+        tp = det_tp[class_bounds[cls_id]:class_bounds[cls_id + 1]]
+        n_gt = int(gt_counts[cls_id])
         
         if n_gt == 0:
             results[class_names[cls_id]] = {"AP": 0.0, "precision": 0.0, "recall": 0.0}
             continue
         
-        tp_cumsum = np.cumsum([d["tp"] for d in dets])
-        fp_cumsum = np.cumsum([1 - d["tp"] for d in dets])
+        tp_cumsum = np.cumsum(tp, axis=0, dtype=np.int64)
+        fp_cumsum = np.arange(1, len(tp) + 1)[:, np.newaxis] - tp_cumsum
         
         recalls = tp_cumsum / n_gt
         precisions = tp_cumsum / (tp_cumsum + fp_cumsum)
         
-        ap = compute_ap(recalls, precisions)
-        aps.append(ap)
+        class_aps = [
+            compute_ap(recalls[:, t], precisions[:, t], ap_method)
+            for t in range(len(iou_thresholds))
+        ]
+        aps.append(class_aps)
         
+        # Precision/recall are reported at the first (loosest) threshold
         results[class_names[cls_id]] = {
-            "AP": float(ap),
-            "precision": float(precisions[-1]) if len(precisions) > 0 else 0.0,
-            "recall": float(recalls[-1]) if len(recalls) > 0 else 0.0,
-            "n_predictions": len(dets),
+            "AP": float(np.mean(class_aps)) if multi else float(class_aps[0]),
+            "precision": float(precisions[-1, 0]) if len(precisions) > 0 else 0.0,
+            "recall": float(recalls[-1, 0]) if len(recalls) > 0 else 0.0,
+            "n_predictions": len(tp),
             "n_ground_truth": n_gt,
         }
+        if multi:
+            results[class_names[cls_id]]["AP_per_threshold"] = [float(ap) for ap in class_aps]
     
-    mAP = np.mean(aps) if aps else 0.0
+    if not multi:
+        mAP = np.mean([ap[0] for ap in aps]) if aps else 0.0
+        return {
+            "mAP@0.5": float(mAP),
+            "per_class": results,
+            "total_predictions": total_predictions,
+            "total_ground_truth": total_ground_truth,
+        }
     
-    return {
-        "mAP@0.5": float(mAP),
+    # Averaged per threshold exactly as a single-threshold run averages
+    map_per_threshold = np.array([np.mean([ap[t] for ap in aps]) if aps else 0.0 for t in range(len(iou_thresholds))])
+    summary = {
+        f"mAP@{iou_thresholds[0]:g}:{iou_thresholds[-1]:g}": float(np.mean(map_per_threshold)),
         "per_class": results,
-        "total_predictions": sum(len(v) for v in all_detections.values()),
-        "total_ground_truth": sum(all_annotations.values()),
+        "total_predictions": total_predictions,
+        "total_ground_truth": total_ground_truth,
+        "iou_thresholds": [float(t) for t in iou_thresholds],
+        "mAP_per_threshold": [float(m) for m in map_per_threshold],
+    }
+    at_half = np.flatnonzero(np.isclose(iou_thresholds, 0.5))
+    if len(at_half):
+        summary["mAP@0.5"] = float(map_per_threshold[at_half[0]])
+    return summary
+
+
+def _confusion_counts(matches: Dict[str, np.ndarray], num_classes: int, conf_threshold: float) -> np.ndarray:
+    """
+    (num_classes + 1)^2 confusion counts from class-agnostic matches, with
+    ground truth classes as rows and predicted classes as columns; the
+    last row/column is background (false positives / missed objects).
+    Boxes with out-of-range classes are left out.
+    """
+    det_labels, gt_labels = matches["det_labels"], matches["gt_labels"]
+    det_idx, gt_idx = matches["agnostic_det"], matches["agnostic_gt"]
+    background = num_classes
+    
+    def in_range(labels: np.ndarray) -> np.ndarray:
+        return np.where((labels >= 0) & (labels < num_classes), labels, -1)
+    
+    predicted = np.full(len(gt_labels), background, dtype=np.int64)
+    predicted[gt_idx] = in_range(det_labels[det_idx])
+    unmatched = matches["det_scores"] >= conf_threshold
+    unmatched[det_idx] = False
+    false_positives = det_labels[unmatched]
+    
+    rows = np.concatenate([in_range(gt_labels), np.full(len(false_positives), background)])
+    cols = np.concatenate([predicted, in_range(false_positives)])
+    keep = (rows >= 0) & (cols >= 0)
+    size = num_classes + 1
+    return np.bincount(rows[keep] * size + cols[keep], minlength=size * size).reshape(size, size)
+
+
+def _confidence_curves(
+    det_labels: np.ndarray,
+    det_tp: np.ndarray,
+    det_scores: np.ndarray,
+    gt_counts: np.ndarray,
+    n_points: int = 101,
+) -> Dict[str, np.ndarray]:
+    """
+    Per-class precision, recall and F1 when keeping predictions scoring at
+    least each of n_points confidences evenly spaced over [0, 1], at the
+    first IoU threshold. Precision is 1 where no prediction is kept.
+    
+    All classes are read off one cumulative TP count: with predictions
+    sorted by class and descending score, the key 2 * class + (1 - score)
+    is ascending, so one searchsorted finds every (class, confidence) cut.
+    """
+    num_classes = len(gt_counts)
+    confidence = np.linspace(0.0, 1.0, n_points)
+    order = np.lexsort((-det_scores, det_labels))
+    key = det_labels[order] * 2.0 + (1.0 - det_scores[order])
+    tp_cumsum = np.concatenate([[0], np.cumsum(det_tp[order, 0], dtype=np.int64)])
+    
+    class_start = np.searchsorted(key, np.arange(num_classes) * 2.0)
+    cut = np.searchsorted(key, np.arange(num_classes)[:, np.newaxis] * 2.0 + (1.0 - confidence), side="right")
+    kept = cut - class_start[:, np.newaxis]
+    hits = tp_cumsum[cut] - tp_cumsum[class_start][:, np.newaxis]
+    
+    precision = np.ones(kept.shape, dtype=np.float64)
+    np.divide(hits, kept, out=precision, where=kept > 0)
+    recall = np.zeros(kept.shape, dtype=np.float64)
+    np.divide(hits, gt_counts[:, np.newaxis], out=recall, where=gt_counts[:, np.newaxis] > 0)
+    f1 = np.zeros(kept.shape, dtype=np.float64)
+    np.divide(2 * precision * recall, precision + recall, out=f1, where=precision + recall > 0)
+    return {"confidence": confidence, "precision": precision, "recall": recall, "f1": f1}
+
+
+def optimal_thresholds(curves: Dict[str, np.ndarray], gt_counts: np.ndarray, class_names: List[str]) -> Dict:
+    """
+    Confidence threshold maximizing F1 for each class with ground truth,
+    plus "all": the single threshold maximizing the mean F1 over them.
+    Ties go to the lowest confidence.
+    """
+    confidence = np.asarray(curves["confidence"])
+    precision, recall, f1 = (np.asarray(curves[key]) for key in ("precision", "recall", "f1"))
+    present = np.flatnonzero(np.asarray(gt_counts) > 0)
+    
+    def row(i: int, p: float, r: float, score: float) -> Dict:
+        return {"confidence": float(confidence[i]), "precision": float(p), "recall": float(r), "F1": float(score)}
+    
+    table = {}
+    for cls_id in present:
+        i = int(np.argmax(f1[cls_id]))
+        table[class_names[cls_id]] = row(i, precision[cls_id, i], recall[cls_id, i], f1[cls_id, i])
+    if len(present):
+        mean_f1 = f1[present].mean(axis=0)
+        i = int(np.argmax(mean_f1))
+        table["all"] = row(i, precision[present, i].mean(), recall[present, i].mean(), mean_f1[i])
+    return table
+
+
+class _GrowableArray:
+    """Append-only array with amortized doubling, trimmed when pickled."""
+    
+    def __init__(self, dtype, width: int = 0, capacity: int = 1024):
+        self._shape_tail = (width,) if width else ()
+        self._data = np.empty((capacity,) + self._shape_tail, dtype=dtype)
+        self._size = 0
+    
+    def extend(self, values: np.ndarray):
+        end = self._size + len(values)
+        if end > len(self._data):
+            grown = np.empty((max(end, 2 * len(self._data)),) + self._shape_tail, dtype=self._data.dtype)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:end] = values
+        self._size = end
+    
+    @property
+    def values(self) -> np.ndarray:
+        return self._data[:self._size]
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def __getstate__(self):
+        return {"_shape_tail": self._shape_tail, "_data": self.values.copy(), "_size": self._size}
+
+
+class IncrementalEvaluator:
+    """
+    Streaming accumulator for evaluate_detections.
+    
+    Images are fed with update(pred, gt) and matched in batches of
+    batch_size; only compact per-prediction (class, score, TP) arrays and
+    per-class GT counts are kept, so memory does not depend on how many
+    boxes each image had. Partial evaluators built over disjoint sets of
+    images (e.g. by separate workers) can be combined with merge().
+    
+    With confusion_iou, a class-agnostic confusion matrix of predictions
+    scoring at least confusion_conf is accumulated in the same matching
+    pass; with curve_points, compute() also returns per-class precision,
+    recall and F1 against confidence and the F1-optimal thresholds.
+    
+    Example:
+        evaluator = IncrementalEvaluator(num_classes=8)
+        for pred, gt in iter_yolo_txt_pairs("runs/predict/labels", "dataset/labels/test"):
+            evaluator.update(pred, gt)
+        results = evaluator.compute()
+    """
+    
+    def __init__(
+        self,
+        num_classes: int = 8,
+        class_names: List[str] = None,
+        iou_thresholds: Union[float, Sequence[float]] = 0.5,
+        ap_method: str = "11point",
+        batch_size: int = 256,
+        confusion_iou: Optional[float] = None,
+        confusion_conf: float = 0.25,
+        curve_points: int = 0,
+    ):
+        if ap_method not in AP_METHODS:
+            raise ValueError(f"Unknown AP method '{ap_method}', expected one of {AP_METHODS}")
+        self.num_classes = num_classes
+        self.class_names = class_names or [f"class_{i}" for i in range(num_classes)]
+        self.iou_thresholds = np.atleast_1d(np.asarray(iou_thresholds, dtype=np.float64))
+        self.ap_method = ap_method
+        self.batch_size = batch_size
+        self.confusion_iou = confusion_iou
+        self.confusion_conf = confusion_conf
+        self.curve_points = curve_points
+        
+        self._labels = _GrowableArray(np.int32)
+        self._scores = _GrowableArray(np.float64)
+        self._tp = _GrowableArray(bool, width=len(self.iou_thresholds))
+        self._gt_counts = np.zeros(num_classes, dtype=np.int64)
+        self._confusion = np.zeros((num_classes + 1, num_classes + 1), dtype=np.int64)
+        self._total_predictions = 0
+        self._total_ground_truth = 0
+        self._pending = []
+    
+    def update(self, pred: Dict, gt: Dict):
+        """Add one image's {boxes, scores, labels} and {boxes, labels}."""
+        self._pending.append((pred, gt))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+    
+    def update_batch(self, predictions: List[Dict], ground_truths: List[Dict]):
+        """Add many images at once, matched together in a single pass."""
+        self._flush()
+        self._accumulate(predictions, ground_truths)
+    
+    def merge(self, other: "IncrementalEvaluator") -> "IncrementalEvaluator":
+        """Append another evaluator's images after this one's."""
+        if (other.num_classes != self.num_classes
+                or not np.array_equal(other.iou_thresholds, self.iou_thresholds)
+                or (other.confusion_iou, other.confusion_conf) != (self.confusion_iou, self.confusion_conf)):
+            raise ValueError("Cannot merge evaluators with different classes, IoU thresholds or confusion settings")
+        self._flush()
+        other._flush()
+        self._labels.extend(other._labels.values)
+        self._scores.extend(other._scores.values)
+        self._tp.extend(other._tp.values)
+        self._gt_counts += other._gt_counts
+        self._confusion += other._confusion
+        self._total_predictions += other._total_predictions
+        self._total_ground_truth += other._total_ground_truth
+        return self
+    
+    @timed("evaluate.compute")
+    def compute(self) -> Dict:
+        """Compute metrics over every image seen so far."""
+        self._flush()
+        results = _summarize(
+            self._labels.values,
+            self._tp.values,
+            self._scores.values,
+            self._gt_counts,
+            self._total_predictions,
+            self._total_ground_truth,
+            self.class_names,
+            self.iou_thresholds,
+            self.ap_method,
+        )
+        if self.confusion_iou is not None:
+            results["confusion_matrix"] = {
+                "matrix": self._confusion.tolist(),
+                "labels": list(self.class_names) + ["background"],
+                "iou": self.confusion_iou,
+                "conf": self.confusion_conf,
+            }
+        if self.curve_points:
+            curves = _confidence_curves(
+                self._labels.values, self._tp.values, self._scores.values, self._gt_counts, self.curve_points,
+            )
+            results["curves"] = {key: values.tolist() for key, values in curves.items()}
+            results["optimal_thresholds"] = optimal_thresholds(curves, self._gt_counts, self.class_names)
+        return results
+    
+    def _flush(self):
+        if self._pending:
+            predictions, ground_truths = zip(*self._pending)
+            self._pending = []
+            self._accumulate(predictions, ground_truths)
+    
+    @timed("evaluate.match")
+    def _accumulate(self, predictions: Sequence[Dict], ground_truths: Sequence[Dict]):
+        n_images = min(len(predictions), len(ground_truths))
+        matches = match_detections(
+            predictions[:n_images], ground_truths[:n_images], self.iou_thresholds,
+            agnostic_iou=self.confusion_iou, agnostic_conf=self.confusion_conf,
+        )
+        if self.confusion_iou is not None:
+            self._confusion += _confusion_counts(matches, self.num_classes, self.confusion_conf)
+        
+        # Out-of-range classes only count towards the totals
+        det_labels = matches["det_labels"]
+        keep = (det_labels >= 0) & (det_labels < self.num_classes)
+        self._labels.extend(det_labels[keep])
+        self._scores.extend(matches["det_scores"][keep])
+        self._tp.extend(matches["det_tp"][keep])
+        self._total_predictions += len(det_labels)
+        
+        gt_labels = matches["gt_labels"]
+        in_range = (gt_labels >= 0) & (gt_labels < self.num_classes)
+        self._gt_counts += np.bincount(gt_labels[in_range], minlength=self.num_classes)
+        self._total_ground_truth += len(gt_labels)
+
+
+# Per-process data for sharded evaluation, set by _init_worker
+_WORKER_STATE = {}
+
+
+def _init_worker(predictions: List[Dict], ground_truths: List[Dict], options: Dict):
+    """Pool initializer: inherit the full image lists once per worker."""
+    _WORKER_STATE.update(predictions=predictions, ground_truths=ground_truths, options=options)
+
+
+def _evaluate_range(bounds: Tuple[int, int]) -> IncrementalEvaluator:
+    """Match images [start, end) of the worker's lists."""
+    start, end = bounds
+    evaluator = IncrementalEvaluator(**_WORKER_STATE["options"])
+    evaluator.update_batch(
+        _WORKER_STATE["predictions"][start:end], _WORKER_STATE["ground_truths"][start:end]
+    )
+    return evaluator
+
+
+def _evaluate_shard(shard: List[Tuple[Dict, Dict]], options: Dict) -> IncrementalEvaluator:
+    """Match one shard of (pred, gt) pairs sent to the worker."""
+    evaluator = IncrementalEvaluator(**options)
+    predictions, ground_truths = zip(*shard)
+    evaluator.update_batch(predictions, ground_truths)
+    return evaluator
+
+
+def evaluate_pairs(
+    pairs: Iterable[Tuple[Dict, Dict]],
+    workers: int = 1,
+    shard_size: int = 2048,
+    **options,
+) -> Dict:
+    """
+    Evaluate a stream of (pred, gt) pairs, e.g. from iter_yolo_txt_pairs.
+    
+    With workers > 1 the stream is cut into shards of shard_size images
+    that are matched in a process pool, with at most two shards per
+    worker in flight. Partial results are merged in stream order, so the
+    output is identical to a single-process run.
+    
+    Args:
+        pairs: Iterable of ({boxes, scores, labels}, {boxes, labels})
+        workers: Number of worker processes
+        shard_size: Images per shard
+        **options: IncrementalEvaluator arguments (num_classes,
+            class_names, iou_thresholds, ap_method, confusion_iou,
+            confusion_conf, curve_points)
+    """
+    evaluator = IncrementalEvaluator(**options)
+    if workers <= 1:
+        for pred, gt in pairs:
+            evaluator.update(pred, gt)
+        return evaluator.compute()
+    
+    pairs = iter(pairs)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            shard = list(islice(pairs, shard_size))
+            if shard:
+                pending.append(pool.submit(_evaluate_shard, shard, options))
+            if pending and (not shard or len(pending) >= 2 * workers):
+                evaluator.merge(pending.popleft().result())
+            elif not shard:
+                break
+    return evaluator.compute()
+
+
+@timed("evaluate.evaluate_detections")
+def evaluate_detections(
+    predictions: List[Dict],
+    ground_truths: List[Dict],
+    iou_threshold: float = 0.5,
+    num_classes: int = 8,
+    class_names: List[str] = None,
+    iou_thresholds: Sequence[float] = None,
+    ap_method: str = "11point",
+    workers: int = 1,
+    shard_size: int = 2048,
+    confusion_iou: Optional[float] = None,
+    confusion_conf: float = 0.25,
+    curve_points: int = 0,
+) -> Dict:
+    """
+    Evaluate detection results against ground truth.
+    
+    Args:
+        predictions: List of {boxes, scores, labels} per image
+        ground_truths: List of {boxes, labels} per image
+        iou_threshold: IoU threshold for matching
+        num_classes: Number of classes
+        class_names: Optional class name mapping
+        iou_thresholds: Optional list of IoU thresholds (e.g.
+            COCO_IOU_THRESHOLDS) matched in a single pass; overrides
+            iou_threshold
+        ap_method: "11point", "101point" or "all" (see compute_ap)
+        workers: Number of processes; images are split into contiguous
+            shards of shard_size and the results are identical to workers=1
+        shard_size: Images per shard when workers > 1
+        confusion_iou: IoU for class-agnostic confusion matching (e.g.
+            0.45); no confusion matrix when None
+        confusion_conf: Minimum score of predictions in the confusion matrix
+        curve_points: Confidence steps of the PR/F1 curves; 0 for none
+    
+    Returns:
+        Dictionary with mAP, per-class AP, precision, recall. With
+        iou_thresholds it also holds the mAP averaged over thresholds
+        (e.g. "mAP@0.5:0.95"), mAP and per-class AP at every threshold.
+        confusion_iou adds "confusion_matrix" (rows ground truth, columns
+        predicted, background last); curve_points adds "curves" and
+        "optimal_thresholds"
+    """
+    options = {
+        "num_classes": num_classes,
+        "class_names": class_names,
+        "iou_thresholds": iou_threshold if iou_thresholds is None else iou_thresholds,
+        "ap_method": ap_method,
+        "confusion_iou": confusion_iou,
+        "confusion_conf": confusion_conf,
+        "curve_points": curve_points,
+    }
+    evaluator = IncrementalEvaluator(**options)
+    n_images = min(len(predictions), len(ground_truths))
+    
+    if workers <= 1 or n_images <= shard_size:
+        evaluator.update_batch(predictions, ground_truths)
+        return evaluator.compute()
+    
+    # Workers inherit the lists through the pool initializer and receive
+    # only index ranges; shards are merged back in order
+    bounds = [(start, min(start + shard_size, n_images)) for start in range(0, n_images, shard_size)]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(predictions, ground_truths, options),
+    ) as pool:
+        for part in pool.map(_evaluate_range, bounds):
+            evaluator.merge(part)
+    return evaluator.compute()
+
+
+# ============================================================
+# Streaming loaders
+# ============================================================
+
+@timed("evaluate.read_yolo_txt")
+def read_yolo_txt(path: Union[str, Path]) -> Dict:
+    """
+    Read one YOLO label file ("cls xc yc w h [conf]" per row, normalized).
+    
+    Returns {boxes, labels} in normalized xyxy, plus scores when the file
+    has a confidence column (Ultralytics save_txt with save_conf=True).
+    A missing file is treated as an image with no boxes.
+    """
+    try:
+        with open(path, "r") as f:
+            lines = f.read().split("\n")
+    except FileNotFoundError:
+        lines = []
+    rows = [line.split() for line in lines if line.strip()]
+    if not rows:
+        return {"boxes": np.empty((0, 4)), "labels": np.empty(0, dtype=np.int64), "scores": np.empty(0)}
+    
+    values = np.asarray(rows, dtype=np.float64)
+    record = {
+        "boxes": xywhn_to_xyxy(values[:, 1:5]),
+        "labels": values[:, 0].astype(np.int64),
+    }
+    record["scores"] = values[:, 5] if values.shape[1] > 5 else np.ones(len(values))
+    return record
+
+
+def iter_yolo_txt_pairs(
+    pred_dir: Union[str, Path],
+    gt_dir: Union[str, Path],
+) -> Iterator[Tuple[Dict, Dict]]:
+    """
+    Stream (pred, gt) pairs from two YOLO txt label directories.
+    
+    pred_dir is Ultralytics predict output (save_txt=True, save_conf=True);
+    gt_dir holds the dataset labels. Images with no detections have no
+    prediction file and background images have no label file; both are
+    yielded with empty boxes. Boxes stay normalized, which leaves IoU
+    unchanged.
+    """
+    pred_dir, gt_dir = Path(pred_dir), Path(gt_dir)
+    stems = {p.stem for p in pred_dir.glob("*.txt")} | {p.stem for p in gt_dir.glob("*.txt")}
+    
+    for stem in sorted(stems):
+        pred = read_yolo_txt(pred_dir / f"{stem}.txt")
+        gt = read_yolo_txt(gt_dir / f"{stem}.txt")
+        del gt["scores"]
+        yield pred, gt
+
+
+def _iter_json_array(path: Union[str, Path], chunk_size: int = 1 << 20) -> Iterator:
+    """Yield the elements of a top-level JSON array without loading it whole."""
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buf = f.read(chunk_size).lstrip()
+        if not buf.startswith("["):
+            raise ValueError(f"Expected a JSON array in {path}")
+        pos = 1
+        eof = False
+        
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ","):
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            yield obj
+            pos = end
+
+
+def _ultralytics_image_id(stem: str) -> str:
+    """image_id as Ultralytics writes it: numeric stems become integers."""
+    return str(int(stem)) if stem.isnumeric() else stem
+
+
+def iter_ultralytics_json_pairs(
+    json_path: Union[str, Path],
+    labels_dir: Union[str, Path],
+    images_dir: Union[str, Path],
+    category_offset: int = 0,
+) -> Iterator[Tuple[Dict, Dict]]:
+    """
+    Stream (pred, gt) pairs from Ultralytics save_json output.
+    
+    predictions.json is a COCO-style array of {image_id, category_id,
+    bbox [x, y, w, h] in pixels, score} written image by image, so it is
+    decoded incrementally and grouped by consecutive image_id. Ground
+    truths come from the YOLO label file with the same stem; image sizes
+    (needed to bring both to one coordinate frame) come from images_dir.
+    category_offset is subtracted from category_id to get the class index
+    (set it to 1 if the export numbers classes from 1).
+    
+    Images with labels but no predictions are yielded afterwards with
+    empty predictions.
+    """
+    from .preprocess import IMAGE_SUFFIXES, read_image_size
+    
+    labels_dir = Path(labels_dir)
+    images = {
+        _ultralytics_image_id(p.stem): p
+        for p in Path(images_dir).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES
     }
+    seen = set()
+    
+    def make_pair(image_id: str, rows: List[Dict]) -> Tuple[Dict, Dict]:
+        if image_id in seen:
+            raise ValueError(f"Predictions for image '{image_id}' are not contiguous in {json_path}")
+        if image_id not in images:
+            raise FileNotFoundError(f"No image for image_id '{image_id}' in {images_dir}")
+        seen.add(image_id)
+        width, height = read_image_size(images[image_id])
+        scale = np.array([width, height, width, height], dtype=np.float64)
+        
+        gt = read_yolo_txt(labels_dir / f"{images[image_id].stem}.txt")
+        boxes = np.array([row["bbox"] for row in rows], dtype=np.float64).reshape(-1, 4)
+        boxes[:, 2:4] += boxes[:, 0:2]
+        pred = {
+            "boxes": boxes / scale,
+            "scores": np.array([row["score"] for row in rows], dtype=np.float64),
+            "labels": np.array([row["category_id"] for row in rows], dtype=np.int64) - category_offset,
+        }
+        return pred, {"boxes": gt["boxes"], "labels": gt["labels"]}
+    
+    image_id, rows = None, []
+    for row in _iter_json_array(json_path):
+        row_id = str(row["image_id"])
+        if row_id != image_id and rows:
+            yield make_pair(image_id, rows)
+            rows = []
+        image_id = row_id
+        rows.append(row)
+    if rows:
+        yield make_pair(image_id, rows)
+    
+    empty = {"boxes": np.empty((0, 4)), "scores": np.empty(0), "labels": np.empty(0, dtype=np.int64)}
+    for label_path in sorted(labels_dir.glob("*.txt")):
+        if _ultralytics_image_id(label_path.stem) not in seen:
+            gt = read_yolo_txt(label_path)
+            yield empty, {"boxes": gt["boxes"], "labels": gt["labels"]}
 
 
 def print_evaluation_report(results: Dict, class_names: List[str] = None):
@@ -147,7 +912,10 @@ def print_evaluation_report(results: Dict, class_names: List[str] = None):
     print("PeanutGuard Model Evaluation Report")
     print("=" * 65)
     
-    print(f"\nmAP@0.5: {results['mAP@0.5']:.4f}")
+    print()
+    for key in results:
+        if key.startswith("mAP@"):
+            print(f"{key}: {results[key]:.4f}")
     print(f"Total Predictions: {results['total_predictions']}")
     print(f"Total Ground Truth: {results['total_ground_truth']}")
     
@@ -163,24 +931,63 @@ def print_evaluation_report(results: Dict, class_names: List[str] = None):
             f"{metrics.get('n_ground_truth', 0):>6d}"
         )
     
+    if "optimal_thresholds" in results:
+        print(f"\n{'Best-F1 threshold':<25} {'Conf':>8} {'Prec':>8} {'Recall':>8} {'F1':>6}")
+        print("-" * 65)
+        for cls_name, best in results["optimal_thresholds"].items():
+            print(
+                f"{cls_name:<25} "
+                f"{best['confidence']:>8.2f} "
+                f"{best['precision']:>8.4f} "
+                f"{best['recall']:>8.4f} "
+                f"{best['F1']:>6.3f}"
+            )
+    
+    if "confusion_matrix" in results:
+        confusion = results["confusion_matrix"]
+        labels = confusion["labels"]
+        print(f"\nConfusion matrix (conf >= {confusion['conf']:g}, IoU > {confusion['iou']:g}; "
+              f"rows ground truth, columns predicted)")
+        print(f"{'':<25}" + "".join(f"{i if i < len(labels) - 1 else 'bg':>6}" for i in range(len(labels))))
+        for i, (name, row) in enumerate(zip(labels, confusion["matrix"])):
+            print(f"{f'{i} {name}' if i < len(labels) - 1 else name:<25}"
+                  + "".join(f"{count:>6d}" for count in row))
+    
     print("=" * 65)
 
 
-if __name__ == "__main__":
-    # Demo with synthetic data
-    print("Running evaluation demo with synthetic data...")
-    
-    CLASS_NAMES = [
-        "early_leaf_spot", "late_leaf_spot", "rust", "collar_rot",
-        "aphid", "thrips", "tobacco_caterpillar", "healthy"
-    ]
+def save_evaluation(results: Dict, path: Union[str, Path]):
+    """
+    Write evaluation results as JSON, or as .npz with the confusion matrix
+    and curves as arrays and everything else as a "summary" JSON string.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix != ".npz":
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        return
     
-    # Simulate predictions and ground truths
+    summary = {key: value for key, value in results.items() if key not in ("confusion_matrix", "curves")}
+    arrays = {"summary": np.array(json.dumps(summary))}
+    if "confusion_matrix" in results:
+        confusion = results["confusion_matrix"]
+        arrays["confusion_matrix"] = np.asarray(confusion["matrix"], dtype=np.int64)
+        arrays["confusion_labels"] = np.asarray(confusion["labels"])
+        summary["confusion_iou"], summary["confusion_conf"] = confusion["iou"], confusion["conf"]
+        arrays["summary"] = np.array(json.dumps(summary))
+    for key, values in results.get("curves", {}).items():
+        arrays[f"curve_{key}"] = np.asarray(values, dtype=np.float32)
+    np.savez_compressed(path, **arrays)
+
+
+def _synthetic_demo(n_images: int = 50) -> Tuple[List[Dict], List[Dict]]:
+    """Random predictions and ground truths for the demo run."""
     np.random.seed(42)
     predictions = []
     ground_truths = []
     
-    for _ in range(50):
+    for _ in range(n_images):
         n_gt = np.random.randint(1, 4)
         gt_boxes = np.random.rand(n_gt, 4).tolist()
         gt_labels = np.random.randint(0, 8, n_gt).tolist()
@@ -193,5 +1000,77 @@ if __name__ == "__main__":
         ground_truths.append({"boxes": gt_boxes, "labels": gt_labels})
         predictions.append({"boxes": pred_boxes, "scores": pred_scores, "labels": pred_labels})
     
-    results = evaluate_detections(predictions, ground_truths, class_names=CLASS_NAMES)
+    return predictions, ground_truths
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="PeanutGuard offline detection evaluator (synthetic demo without --pred-json/--pred-dir)"
+    )
+    parser.add_argument("--pred-json", type=str, default=None, help="Ultralytics predictions.json (save_json=True)")
+    parser.add_argument("--pred-dir", type=str, default=None, help="Prediction label dir (save_txt=True, save_conf=True)")
+    parser.add_argument("--labels", type=str, default="dataset/labels/test", help="Ground-truth YOLO label dir")
+    parser.add_argument("--images", type=str, default="dataset/images/test", help="Image dir (for --pred-json sizes)")
+    parser.add_argument("--category-offset", type=int, default=0,
+                        help="Subtracted from --pred-json category_id (1 if the export numbers classes from 1)")
+    parser.add_argument("--gt-store", type=str, default=None,
+                        help="Ground truths from an annotation CSV/.parquet/.npz store instead of --labels (with --pred-dir)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for sharded matching")
+    parser.add_argument("--shard-size", type=int, default=2048, help="Images per worker shard")
+    parser.add_argument("--coco", action="store_true", help="Report mAP@0.5:0.95 over COCO IoU thresholds")
+    parser.add_argument("--ap-method", type=str, default="11point", choices=AP_METHODS, help="AP interpolation")
+    parser.add_argument("--conf", type=float, default=0.25, help="Minimum score for the confusion matrix")
+    parser.add_argument("--confusion-iou", type=float, default=0.45, help="IoU for class-agnostic confusion matching")
+    parser.add_argument("--curve-points", type=int, default=101, help="Confidence steps of the PR/F1 curves (0: off)")
+    parser.add_argument("--save", type=str, default=None, help="Write results, matrix and curves to .json or .npz")
+    args = parser.parse_args()
+    
+    CLASS_NAMES = [
+        "early_leaf_spot", "late_leaf_spot", "rust", "collar_rot",
+        "aphid", "thrips", "tobacco_caterpillar", "healthy"
+    ]
+    options = {
+        "num_classes": len(CLASS_NAMES),
+        "class_names": CLASS_NAMES,
+        "iou_thresholds": COCO_IOU_THRESHOLDS if args.coco else 0.5,
+        "ap_method": args.ap_method,
+        "confusion_iou": args.confusion_iou,
+        "confusion_conf": args.conf,
+        "curve_points": args.curve_points,
+    }
+    
+    if args.pred_json:
+        pairs = iter_ultralytics_json_pairs(args.pred_json, args.labels, args.images, args.category_offset)
+        results = evaluate_pairs(pairs, workers=args.workers, shard_size=args.shard_size, **options)
+    elif args.pred_dir and args.gt_store:
+        from .annotations import AnnotationStore, iter_store_pairs
+        pairs = iter_store_pairs(args.pred_dir, AnnotationStore.load(args.gt_store))
+        results = evaluate_pairs(pairs, workers=args.workers, shard_size=args.shard_size, **options)
+    elif args.pred_dir:
+        pairs = iter_yolo_txt_pairs(args.pred_dir, args.labels)
+        results = evaluate_pairs(pairs, workers=args.workers, shard_size=args.shard_size, **options)
+    else:
+        # Demo with synthetic data
+        print("Running evaluation demo with synthetic data...")
+        predictions, ground_truths = _synthetic_demo()
+        results = evaluate_detections(
+            predictions, ground_truths,
+            num_classes=options["num_classes"],
+            class_names=CLASS_NAMES,
+            iou_thresholds=COCO_IOU_THRESHOLDS if args.coco else None,
+            ap_method=args.ap_method,
+            workers=args.workers,
+            shard_size=args.shard_size,
+            confusion_iou=args.confusion_iou,
+            confusion_conf=args.conf,
+            curve_points=args.curve_points,
+        )
+    
     print_evaluation_report(results, CLASS_NAMES)
+    if args.save:
+        save_evaluation(results, args.save)
+        print(f"Saved evaluation to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Lightweight per-stage instrumentation for the PeanutGuard pipeline.
+
+Timers, counters and histograms kept in one process-wide registry:
+
+    from utils import instrumentation as inst
+    
+    @inst.timed("preprocess.load_image")
+    def load_image(path): ...
+    
+    with inst.timer("predict.forward"):
+        results = model.predict(...)
+    inst.count("predict.images")
+
+Instrumentation is off by default. While disabled, timer() hands back a
+shared no-op context manager and timed() wrappers call straight through,
+so instrumented code pays one flag check per call. Enable it with
+enable() or by setting PEANUTGUARD_METRICS=1, then export the registry
+with snapshot() (JSON) or to_prometheus() (Prometheus text format).
+
+Timer histograms are in seconds and exported with a _seconds suffix;
+metric names use dots, which become underscores under a "peanutguard_"
+prefix in Prometheus output.
+"""
+
+import bisect
+import functools
+import json
+import math
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence, Union
+
+
+# Latency buckets in seconds (upper bounds; +Inf is implicit)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 300)
+
+_enabled = os.environ.get("PEANUTGUARD_METRICS", "") not in ("", "0")
+
+
+class Histogram:
+    """Fixed-bucket histogram with count, sum, min and max."""
+    
+    __slots__ = ("bounds", "counts", "count", "sum", "min", "max")
+    
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+    
+    def add(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+    
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (max for +Inf)."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+    
+    def as_dict(self) -> Dict:
+        cumulative, buckets = 0, {}
+        for bound, n in zip(self.bounds + (math.inf,), self.counts):
+            cumulative += n
+            buckets["+Inf" if bound == math.inf else repr(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "min": self.min if self.count else 0.0,
+            "max": self.max if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": buckets,
+        }
+
+
+class Registry:
+    """Thread-safe store of counters and histograms."""
+    
+    def __init__(self):
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.timers = set()
+        self._lock = threading.Lock()
+    
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, timer: bool = False):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+                if timer:
+                    self.timers.add(name)
+            histogram.add(value)
+    
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.timers.clear()
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "timers": {name: h.as_dict() for name, h in self.histograms.items() if name in self.timers},
+                "histograms": {name: h.as_dict() for name, h in self.histograms.items() if name not in self.timers},
+            }
+    
+    def to_prometheus(self, prefix: str = "peanutguard") -> str:
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = _metric_name(prefix, name) + "_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value:g}"]
+            for name, histogram in sorted(self.histograms.items()):
+                metric = _metric_name(prefix, name) + ("_seconds" if name in self.timers else "")
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, n in zip(histogram.bounds + (math.inf,), histogram.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == math.inf else f"{bound:g}"
+                    lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+                lines += [f"{metric}_sum {histogram.sum:.9g}", f"{metric}_count {histogram.count}"]
+        return "\n".join(lines) + "\n"
+
+
+def _metric_name(prefix: str, name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", f"{prefix}_{name}" if prefix else name)
+
+
+REGISTRY = Registry()
+
+
+class _NullTimer:
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+    
+    def __init__(self, name: str):
+        self.name = name
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        REGISTRY.observe(self.name, time.perf_counter() - self.start, timer=True)
+        return False
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def timer(name: str):
+    """Context manager recording the block's wall time under name."""
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+
+def timed(name: Optional[str] = None) -> Callable:
+    """Decorator timing every call (default name: module.qualname)."""
+    def decorate(fn: Callable) -> Callable:
+        metric = name or f"{fn.__module__}.{fn.__qualname__}"
+        
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                REGISTRY.observe(metric, time.perf_counter() - start, timer=True)
+        
+        return wrapper
+    
+    return decorate
+
+
+def count(name: str, value: float = 1):
+    """Add value to a counter."""
+    if _enabled:
+        REGISTRY.count(name, value)
+
+
+def observe(name: str, value: float, buckets: Sequence[float] = COUNT_BUCKETS):
+    """Record a value (e.g. detections per image) in a histogram."""
+    if _enabled:
+        REGISTRY.observe(name, value, buckets)
+
+
+def observe_seconds(name: str, seconds: float):
+    """Record an externally measured duration as a timer."""
+    if _enabled:
+        REGISTRY.observe(name, seconds, timer=True)
+
+
+def snapshot() -> Dict:
+    return REGISTRY.snapshot()
+
+
+def to_prometheus(prefix: str = "peanutguard") -> str:
+    return REGISTRY.to_prometheus(prefix)
+
+
+def reset():
+    REGISTRY.reset()
+
+
+def write_metrics(path: Union[str, Path]):
+    """Write the registry as Prometheus text (.prom/.txt) or JSON."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        if path.suffix in (".prom", ".txt"):
+            f.write(to_prometheus())
+        else:
+            json.dump(snapshot(), f, indent=2)
+
+
+def print_summary(min_calls: int = 1):
+    """Per-stage timing table, slowest total first."""
+    timers = snapshot()["timers"]
+    if not timers:
+        return
+    print(f"\n{'Stage':<40} {'Calls':>7} {'Total ms':>10} {'Mean ms':>9} {'p95 ms':>9} {'Max ms':>9}")
+    for name, stats in sorted(timers.items(), key=lambda item: -item[1]["sum"]):
+        if stats["count"] >= min_calls:
+            print(f"{name:<40} {stats['count']:>7} {stats['sum'] * 1000:>10.1f} {stats['mean'] * 1000:>9.2f} "
+                  f"{stats['p95'] * 1000:>9.2f} {stats['max'] * 1000:>9.2f}")
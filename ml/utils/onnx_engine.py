@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime inference engine for CPU-only nodes.
+
+Runs a YOLOv8 model exported with `train.py --mode export` using only
+NumPy, OpenCV and onnxruntime: inputs come from preprocess_for_inference /
+batch_preprocess, the raw (B, 4 + nc, anchors) output is decoded and
+filtered with the class-aware NMS of utils.boxes, and boxes are mapped
+back to the original image with the letterbox metadata. No PyTorch or Ultralytics import.
+
+Usage (from the ml/ directory):
+    python -m utils.onnx_engine runs/detect/peanutguard/weights/best.onnx leaf.jpg
+"""
+
+import argparse
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+from .boxes import non_max_suppression, unletterbox_boxes, xywh_to_xyxy
+from .instrumentation import timed
+from .preprocess import batch_preprocess, preprocess_for_inference
+
+
+Detections = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def to_model_input(batch: np.ndarray) -> np.ndarray:
+    """
+    Reorder a BGR (N, 3, S, S) batch from preprocess_for_inference to the
+    contiguous RGB layout the exported model expects.
+    """
+    return np.ascontiguousarray(batch[:, ::-1])
+
+
+class OnnxDetector:
+    """
+    YOLOv8 detector on onnxruntime.
+    
+    predict / predict_batch accept image paths or decoded BGR arrays and
+    return (boxes, scores, class_ids) per image, with xyxy boxes in
+    original image pixels. The input size is read from the model when it
+    was exported with a static shape, otherwise imgsz is used; models
+    exported without a dynamic batch axis are run one image at a time.
+    
+    Example:
+        detector = OnnxDetector("best.onnx", conf=0.25, iou=0.45)
+        boxes, scores, class_ids = detector.predict("leaf.jpg")
+    """
+    
+    def __init__(
+        self,
+        model_path: str,
+        conf: float = 0.25,
+        iou: float = 0.45,
+        imgsz: int = 640,
+        max_det: int = 300,
+        num_threads: int = 0,
+        providers: Sequence[str] = ("CPUExecutionProvider",),
+    ):
+        if ort is None:
+            raise ImportError("onnxruntime is required: pip install onnxruntime")
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(str(model_path), options, providers=list(providers))
+        
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch_dim, _channels, height, _width = model_input.shape
+        self.imgsz = height if isinstance(height, int) else imgsz
+        self.dynamic_batch = not isinstance(batch_dim, int)
+        
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+    
+    def predict(self, image: Union[str, np.ndarray]) -> Detections:
+        """Detect objects in one image path or BGR array."""
+        if isinstance(image, np.ndarray):
+            return self.predict_batch([image])[0]
+        tensor, metadata = preprocess_for_inference(image, self.imgsz)
+        return self.postprocess(self.forward(tensor), [metadata])[0]
+    
+    def predict_batch(self, images: List[Union[str, np.ndarray]]) -> List[Detections]:
+        """Detect objects in several images with one forward pass when possible."""
+        batch, metadata_list = batch_preprocess(images, self.imgsz)
+        return self.infer(batch, metadata_list)
+    
+    def infer(self, batch: np.ndarray, metadata_list: List[dict]) -> List[Detections]:
+        """Detect objects in an already preprocessed batch (e.g. a BatchBuffer)."""
+        if self.dynamic_batch:
+            output = self.forward(batch)
+        else:
+            output = np.concatenate([self.forward(batch[i:i + 1]) for i in range(len(batch))])
+        return self.postprocess(output, metadata_list)
+    
+    @timed("onnx.forward")
+    def forward(self, batch: np.ndarray) -> np.ndarray:
+        """Run the session on a BGR (N, 3, S, S) float batch; returns raw output."""
+        return self.session.run(None, {self.input_name: to_model_input(batch)})[0]
+    
+    @timed("onnx.postprocess")
+    def postprocess(self, output: np.ndarray, metadata_list: List[dict]) -> List[Detections]:
+        """Decode (N, 4 + nc, anchors) output into per-image detections."""
+        detections = []
+        for pred, metadata in zip(output, metadata_list):
+            pred = pred.T
+            class_scores = pred[:, 4:]
+            class_ids = class_scores.argmax(axis=1)
+            scores = class_scores[np.arange(len(pred)), class_ids]
+            
+            mask = scores > self.conf
+            boxes = xywh_to_xyxy(pred[mask, :4])
+            scores, class_ids = scores[mask], class_ids[mask]
+            
+            keep = non_max_suppression(boxes, scores, self.iou, class_ids, self.max_det)
+            detections.append((
+                unletterbox_boxes(boxes[keep], metadata),
+                scores[keep].astype(np.float64),
+                class_ids[keep].astype(np.int64),
+            ))
+        return detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an exported ONNX model on images")
+    parser.add_argument("model", help="Path to the exported .onnx model")
+    parser.add_argument("images", nargs="+", help="Image paths")
+    parser.add_argument("--conf", type=float, default=0.25, help="Confidence threshold")
+    parser.add_argument("--iou", type=float, default=0.45, help="NMS IoU threshold")
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads (0 = onnxruntime default)")
+    args = parser.parse_args()
+    
+    detector = OnnxDetector(args.model, conf=args.conf, iou=args.iou, num_threads=args.threads)
+    for path in args.images:
+        boxes, scores, class_ids = detector.predict(path)
+        print(f"{path}: {len(boxes)} detections")
+        for box, score, cls_id in zip(boxes, scores, class_ids):
+            print(f"  class {cls_id}  {score:.2%}  {np.round(box, 1).tolist()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+INT8 post-training static quantization of the exported ONNX model.
+
+Calibration images are a seeded random sample of the dataset's train
+split, preprocessed exactly as at inference (preprocess_for_inference),
+so activation ranges match what the field devices will see. The INT8
+model is written in QDQ format with per-channel weights; the detection
+head's box decoding (DFL, concat, sigmoid) stays in float, since
+quantizing pixel-scale coordinates costs far more accuracy than time.
+
+Both models are then scored on a labelled split with the same
+OnnxDetector path: per-class AP from evaluate_detections and ms/image,
+printed side by side and optionally written as JSON.
+
+Usage (from the ml/ directory):
+    python -m utils.quantize runs/detect/peanutguard/weights/best.onnx --data dataset/data.yaml
+"""
+
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        CalibrationMethod,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+except ImportError:
+    CalibrationDataReader = object
+    quantize_static = None
+
+from .dataset_index import label_path_for, read_data_yaml
+from .evaluate import COCO_IOU_THRESHOLDS, evaluate_detections, read_yolo_txt
+from .onnx_engine import OnnxDetector, to_model_input
+from .preprocess import preprocess_for_inference, read_image_size
+from .tensor_cache import find_images
+
+
+CALIBRATION_METHODS = ("minmax", "entropy", "percentile")
+
+
+def resolve_split(data_yaml: str, split: str) -> Tuple[Path, List[str]]:
+    """
+    Locate a split from a YOLO data.yaml.
+    
+    Returns:
+        (image_dir or list file, class_names); labels follow the YOLO
+        convention of replacing "images" with "labels" in each image path
+    """
+    _root, splits, class_names = read_data_yaml(data_yaml)
+    if split not in splits:
+        raise KeyError(f"{data_yaml} has no {split!r} split")
+    return splits[split], class_names
+
+
+class CalibrationImages(CalibrationDataReader):
+    """Feeds preprocessed images to the onnxruntime calibrator one at a time."""
+    
+    def __init__(self, image_paths: List[str], input_name: str, imgsz: int = 640):
+        self.image_paths = list(image_paths)
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self._next = 0
+    
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        if self._next >= len(self.image_paths):
+            return None
+        tensor, _metadata = preprocess_for_inference(self.image_paths[self._next], self.imgsz)
+        self._next += 1
+        return {self.input_name: to_model_input(tensor)}
+    
+    def rewind(self):
+        self._next = 0
+
+
+def sample_images(image_dir: Path, n_images: int, seed: int = 0) -> List[str]:
+    """Seeded random sample of up to n_images from a directory tree or list file."""
+    paths = find_images([image_dir])
+    if len(paths) <= n_images:
+        return paths
+    rng = np.random.default_rng(seed)
+    return [paths[i] for i in sorted(rng.choice(len(paths), n_images, replace=False))]
+
+
+def detection_head_nodes(model_path: str) -> List[str]:
+    """
+    Names of the box-decoding nodes of an Ultralytics Detect head.
+    
+    These are the nodes of the last "/model.N/" block other than its
+    cv2/cv3 convolution branches: DFL, anchor arithmetic, concat and the
+    class sigmoid. Returns an empty list for graphs without that naming.
+    """
+    import onnx
+    
+    graph = onnx.load(str(model_path), load_external_data=False).graph
+    output_names = {output.name for output in graph.output}
+    head = None
+    for node in graph.node:
+        if output_names.intersection(node.output):
+            match = re.match(r"/model\.\d+/", node.name)
+            head = match.group(0) if match else None
+    if head is None:
+        return []
+    return [
+        node.name for node in graph.node
+        if node.name.startswith(head) and not re.match(re.escape(head) + r"cv[23]\.", node.name)
+    ]
+
+
+def quantize_int8(
+    fp32_path: str,
+    int8_path: str,
+    calibration_paths: List[str],
+    imgsz: int = 640,
+    method: str = "minmax",
+    per_channel: bool = True,
+    keep_head_float: bool = True,
+) -> str:
+    """
+    Write a static INT8 (QDQ) model calibrated on calibration_paths.
+    
+    Args:
+        fp32_path: Exported FP32 .onnx model
+        int8_path: Output path
+        calibration_paths: Images used to collect activation ranges
+        imgsz: Input size when the model has dynamic spatial axes
+        method: Calibration method, one of CALIBRATION_METHODS
+        per_channel: Quantize Conv weights per output channel
+        keep_head_float: Leave the Detect head's box decoding in FP32
+    
+    Returns:
+        int8_path
+    """
+    if quantize_static is None:
+        raise ImportError("onnxruntime is required: pip install onnxruntime onnx")
+    if method not in CALIBRATION_METHODS:
+        raise ValueError(f"method must be one of {CALIBRATION_METHODS}, got {method!r}")
+    
+    detector = OnnxDetector(fp32_path, imgsz=imgsz)
+    reader = CalibrationImages(calibration_paths, detector.input_name, detector.imgsz)
+    exclude = detection_head_nodes(fp32_path) if keep_head_float else []
+    
+    quantize_static(
+        str(fp32_path),
+        str(int8_path),
+        reader,
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=per_channel,
+        calibrate_method={
+            "minmax": CalibrationMethod.MinMax,
+            "entropy": CalibrationMethod.Entropy,
+            "percentile": CalibrationMethod.Percentile,
+        }[method],
+        nodes_to_exclude=exclude,
+    )
+    return str(int8_path)
+
+
+def score_model(
+    model_path: str,
+    image_paths: List[str],
+    class_names: List[str],
+    imgsz: int = 640,
+    conf: float = 0.001,
+    iou: float = 0.6,
+    threads: int = 0,
+) -> Dict:
+    """
+    Run one model over labelled images; returns accuracy and latency.
+    
+    Returns:
+        {"model", "size_mb", "ms_per_image", "p90_ms", "metrics"} where
+        metrics is the evaluate_detections result at COCO IoU thresholds
+    """
+    detector = OnnxDetector(model_path, conf=conf, iou=iou, imgsz=imgsz, num_threads=threads)
+    for path in image_paths[:3]:
+        detector.predict(path)  # warm up
+    
+    predictions, ground_truths, latencies = [], [], []
+    for path in image_paths:
+        start = time.perf_counter()
+        boxes, scores, class_ids = detector.predict(path)
+        latencies.append((time.perf_counter() - start) * 1000)
+        
+        # Labels are normalized xyxy after read_yolo_txt; match that scale
+        w, h = read_image_size(path)
+        predictions.append({"boxes": boxes / [w, h, w, h], "scores": scores, "labels": class_ids})
+        gt = read_yolo_txt(label_path_for(path))
+        ground_truths.append({"boxes": gt["boxes"], "labels": gt["labels"]})
+    
+    metrics = evaluate_detections(
+        predictions,
+        ground_truths,
+        num_classes=len(class_names),
+        class_names=class_names,
+        iou_thresholds=COCO_IOU_THRESHOLDS,
+    )
+    latencies = np.asarray(latencies)
+    return {
+        "model": str(model_path),
+        "size_mb": Path(model_path).stat().st_size / 2 ** 20,
+        "ms_per_image": float(latencies.mean()) if len(latencies) else 0.0,
+        "p90_ms": float(np.percentile(latencies, 90)) if len(latencies) else 0.0,
+        "metrics": metrics,
+    }
+
+
+def print_comparison(fp32: Dict, int8: Dict):
+    """Side-by-side per-class AP and speed table for the go/no-go review."""
+    print("\n" + "=" * 72)
+    print("FP32 vs INT8")
+    print("=" * 72)
+    print(f"{'Class':<22} {'FP32 AP50':>10} {'INT8 AP50':>10} {'diff':>7} "
+          f"{'FP32 AP':>9} {'INT8 AP':>9}")
+    print("-" * 72)
+    
+    for name, base in fp32["metrics"]["per_class"].items():
+        quant = int8["metrics"]["per_class"][name]
+        if "AP_per_threshold" not in base:
+            print(f"{name:<22} {'(no labels)':>10}")
+            continue
+        ap50, q_ap50 = base["AP_per_threshold"][0], quant["AP_per_threshold"][0]
+        print(f"{name:<22} {ap50:>10.4f} {q_ap50:>10.4f} {q_ap50 - ap50:>+7.3f} "
+              f"{base['AP']:>9.4f} {quant['AP']:>9.4f}")
+    
+    print("-" * 72)
+    for key in ("mAP@0.5", "mAP@0.5:0.95"):
+        base, quant = fp32["metrics"][key], int8["metrics"][key]
+        print(f"{key:<22} {base:>10.4f} {quant:>10.4f} {quant - base:>+7.3f}")
+    print(f"{'ms/image (mean)':<22} {fp32['ms_per_image']:>10.1f} {int8['ms_per_image']:>10.1f}")
+    print(f"{'ms/image (p90)':<22} {fp32['p90_ms']:>10.1f} {int8['p90_ms']:>10.1f}")
+    print(f"{'model size (MB)':<22} {fp32['size_mb']:>10.1f} {int8['size_mb']:>10.1f}")
+    if int8["ms_per_image"]:
+        print(f"\nINT8 speedup: {fp32['ms_per_image'] / int8['ms_per_image']:.2f}x")
+    print("=" * 72)
+
+
+def quantize_and_compare(
+    fp32_path: str,
+    data_yaml: str = "dataset/data.yaml",
+    int8_path: str = None,
+    calibration_images: int = 200,
+    eval_split: str = "test",
+    eval_limit: int = 0,
+    imgsz: int = 640,
+    method: str = "minmax",
+    seed: int = 0,
+    report_path: str = None,
+) -> Dict:
+    """
+    Calibrate on the train split, quantize, and score FP32 vs INT8.
+    
+    Returns:
+        {"fp32": score_model(...), "int8": score_model(...), "calibration": {...}}
+    """
+    int8_path = int8_path or str(Path(fp32_path).with_name(Path(fp32_path).stem + "_int8.onnx"))
+    
+    train_dir, class_names = resolve_split(data_yaml, "train")
+    calibration_paths = sample_images(train_dir, calibration_images, seed)
+    if not calibration_paths:
+        raise FileNotFoundError(f"No calibration images found in {train_dir}")
+    print(f"Calibrating on {len(calibration_paths)} images from {train_dir} ({method})")
+    start = time.perf_counter()
+    quantize_int8(fp32_path, int8_path, calibration_paths, imgsz=imgsz, method=method)
+    print(f"INT8 model saved to: {int8_path} ({time.perf_counter() - start:.1f}s)")
+    
+    image_dir, _ = resolve_split(data_yaml, eval_split)
+    eval_paths = find_images([image_dir])
+    if eval_limit:
+        eval_paths = eval_paths[:eval_limit]
+    print(f"Scoring both models on {len(eval_paths)} {eval_split} images")
+    
+    report = {
+        "calibration": {"images": len(calibration_paths), "method": method, "seed": seed},
+        "eval_split": eval_split,
+        "fp32": score_model(fp32_path, eval_paths, class_names, imgsz),
+        "int8": score_model(int8_path, eval_paths, class_names, imgsz),
+    }
+    print_comparison(report["fp32"], report["int8"])
+    
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to: {report_path}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8 static quantization with FP32 vs INT8 report")
+    parser.add_argument("model", help="Exported FP32 .onnx model")
+    parser.add_argument("--data", default="dataset/data.yaml", help="YOLO data.yaml")
+    parser.add_argument("--output", default=None, help="INT8 model path (default: <model>_int8.onnx)")
+    parser.add_argument("--calib-images", type=int, default=200, help="Calibration sample size")
+    parser.add_argument("--method", default="minmax", choices=CALIBRATION_METHODS, help="Calibration method")
+    parser.add_argument("--split", default="test", help="Split to score both models on")
+    parser.add_argument("--limit", type=int, default=0, help="Score at most this many images (0 = all)")
+    parser.add_argument("--size", type=int, default=640, help="Input size for dynamic-shape models")
+    parser.add_argument("--seed", type=int, default=0, help="Calibration sampling seed")
+    parser.add_argument("--report", default=None, help="Write the comparison as JSON")
+    args = parser.parse_args()
+    
+    quantize_and_compare(
+        args.model,
+        data_yaml=args.data,
+        int8_path=args.output,
+        calibration_images=args.calib_images,
+        eval_split=args.split,
+        eval_limit=args.limit,
+        imgsz=args.size,
+        method=args.method,
+        seed=args.seed,
+        report_path=args.report,
+    )
+
+
+if __name__ == "__main__":
+    main()
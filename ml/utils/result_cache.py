@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Prediction result cache for the PeanutGuard inference path.
+
+Field users often upload the same leaf photo several times. Results are
+keyed by the SHA-256 of the image bytes, the SHA-256 of the model weights
+and the inference settings (imgsz, conf, iou), so a repeated upload is
+answered without loading the model or running inference.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    In-process LRU of prediction results with an optional SQLite store.
+    
+    Values are JSON-serializable (the detection list predict prints). The
+    in-memory LRU is bounded by max_bytes of serialized JSON and evicts
+    least recently used entries; with db_path set, every result is also
+    written to SQLite so later processes can reuse it, and memory misses
+    fall back to the database. All methods are thread-safe.
+    
+    Example:
+        cache = PredictionCache(db_path="runs/predict_cache.sqlite")
+        key = cache.make_key(image_bytes, "best.pt", imgsz=640, conf=0.25, iou=0.45)
+        detections = cache.get(key)
+        if detections is None:
+            detections = run_model(...)
+            cache.put(key, detections)
+    """
+    
+    def __init__(self, max_bytes: int = 64 << 20, db_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._weights_hashes: Dict[tuple, str] = {}
+        self._db = None
+        
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+    
+    def weights_hash(self, model_path: str) -> str:
+        """Hash of the weights file, memoized per (path, size, mtime)."""
+        st = os.stat(model_path)
+        ident = (os.path.abspath(model_path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._weights_hashes.get(ident)
+        if cached is None:
+            cached = file_sha256(model_path)
+            with self._lock:
+                self._weights_hashes[ident] = cached
+        return cached
+    
+    def make_key(self, image_bytes: bytes, model_path: str, **settings) -> str:
+        """Cache key for one image under one model and inference settings."""
+        digest = hashlib.sha256()
+        digest.update(hashlib.sha256(image_bytes).digest())
+        digest.update(self.weights_hash(model_path).encode())
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        return digest.hexdigest()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Cached value for key, or None (counted as a miss)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return json.loads(entry[0])
+            
+            row = None
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            
+            self.stats["disk_hits"] += 1
+            self._remember(key, row[0])
+            return json.loads(row[0])
+    
+    def put(self, key: str, value: Any):
+        """Store a JSON-serializable value under key."""
+        payload = json.dumps(value)
+        with self._lock:
+            self._remember(key, payload)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO predictions (key, value, created) VALUES (?, ?, ?)",
+                    (key, payload, time.time()),
+                )
+                self._db.commit()
+    
+    def _remember(self, key: str, payload: str):
+        """Insert into the LRU and evict down to max_bytes (lock held)."""
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (payload, len(payload))
+        self._bytes += len(payload)
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.stats["evictions"] += 1
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    @property
+    def memory_bytes(self) -> int:
+        return self._bytes
+    
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
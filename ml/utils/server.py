@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Long-lived local inference server for the PeanutGuard detector.
+
+The server owns one loaded model for its whole lifetime and answers
+POST /predict requests whose body is an encoded image (JPEG/PNG bytes)
+with the JSON detection schema:
+
+    {
+        "detections": [{"class_id", "class", "scientific_name", "category",
+                        "severity_range", "confidence", "box"}, ...],
+        "cached": false,
+        "timing_ms": {"decode": ..., "inference": ..., "total": ...}
+    }
+
+GET /health reports readiness and request counters, and GET /metrics
+exports the utils.instrumentation registry in Prometheus text format. It listens on TCP
+(localhost by default) or on a Unix domain socket, so an external API can
+sit in front of it. The model itself is supplied by the caller as an
+infer(image) -> detections function (see train.py --mode serve).
+
+Client usage (from the ml/ directory):
+    python -m utils.server leaf.jpg --url http://127.0.0.1:8765
+    python -m utils.server leaf.jpg --unix-socket /tmp/peanutguard.sock
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import numpy as np
+
+from . import instrumentation
+from .result_cache import PredictionCache
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+
+class InferenceServer:
+    """
+    HTTP front end around a single in-process model.
+    
+    Args:
+        infer: Function taking a decoded BGR image and returning the list
+            of detection dicts
+        host, port: TCP address (ignored when unix_socket is set)
+        unix_socket: Path of a Unix domain socket to listen on instead
+        cache: Optional PredictionCache; keys come from cache_key(body)
+        cache_key: Function mapping request bytes to a cache key
+        max_body_bytes: Reject uploads larger than this
+        extra_stats: Optional function whose dict is merged into the
+            /health payload (e.g. MicroBatcher.stats)
+    """
+    
+    def __init__(
+        self,
+        infer: Callable[[np.ndarray], List[Dict]],
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        unix_socket: Optional[str] = None,
+        cache: Optional[PredictionCache] = None,
+        cache_key: Optional[Callable[[bytes], str]] = None,
+        max_body_bytes: int = 50 << 20,
+        extra_stats: Optional[Callable[[], Dict]] = None,
+    ):
+        self.infer = infer
+        self.extra_stats = extra_stats
+        self.cache = cache
+        self.cache_key = cache_key
+        self.max_body_bytes = max_body_bytes
+        self.stats = {"requests": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+        
+        handler = self._make_handler()
+        if unix_socket:
+            self.httpd = _UnixHTTPServer(unix_socket, handler)
+            self.address = f"unix:{unix_socket}"
+        else:
+            self.httpd = ThreadingHTTPServer((host, port), handler)
+            self.httpd.daemon_threads = True
+            bound_host, bound_port = self.httpd.server_address[:2]
+            self.address = f"http://{bound_host}:{bound_port}"
+    
+    def serve_forever(self):
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+    
+    def start_background(self) -> threading.Thread:
+        """Serve from a daemon thread (for tests and embedding)."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+    
+    def shutdown(self):
+        self.httpd.shutdown()
+    
+    def handle_image(self, body: bytes) -> Dict:
+        """Decode, look up the cache, run inference: the /predict payload."""
+        import cv2
+        
+        start = time.perf_counter()
+        key = self.cache_key(body) if self.cache is not None and self.cache_key else None
+        if key is not None:
+            detections = self.cache.get(key)
+            if detections is not None:
+                instrumentation.count("server.cache_hits")
+                total = (time.perf_counter() - start) * 1000
+                return {"detections": detections, "cached": True, "timing_ms": {"total": total}}
+        
+        image = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Request body is not a decodable image")
+        decoded = time.perf_counter()
+        
+        detections = self.infer(image)
+        done = time.perf_counter()
+        if key is not None:
+            self.cache.put(key, detections)
+        instrumentation.observe_seconds("server.decode", decoded - start)
+        instrumentation.observe_seconds("server.inference", done - decoded)
+        
+        return {
+            "detections": detections,
+            "cached": False,
+            "timing_ms": {
+                "decode": (decoded - start) * 1000,
+                "inference": (done - decoded) * 1000,
+                "total": (done - start) * 1000,
+            },
+        }
+    
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def address_string(self):
+                # Unix socket peers have no (host, port)
+                return self.client_address[0] if self.client_address else "unix"
+            
+            def log_message(self, format, *args):
+                pass
+            
+            def _send_json(self, status: int, payload: Dict):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if self.close_connection:
+                    self.send_header("Connection", "close")
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def _reject(self, status: int, message: str, length: Optional[int]):
+                """
+                Error response before the body was read. A body of valid
+                size is drained so the keep-alive connection stays in sync;
+                otherwise the connection is closed after the response.
+                """
+                if length is not None and 0 <= length <= server.max_body_bytes:
+                    self.rfile.read(length)
+                else:
+                    self.close_connection = True
+                self._send_json(status, {"error": message})
+            
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = instrumentation.to_prometheus().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if self.path != "/health":
+                    self._send_json(404, {"error": f"Unknown path {self.path}"})
+                    return
+                payload = {"status": "ok", **server.stats}
+                if server.cache is not None:
+                    payload["cache"] = server.cache.stats
+                if server.extra_stats is not None:
+                    payload.update(server.extra_stats())
+                self._send_json(200, payload)
+            
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                except ValueError:
+                    length = None
+                if self.path != "/predict":
+                    self._reject(404, f"Unknown path {self.path}", length)
+                    return
+                if length is None or length <= 0:
+                    self._reject(400, "Invalid Content-Length", length)
+                    return
+                if length > server.max_body_bytes:
+                    self._reject(413, f"Body larger than {server.max_body_bytes} bytes", length)
+                    return
+                
+                server._count("requests")
+                try:
+                    payload = server.handle_image(self.rfile.read(length))
+                except ValueError as exc:
+                    server._count("errors")
+                    self._send_json(400, {"error": str(exc)})
+                    return
+                except Exception as exc:
+                    server._count("errors")
+                    self._send_json(500, {"error": f"{type(exc).__name__}: {exc}"})
+                    return
+                self._send_json(200, payload)
+        
+        return Handler
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+    
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class InferenceClient:
+    """Minimal client for InferenceServer over TCP or a Unix socket."""
+    
+    def __init__(self, url: str = "http://127.0.0.1:8765", unix_socket: Optional[str] = None, timeout: float = 30.0):
+        self.url = urlparse(url)
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+    
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.unix_socket:
+            return _UnixHTTPConnection(self.unix_socket, self.timeout)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.timeout)
+    
+    def _request(self, method: str, path: str, body: bytes = None) -> bytes:
+        conn = self._connection()
+        try:
+            headers = {"Content-Type": "application/octet-stream"} if body is not None else {}
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise RuntimeError(f"Server returned {response.status}: {json.loads(data).get('error')}")
+        return data
+    
+    def predict_bytes(self, image_bytes: bytes) -> Dict:
+        return json.loads(self._request("POST", "/predict", image_bytes))
+    
+    def predict(self, image_path: str) -> Dict:
+        with open(image_path, "rb") as f:
+            return self.predict_bytes(f.read())
+    
+    def health(self) -> Dict:
+        return json.loads(self._request("GET", "/health"))
+    
+    def metrics(self) -> str:
+        """Prometheus text from GET /metrics."""
+        return self._request("GET", "/metrics").decode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send images to a running PeanutGuard inference server")
+    parser.add_argument("images", nargs="+", help="Image files to predict")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8765", help="Server URL")
+    parser.add_argument("--unix-socket", type=str, default=None, help="Server Unix socket path")
+    args = parser.parse_args()
+    
+    client = InferenceClient(args.url, unix_socket=args.unix_socket)
+    for path in args.images:
+        start = time.perf_counter()
+        result = client.predict(path)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(json.dumps({"image": path, "round_trip_ms": elapsed, **result}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Deterministic train/val/test splitting for large image corpora.
+
+Each image is assigned by hashing its path relative to the source root,
+so the split is reproducible, independent of file order, and does not
+change for existing images when new ones are added. With stratify, images
+are grouped by the rarest class in their label file and every group is
+filled to the target ratios; assignments found in the existing output are
+kept and only new images are placed, so stratified splits are stable too.
+
+Splits are materialized without copying pixels:
+    symlink   <out>/images/<split>/<relative path> and
+              <out>/labels/<split>/<relative path>.txt links to the source
+              files, the layout data.yaml expects
+    list      <out>/<split>.txt files of absolute image paths, which
+              Ultralytics accepts in place of directories
+
+Re-running only adds and removes the links that changed, so re-splitting
+500k images takes seconds.
+
+Usage (from the ml/ directory):
+    python -m utils.split dataset/raw/images --out dataset --ratios 0.8 0.1 0.1 --stratify
+"""
+
+import argparse
+import hashlib
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .dataset_index import label_path_for
+from .tensor_cache import find_images
+
+
+SPLITS = ("train", "val", "test")
+SPLIT_MODES = ("symlink", "list")
+
+
+def hash_fraction(key: str, salt: str = "") -> float:
+    """Stable pseudo-random number in [0, 1) for a key."""
+    digest = hashlib.blake2b(f"{salt}{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+def image_strata(image_paths: Sequence[str], workers: int = 16) -> List[int]:
+    """
+    Stratum of each image: its rarest class across the corpus, or -1 for
+    background images (no or empty label file).
+    """
+    def read_classes(path: str) -> np.ndarray:
+        try:
+            with open(label_path_for(path), "r") as f:
+                rows = [line.split(None, 1)[0] for line in f if line.strip()]
+        except FileNotFoundError:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.array(rows, dtype=np.float64).astype(np.int64))
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        classes = list(pool.map(read_classes, image_paths))
+    frequency = Counter(int(c) for image_classes in classes for c in image_classes)
+    return [min(c.tolist(), key=lambda c: (frequency[c], c)) if len(c) else -1 for c in classes]
+
+
+def assign_splits(
+    keys: Sequence[str],
+    ratios: Sequence[float] = (0.8, 0.1, 0.1),
+    strata: Optional[Sequence[int]] = None,
+    previous: Optional[Dict[str, str]] = None,
+    salt: str = "",
+) -> Dict[str, str]:
+    """
+    Map each key to a split name.
+    
+    Args:
+        keys: Stable image identifiers (paths relative to the corpus root)
+        ratios: train/val/test fractions (normalized to sum to 1)
+        strata: Optional group per key; each group is split to the ratios
+        previous: Existing assignments to keep (stratified mode only;
+            unstratified assignments never change anyway)
+        salt: Changes the whole split, e.g. for a second independent split
+    
+    Returns:
+        {key: "train" | "val" | "test"}
+    """
+    ratios = np.asarray(ratios, dtype=np.float64)
+    ratios = ratios / ratios.sum()
+    if strata is None:
+        edges = np.cumsum(ratios)[:-1]
+        fractions = np.array([hash_fraction(key, salt) for key in keys])
+        return dict(zip(keys, np.array(SPLITS)[np.searchsorted(edges, fractions, side="right")].tolist()))
+    
+    previous = previous or {}
+    groups: Dict[int, List[str]] = {}
+    for key, stratum in zip(keys, strata):
+        groups.setdefault(stratum, []).append(key)
+    
+    assignment = {}
+    for members in groups.values():
+        counts = np.zeros(len(SPLITS))
+        new = []
+        for key in members:
+            split = previous.get(key)
+            if split in SPLITS:
+                assignment[key] = split
+                counts[SPLITS.index(split)] += 1
+            else:
+                new.append(key)
+        # New images in hash order, each to the split furthest below its share
+        for key in sorted(new, key=lambda key: hash_fraction(key, salt)):
+            split = int(np.argmax(ratios * (counts.sum() + 1) - counts))
+            assignment[key] = SPLITS[split]
+            counts[split] += 1
+    return assignment
+
+
+def read_existing(out_dir: str, mode: str = "symlink") -> Dict[str, str]:
+    """
+    Current split membership in out_dir as {absolute image path: split}.
+    Only symlinks count in symlink mode; real files are never touched.
+    """
+    out_dir = Path(out_dir)
+    existing = {}
+    for split in SPLITS:
+        if mode == "list":
+            list_path = out_dir / f"{split}.txt"
+            if list_path.exists():
+                with open(list_path, "r") as f:
+                    existing.update((line.strip(), split) for line in f if line.strip())
+        else:
+            for link in _walk_links(out_dir / "images" / split):
+                existing[os.path.realpath(link)] = split
+    return existing
+
+
+def _walk_links(split_dir: Path) -> List[Path]:
+    """All symlinks to files under split_dir, at any depth."""
+    links = []
+    for dirpath, _dirnames, filenames in os.walk(split_dir):
+        links.extend(Path(dirpath) / name for name in filenames if os.path.islink(os.path.join(dirpath, name)))
+    return links
+
+
+def write_lists(assignment: Dict[str, str], out_dir: str) -> Dict[str, int]:
+    """Write <out_dir>/<split>.txt of absolute image paths, atomically."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    counts = {}
+    for split in SPLITS:
+        paths = sorted(path for path, s in assignment.items() if s == split)
+        tmp_path = out_dir / f"{split}.txt.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("".join(f"{path}\n" for path in paths))
+        os.replace(tmp_path, out_dir / f"{split}.txt")
+        counts[split] = len(paths)
+    return counts
+
+
+def write_symlinks(assignment: Dict[str, str], out_dir: str, source: Optional[str] = None) -> Dict[str, int]:
+    """
+    Make <out_dir>/images/<split> and labels/<split> hold symlinks to
+    exactly the assigned images and their label files.
+    
+    Each link keeps the image's path relative to source (default: the
+    deepest directory containing all images), so images with the same
+    name in different subdirectories get separate links. Links that are
+    already right are left alone, stale links are removed, and a real
+    file in the way of a link, or two images wanting the same link, is
+    reported as a conflict rather than replaced.
+    
+    Returns:
+        Counts of linked, unchanged, removed and conflicting images
+    """
+    out_dir = Path(out_dir)
+    counts = {"linked": 0, "unchanged": 0, "removed": 0, "conflicts": 0}
+    if source is None:
+        source = os.path.commonpath([os.path.dirname(path) for path in assignment]) if assignment else "."
+    wanted = {}
+    for path, split in assignment.items():
+        relative = Path(path).relative_to(source)
+        image_link = out_dir / "images" / split / relative
+        if wanted.setdefault(image_link, Path(path)) != Path(path):
+            counts["conflicts"] += 1
+            continue
+        label = label_path_for(path)
+        if label.exists():
+            wanted.setdefault(out_dir / "labels" / split / relative.with_suffix(".txt"), label)
+    
+    for kind in ("images", "labels"):
+        for split in SPLITS:
+            split_dir = out_dir / kind / split
+            split_dir.mkdir(parents=True, exist_ok=True)
+            for link in _walk_links(split_dir):
+                if wanted.get(link) == Path(os.readlink(link)):
+                    wanted.pop(link)
+                    counts["unchanged"] += kind == "images"
+                else:
+                    link.unlink()
+                    counts["removed"] += kind == "images"
+    
+    for link, target in wanted.items():
+        is_image = link.relative_to(out_dir).parts[0] == "images"
+        if os.path.lexists(link):
+            counts["conflicts"] += is_image
+            continue
+        link.parent.mkdir(parents=True, exist_ok=True)
+        link.symlink_to(target)
+        counts["linked"] += is_image
+    return counts
+
+
+def split_dataset(
+    source: str,
+    out_dir: str = "dataset",
+    ratios: Sequence[float] = (0.8, 0.1, 0.1),
+    mode: str = "symlink",
+    stratify: bool = False,
+    salt: str = "",
+) -> Dict:
+    """
+    Split every image under source and materialize the split in out_dir.
+    
+    Returns:
+        Summary: images per split, plus the link counts in symlink mode
+    """
+    if mode not in SPLIT_MODES:
+        raise ValueError(f"mode must be one of {SPLIT_MODES}, got {mode}")
+    source = Path(source).resolve()
+    paths = find_images([source])
+    if not paths:
+        raise FileNotFoundError(f"No images found in {source}")
+    keys = [Path(path).relative_to(source).as_posix() for path in paths]
+    
+    strata, previous = None, None
+    if stratify:
+        strata = image_strata(paths)
+        existing = read_existing(out_dir, mode)
+        previous = {key: existing[path] for key, path in zip(keys, paths) if path in existing}
+    by_key = assign_splits(keys, ratios, strata=strata, previous=previous, salt=salt)
+    assignment = {path: by_key[key] for key, path in zip(keys, paths)}
+    
+    summary = {"images": Counter(assignment.values())}
+    if mode == "list":
+        write_lists(assignment, out_dir)
+    else:
+        summary.update(write_symlinks(assignment, out_dir, source))
+    summary["images"] = {split: summary["images"].get(split, 0) for split in SPLITS}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic hash-based train/val/test split")
+    parser.add_argument("source", help="Directory with all images (labels via images -> labels)")
+    parser.add_argument("--out", default="dataset", help="Output dataset directory")
+    parser.add_argument("--ratios", type=float, nargs=3, default=[0.8, 0.1, 0.1], help="train val test fractions")
+    parser.add_argument("--mode", default="symlink", choices=SPLIT_MODES, help="Symlink tree or list files")
+    parser.add_argument("--stratify", action="store_true", help="Balance splits per rarest class")
+    parser.add_argument("--salt", default="", help="Change to draw a different split")
+    args = parser.parse_args()
+    
+    summary = split_dataset(args.source, args.out, args.ratios, args.mode, args.stratify, args.salt)
+    print("  ".join(f"{split}: {count}" for split, count in summary["images"].items()))
+    if args.mode == "symlink":
+        print(f"Links: {summary['linked']} new, {summary['unchanged']} unchanged, {summary['removed']} removed"
+              + (f", {summary['conflicts']} conflicting real files left in place" if summary["conflicts"] else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Streaming bulk prediction: sources, incremental sinks and resume.
+
+The daily ingest runs one model over tens of thousands of images (or
+video frames) and must survive crashes. iter_source expands a directory,
+glob or video into (key, item) pairs lazily; run_stream batches them
+through a detector and appends one record per image to a sink as it
+goes, so memory stays flat however large the source is.
+
+An item that fails to decode or to run through the model does not stop
+the run: it gets an error record ({"source", "detections": [], "error"})
+and is checkpointed like any other, so a resumed run moves past it.
+
+Resume works through a checkpoint file. After each sink flush, the keys
+it covered and the sink's position (byte offset for JSONL, part count for
+Parquet) are appended to the checkpoint and fsync'd. On restart, output
+written after the last checkpoint is truncated away and checkpointed keys
+are skipped, so every image appears exactly once in the output.
+"""
+
+import glob
+import json
+import os
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import cv2
+import numpy as np
+
+from .preprocess import IMAGE_SUFFIXES
+from .tensor_cache import find_images
+
+
+VIDEO_SUFFIXES = {".mp4", ".avi", ".mov", ".mkv", ".webm", ".m4v"}
+
+
+def iter_source(
+    source: str,
+    vid_stride: int = 1,
+    done: Set[str] = frozenset(),
+) -> Iterator[Tuple[str, Union[str, np.ndarray]]]:
+    """
+    Expand a source into (key, item) pairs, skipping keys in done.
+    
+    source may be an image file, a directory (searched recursively), a
+    glob pattern or a video file. Images yield (path, path); videos yield
+    ("video.mp4#<frame>", BGR frame) for every vid_stride-th frame,
+    seeking past frames that are already done.
+    """
+    path = Path(source)
+    if path.suffix.lower() in VIDEO_SUFFIXES and path.is_file():
+        yield from _iter_video(str(path), vid_stride, done)
+        return
+    
+    if path.exists():
+        paths = find_images([path])
+    else:
+        paths = sorted(p for p in glob.glob(source, recursive=True) if Path(p).suffix.lower() in IMAGE_SUFFIXES)
+    for image_path in paths:
+        if image_path not in done:
+            yield image_path, image_path
+
+
+def _iter_video(path: str, vid_stride: int, done: Set[str]) -> Iterator[Tuple[str, np.ndarray]]:
+    """Frames of one video; resumes after the last finished frame."""
+    finished = [int(key.rsplit("#", 1)[1]) for key in done if key.startswith(path + "#")]
+    frame_index = max(finished) + vid_stride if finished else 0
+    
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Failed to open video: {path}")
+    try:
+        if frame_index:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if frame_index % vid_stride == 0:
+                yield f"{path}#{frame_index}", frame
+            frame_index += 1
+            # grab() skips decoding frames that the stride drops
+            while frame_index % vid_stride and capture.grab():
+                frame_index += 1
+    finally:
+        capture.release()
+
+
+class Checkpoint:
+    """
+    Append-only log of finished keys and the sink position after them.
+    
+    Each line is {"position": int, "keys": [...]}; a torn final line from
+    a crash is ignored.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        self.position = 0
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    self.done.update(entry["keys"])
+                    self.position = entry["position"]
+    
+    def mark(self, keys: List[str], position: int):
+        """Record keys as finished once the sink has reached position."""
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"position": position, "keys": keys}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(keys)
+        self.position = position
+
+
+class JsonlSink:
+    """One JSON record per line; flushed and fsync'd after every batch."""
+    
+    def __init__(self, path: str, position: int = 0):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "ab")
+        if position > os.path.getsize(path):
+            self._file.close()
+            raise ValueError(f"{path} is shorter than its checkpoint; delete the checkpoint to start over")
+        # Drop records written after the last checkpoint
+        self._file.truncate(position)
+        self._file.seek(position)
+        self._lines: List[bytes] = []
+    
+    def write(self, records: List[Dict]):
+        self._lines.extend((json.dumps(record) + "\n").encode() for record in records)
+    
+    def should_flush(self) -> bool:
+        return bool(self._lines)
+    
+    def flush(self) -> int:
+        self._file.write(b"".join(self._lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._lines = []
+        return self._file.tell()
+    
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    """
+    Parquet part files (part-00000.parquet, ...) in a directory.
+    
+    Parquet files cannot be appended to, so records are buffered and
+    written rows_per_file at a time, each part atomically via rename. The
+    position is the number of finished parts. The schema is fixed to the
+    train.py detection dict, so parts with no detections at all still
+    share one schema with the rest of the dataset.
+    """
+    
+    def __init__(self, directory: str, position: int = 0, rows_per_file: int = 5000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow: pip install pyarrow")
+        self._pa, self._pq = pa, pq
+        detection = pa.struct([
+            ("class_id", pa.int64()),
+            ("class", pa.string()),
+            ("scientific_name", pa.string()),
+            ("category", pa.string()),
+            ("severity_range", pa.list_(pa.string())),
+            ("confidence", pa.float64()),
+            ("box", pa.list_(pa.float64())),
+        ])
+        self.schema = pa.schema([
+            ("source", pa.string()),
+            ("detections", pa.list_(detection)),
+            ("error", pa.string()),
+        ])
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.rows_per_file = rows_per_file
+        self._parts = position
+        self._rows: List[Dict] = []
+        # Parts written after the last checkpoint would duplicate rows
+        for part in self.directory.glob("part-*.parquet"):
+            if int(part.stem.split("-")[1]) >= position:
+                part.unlink()
+    
+    def write(self, records: List[Dict]):
+        self._rows.extend(records)
+    
+    def should_flush(self) -> bool:
+        return len(self._rows) >= self.rows_per_file
+    
+    def flush(self) -> int:
+        if self._rows:
+            part = self.directory / f"part-{self._parts:05d}.parquet"
+            tmp = part.with_suffix(".tmp")
+            self._pq.write_table(self._pa.Table.from_pylist(self._rows, schema=self.schema), tmp)
+            os.replace(tmp, part)
+            self._parts += 1
+            self._rows = []
+        return self._parts
+    
+    def close(self):
+        pass
+
+
+def open_sink(output: str, position: int = 0):
+    """JsonlSink for a *.jsonl file, ParquetSink for a *.parquet directory."""
+    if output.endswith(".jsonl"):
+        return JsonlSink(output, position)
+    if output.endswith(".parquet"):
+        return ParquetSink(output, position)
+    raise ValueError(f"Output must end in .jsonl or .parquet, got {output}")
+
+
+def _infer_isolated(
+    infer_batch: Callable[[List[Union[str, np.ndarray]]], List[List[Dict]]],
+    items: List[Union[str, np.ndarray]],
+) -> Tuple[List[List[Dict]], List[Optional[str]]]:
+    """
+    infer_batch over items, returning (detections, errors) per item. When
+    the batch fails, items are retried one at a time so only the bad ones
+    get an error message (and empty detections).
+    """
+    try:
+        return infer_batch(items), [None] * len(items)
+    except Exception as e:
+        if len(items) == 1:
+            return [[]], [f"{type(e).__name__}: {e}"]
+    detections, errors = [], []
+    for item in items:
+        try:
+            detections.append(infer_batch([item])[0])
+            errors.append(None)
+        except Exception as e:
+            detections.append([])
+            errors.append(f"{type(e).__name__}: {e}")
+    return detections, errors
+
+
+def run_stream(
+    items: Iterable[Tuple[str, Union[str, np.ndarray]]],
+    infer_batch: Callable[[List[Union[str, np.ndarray]]], List[List[Dict]]],
+    sink,
+    checkpoint: Checkpoint,
+    batch_size: int = 16,
+    on_batch: Optional[Callable[[List[str], List, List[List[Dict]]], None]] = None,
+) -> Dict:
+    """
+    Batch items through infer_batch and stream records to sink.
+    
+    infer_batch maps a list of paths/frames to one detection list per
+    item. Each record is {"source": key, "detections": [...]}; an item
+    that raises gets {"source": key, "detections": [], "error": message}
+    instead and on_batch only sees the items that succeeded. Keys are
+    checkpointed only after the sink has durably written them.
+    
+    Returns:
+        Stats dict: images, detections, errors, elapsed, images_per_sec
+    """
+    stats = {"images": 0, "detections": 0, "errors": 0}
+    pending: List[str] = []
+    start = time.perf_counter()
+    items = iter(items)
+    
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            break
+        keys = [key for key, _item in batch]
+        detections, errors = _infer_isolated(infer_batch, [item for _key, item in batch])
+        sink.write([
+            {"source": key, "detections": dets} if error is None else {"source": key, "detections": [], "error": error}
+            for key, dets, error in zip(keys, detections, errors)
+        ])
+        ok = [i for i, error in enumerate(errors) if error is None]
+        if on_batch is not None and ok:
+            on_batch([keys[i] for i in ok], [batch[i][1] for i in ok], [detections[i] for i in ok])
+        
+        pending.extend(keys)
+        stats["images"] += len(keys)
+        stats["detections"] += sum(len(dets) for dets in detections)
+        stats["errors"] += len(keys) - len(ok)
+        if sink.should_flush():
+            checkpoint.mark(pending, sink.flush())
+            pending = []
+    
+    if pending:
+        checkpoint.mark(pending, sink.flush())
+    sink.close()
+    
+    stats["elapsed"] = time.perf_counter() - start
+    stats["images_per_sec"] = stats["images"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+    return stats
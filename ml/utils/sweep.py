@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Hyperparameter sweeps over the training config.
+
+A sweep file names config entries by dotted path and gives each a value
+list or a range:
+
+    method: bayes           # grid | random | bayes
+    trials: 24
+    parallel: 2             # trials trained at the same time
+    epochs: 60              # epochs per trial if never pruned
+    min_epochs: 5           # first successive-halving rung
+    eta: 3                  # keep the top 1/eta at each rung
+    metric: map50           # map50 | map50-95 (validation)
+    space:
+      training.learning_rate: {low: 0.001, high: 0.03, log: true}
+      augmentation.mosaic: [0.5, 1.0]
+
+Every trial gets a deep copy of the base config with its values applied
+and runs as a separate `train.py` process (own CUDA context, own log),
+with the CPU budget split evenly between concurrent trials. After each
+epoch the trial records the validation metric in a SQLite file shared by
+the sweep. At rung epochs min_epochs * eta^k, a trial stops unless it is
+among the best ceil(n / eta) of the n trials that reached that rung so
+far (asynchronous successive halving), so weak settings release their
+slot early. A leaderboard is rewritten after every finished trial.
+
+"bayes" is a small tree-structured Parzen estimator: after a few random
+trials, candidates are drawn around the best quarter of results and the
+one most likely under the good results relative to the rest is tried.
+Pruned trials count with the best value they reached.
+
+Usage (from the ml/ directory):
+    python train.py --mode sweep --sweep sweep.yaml --parallel 2
+"""
+
+import copy
+import itertools
+import json
+import math
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import yaml
+
+
+METHODS = ("grid", "random", "bayes")
+
+# Validation metrics reported by Ultralytics after each epoch
+METRICS = {
+    "map50": "metrics/mAP50(B)",
+    "map50-95": "metrics/mAP50-95(B)",
+}
+
+SWEEP_DEFAULTS = {
+    "method": "random",
+    "trials": None,         # grid: every point; random/bayes: 16
+    "parallel": 1,
+    "epochs": 50,
+    "min_epochs": 5,
+    "eta": 3,
+    "metric": "map50",
+    "seed": 0,
+    "space": {},
+}
+
+
+def load_sweep(path: str) -> Dict:
+    """Read a sweep file and fill in defaults."""
+    with open(path, "r") as f:
+        sweep = {**SWEEP_DEFAULTS, **(yaml.safe_load(f) or {})}
+    if sweep["method"] not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, got {sweep['method']}")
+    if sweep["metric"] not in METRICS:
+        raise ValueError(f"metric must be one of {tuple(METRICS)}, got {sweep['metric']}")
+    if not sweep["space"]:
+        raise ValueError(f"{path} has an empty search space")
+    for name, spec in sweep["space"].items():
+        if isinstance(spec, dict) and not {"low", "high"} <= set(spec):
+            raise ValueError(f"Range for {name} needs low and high")
+        if not isinstance(spec, (dict, list)):
+            raise ValueError(f"{name} must be a value list or a {{low, high}} range")
+    return sweep
+
+
+def rung_epochs(epochs: int, min_epochs: int, eta: int) -> List[int]:
+    """Epochs at which trials are compared: min_epochs * eta^k below epochs."""
+    rungs, epoch = [], min_epochs
+    while 0 < epoch < epochs:
+        rungs.append(epoch)
+        epoch *= eta
+    return rungs
+
+
+def set_by_path(config: Dict, path: str, value: Any):
+    """Set config["a"]["b"] for path "a.b", creating sections as needed."""
+    *sections, key = path.split(".")
+    for section in sections:
+        config = config.setdefault(section, {})
+    config[key] = value
+
+
+def trial_config(base_config: Dict, params: Dict[str, Any]) -> Dict:
+    """Deep copy of base_config with a trial's values applied."""
+    config = copy.deepcopy(base_config)
+    for path, value in params.items():
+        set_by_path(config, path, value)
+    return config
+
+
+# ============================================================
+# Samplers
+# ============================================================
+
+def _to_unit(spec: Dict, value: float) -> float:
+    low, high = spec["low"], spec["high"]
+    if spec.get("log"):
+        return (math.log(value) - math.log(low)) / (math.log(high) - math.log(low))
+    return (value - low) / (high - low)
+
+
+def _from_unit(spec: Dict, u: float):
+    low, high = spec["low"], spec["high"]
+    u = min(max(u, 0.0), 1.0)
+    value = math.exp(math.log(low) + u * (math.log(high) - math.log(low))) if spec.get("log") else low + u * (high - low)
+    return int(round(value)) if spec.get("int") else float(value)
+
+
+def grid_points(space: Dict) -> List[Dict[str, Any]]:
+    """Every combination of the value lists (ranges are not allowed)."""
+    ranges = [name for name, spec in space.items() if isinstance(spec, dict)]
+    if ranges:
+        raise ValueError(f"Grid search needs value lists, got ranges for {', '.join(ranges)}")
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+class RandomSampler:
+    """Independent uniform (or log-uniform) draws per parameter."""
+    
+    def __init__(self, space: Dict, seed: int = 0):
+        self.space = space
+        self.rng = np.random.default_rng(seed)
+    
+    def sample_one(self, spec):
+        if isinstance(spec, list):
+            return spec[int(self.rng.integers(len(spec)))]
+        return _from_unit(spec, float(self.rng.random()))
+    
+    def suggest(self, observations: Sequence[Tuple[Dict, float]]) -> Dict[str, Any]:
+        return {name: self.sample_one(spec) for name, spec in self.space.items()}
+
+
+class TPESampler(RandomSampler):
+    """
+    Independent tree-structured Parzen estimator.
+    
+    Observations are split into the best gamma fraction ("good") and the
+    rest. Ranges get a Gaussian kernel per observation in [0, 1] space
+    (log scale for log ranges) plus a uniform prior; value lists get
+    smoothed frequencies. n_candidates draws from the good model are
+    scored by log l(x) - log g(x) and the best is suggested.
+    """
+    
+    def __init__(self, space: Dict, seed: int = 0, n_startup: int = 6, gamma: float = 0.25, n_candidates: int = 32):
+        super().__init__(space, seed)
+        self.n_startup = n_startup
+        self.gamma = gamma
+        self.n_candidates = n_candidates
+    
+    def suggest(self, observations: Sequence[Tuple[Dict, float]]) -> Dict[str, Any]:
+        if len(observations) < self.n_startup:
+            return super().suggest(observations)
+        ranked = sorted(observations, key=lambda obs: -obs[1])
+        n_good = max(1, math.ceil(self.gamma * len(ranked)))
+        good = [params for params, _ in ranked[:n_good]]
+        bad = [params for params, _ in ranked[n_good:]]
+        
+        candidates = [{} for _ in range(self.n_candidates)]
+        score = np.zeros(self.n_candidates)
+        for name, spec in self.space.items():
+            good_values = [params[name] for params in good if name in params]
+            bad_values = [params[name] for params in bad if name in params]
+            values = self._draw(spec, good_values)
+            score += self._log_density(spec, good_values, values) - self._log_density(spec, bad_values, values)
+            for candidate, value in zip(candidates, values):
+                candidate[name] = value
+        return candidates[int(np.argmax(score))]
+    
+    def _bandwidth(self, n: int) -> float:
+        return max(0.05, 1.0 / (n + 1))
+    
+    def _draw(self, spec, observed: List) -> List:
+        if isinstance(spec, list):
+            probs = self._frequencies(spec, observed)
+            return [spec[i] for i in self.rng.choice(len(spec), size=self.n_candidates, p=probs)]
+        
+        centres = np.array([_to_unit(spec, value) for value in observed])
+        draws = []
+        for _ in range(self.n_candidates):
+            # Uniform prior with weight 1 / (n + 1), else around an observation
+            if len(centres) == 0 or self.rng.random() < 1 / (len(centres) + 1):
+                draws.append(_from_unit(spec, float(self.rng.random())))
+            else:
+                centre = centres[self.rng.integers(len(centres))]
+                draws.append(_from_unit(spec, float(centre + self.rng.normal(0, self._bandwidth(len(centres))))))
+        return draws
+    
+    def _frequencies(self, choices: List, observed: List) -> np.ndarray:
+        counts = np.ones(len(choices))
+        for value in observed:
+            if value in choices:
+                counts[choices.index(value)] += 1
+        return counts / counts.sum()
+    
+    def _log_density(self, spec, observed: List, values: List) -> np.ndarray:
+        if isinstance(spec, list):
+            probs = self._frequencies(spec, observed)
+            return np.log([probs[spec.index(value)] for value in values])
+        
+        points = np.array([_to_unit(spec, value) for value in values])
+        centres = np.array([_to_unit(spec, value) for value in observed])
+        density = np.ones(len(points))  # uniform prior on [0, 1]
+        if len(centres):
+            bandwidth = self._bandwidth(len(centres))
+            z = (points[:, np.newaxis] - centres[np.newaxis, :]) / bandwidth
+            density += (np.exp(-0.5 * z ** 2) / (bandwidth * math.sqrt(2 * math.pi))).sum(axis=1)
+        return np.log(density / (len(centres) + 1))
+
+
+# ============================================================
+# Successive halving
+# ============================================================
+
+class RungStore:
+    """
+    Per-epoch trial metrics in SQLite, shared by all trial processes.
+    
+    report() records a value and, at a rung epoch, decides in the same
+    transaction whether the trial keeps training.
+    """
+    
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS epochs "
+            "(trial INTEGER NOT NULL, epoch INTEGER NOT NULL, value REAL NOT NULL, PRIMARY KEY (trial, epoch))"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS pruned (trial INTEGER PRIMARY KEY, epoch INTEGER NOT NULL)")
+    
+    def report(self, trial: int, epoch: int, value: float, rungs: Sequence[int] = (), eta: int = 3) -> bool:
+        """Record trial's value after epoch; False if it should stop here."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.execute("INSERT OR REPLACE INTO epochs VALUES (?, ?, ?)", (trial, epoch, value))
+            keep = True
+            if epoch in rungs:
+                others = [row[0] for row in self._db.execute("SELECT value FROM epochs WHERE epoch = ?", (epoch,))]
+                keep = keep_at_rung(value, others, eta)
+                if not keep:
+                    self._db.execute("INSERT OR REPLACE INTO pruned VALUES (?, ?)", (trial, epoch))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return keep
+    
+    def history(self, trial: int) -> List[Tuple[int, float]]:
+        return self._db.execute("SELECT epoch, value FROM epochs WHERE trial = ? ORDER BY epoch", (trial,)).fetchall()
+    
+    def pruned_at(self, trial: int) -> Optional[int]:
+        row = self._db.execute("SELECT epoch FROM pruned WHERE trial = ?", (trial,)).fetchone()
+        return row[0] if row else None
+    
+    def close(self):
+        self._db.close()
+
+
+def keep_at_rung(value: float, values_at_rung: Sequence[float], eta: int) -> bool:
+    """
+    True if value is among the best ceil(n / eta) of the n values seen at
+    a rung (value included), so the first trials to arrive always continue.
+    """
+    n_keep = math.ceil(len(values_at_rung) / eta)
+    better = sum(other > value for other in values_at_rung)
+    return better < n_keep
+
+
+def make_pruning_callback(sweep_config: Dict) -> Callable:
+    """
+    Ultralytics on_fit_epoch_end callback for one trial: records the
+    validation metric and stops training when the trial is pruned.
+    sweep_config is the "sweep" section run_sweep writes into trial configs.
+    """
+    store = RungStore(sweep_config["db"])
+    metric_key = METRICS[sweep_config["metric"]]
+    
+    def on_fit_epoch_end(trainer):
+        epoch = trainer.epoch + 1
+        value = float(trainer.metrics.get(metric_key, 0.0))
+        if not store.report(sweep_config["trial"], epoch, value, sweep_config["rungs"], sweep_config["eta"]):
+            print(f"Sweep trial {sweep_config['trial']} pruned after epoch {epoch} ({sweep_config['metric']} {value:.4f})")
+            trainer.stop = True
+    
+    return on_fit_epoch_end
+
+
+# ============================================================
+# Sweep runner
+# ============================================================
+
+def _run_trial(command: List[str], log_path: Path, threads: int) -> int:
+    env = dict(os.environ)
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        env[var] = str(threads)
+    with open(log_path, "w") as log:
+        return subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, env=env).returncode
+
+
+def write_leaderboard(trials: List[Dict], sweep_dir: Path) -> List[Dict]:
+    """
+    Rank finished trials and write leaderboard.json: complete trials by
+    value, then pruned ones by how far they got and value, failed last.
+    """
+    order = {"complete": 0, "pruned": 1, "failed": 2}
+    board = sorted(trials, key=lambda t: (
+        order[t["status"]],
+        -t["epochs"] if t["status"] == "pruned" else 0,
+        -(t["value"] if t["value"] is not None else -1),
+    ))
+    tmp_path = sweep_dir / "leaderboard.json.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(board, f, indent=2)
+    os.replace(tmp_path, sweep_dir / "leaderboard.json")
+    return board
+
+
+def print_leaderboard(board: List[Dict], metric: str, top: int = 10):
+    print(f"\n{'Rank':>4} {'Trial':>6} {metric:>10} {'Epochs':>7} {'Status':<9} Params")
+    for rank, trial in enumerate(board[:top], 1):
+        value = f"{trial['value']:.4f}" if trial["value"] is not None else "-"
+        params = ", ".join(f"{name}={value!r}" for name, value in trial["params"].items())
+        print(f"{rank:>4} {trial['trial']:>6} {value:>10} {trial['epochs']:>7} {trial['status']:<9} {params}")
+
+
+def run_sweep(
+    sweep: Dict,
+    base_config: Dict,
+    sweep_dir: str,
+    parallel: Optional[int] = None,
+    cpu_budget: Optional[int] = None,
+    script: str = "train.py",
+    extra_args: Sequence[str] = (),
+) -> List[Dict]:
+    """
+    Run a sweep (see load_sweep) and return the leaderboard.
+    
+    Args:
+        sweep: Sweep settings and search space
+        base_config: Loaded training config; never modified
+        sweep_dir: Output directory (trial configs, logs, metrics DB,
+            leaderboard.json); trial weights go to
+            runs/detect/sweeps/<sweep_dir name>/trial_NNN. Both must be
+            new or empty, so results of an earlier sweep with the same
+            name never mix into this one
+        parallel: Concurrent trials (default: sweep["parallel"])
+        cpu_budget: CPU threads shared by concurrent trials (default: all)
+        script: Training entry point run per trial
+        extra_args: Further train.py arguments for every trial
+    """
+    sweep_dir = Path(sweep_dir)
+    for directory in (sweep_dir, Path("runs/detect/sweeps") / sweep_dir.name):
+        if directory.is_dir() and any(directory.iterdir()):
+            raise FileExistsError(f"{directory} is not empty; choose another sweep name or remove it")
+    sweep_dir.mkdir(parents=True, exist_ok=True)
+    parallel = parallel or sweep["parallel"]
+    threads = max(1, (cpu_budget or os.cpu_count() or 1) // parallel)
+    rungs = rung_epochs(sweep["epochs"], sweep["min_epochs"], sweep["eta"])
+    db_path = sweep_dir / "trials.sqlite"
+    store = RungStore(str(db_path))
+    
+    if sweep["method"] == "grid":
+        grid = grid_points(sweep["space"])
+        n_trials = min(sweep["trials"], len(grid)) if sweep["trials"] else len(grid)
+        sampler = None
+    else:
+        n_trials = sweep["trials"] or 16
+        sampler = (TPESampler if sweep["method"] == "bayes" else RandomSampler)(sweep["space"], seed=sweep["seed"])
+    print(f"Sweep: {n_trials} {sweep['method']} trials, {parallel} at a time, {threads} threads each, "
+          f"up to {sweep['epochs']} epochs, rungs at {rungs or 'none'}")
+    
+    finished, observations, running, board = [], [], {}, []
+    with open(sweep_dir / "sweep.yaml", "w") as f:
+        yaml.safe_dump(sweep, f, sort_keys=False)
+    
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        next_trial = 0
+        while next_trial < n_trials or running:
+            while next_trial < n_trials and len(running) < parallel:
+                params = grid[next_trial] if sampler is None else sampler.suggest(observations)
+                config = trial_config(base_config, params)
+                config["training"]["epochs"] = sweep["epochs"]
+                config["training"]["workers"] = min(config["training"].get("workers", 8), threads)
+                config["sweep"] = {
+                    "db": str(db_path.resolve()),
+                    "trial": next_trial,
+                    "rungs": rungs,
+                    "eta": sweep["eta"],
+                    "metric": sweep["metric"],
+                }
+                config_path = sweep_dir / f"trial_{next_trial:03d}.yaml"
+                with open(config_path, "w") as f:
+                    yaml.safe_dump(config, f, sort_keys=False)
+                
+                name = f"sweeps/{sweep_dir.name}/trial_{next_trial:03d}"
+                command = [sys.executable, script, "--mode", "train", "--config", str(config_path),
+                           "--no-validate", "--name", name, *extra_args]
+                log_path = sweep_dir / f"trial_{next_trial:03d}.log"
+                future = pool.submit(_run_trial, command, log_path, threads)
+                running[future] = {"trial": next_trial, "params": params, "run_dir": f"runs/detect/{name}",
+                                   "log": str(log_path), "started": time.time()}
+                next_trial += 1
+            
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                trial = running.pop(future)
+                history = store.history(trial["trial"])
+                pruned_at = store.pruned_at(trial["trial"])
+                returncode = future.result()
+                trial.update(
+                    status="failed" if returncode != 0 else "pruned" if pruned_at else "complete",
+                    value=max(value for _, value in history) if history else None,
+                    epochs=history[-1][0] if history else 0,
+                    seconds=round(time.time() - trial.pop("started"), 1),
+                )
+                finished.append(trial)
+                if trial["value"] is not None:
+                    observations.append((trial["params"], trial["value"]))
+                print(f"Trial {trial['trial']} {trial['status']}: {sweep['metric']} "
+                      f"{trial['value'] if trial['value'] is not None else '-'} after {trial['epochs']} epochs")
+                board = write_leaderboard(finished, sweep_dir)
+    
+    store.close()
+    print_leaderboard(board, sweep["metric"])
+    print(f"\nLeaderboard written to {sweep_dir / 'leaderboard.json'}")
+    return board
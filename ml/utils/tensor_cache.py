@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped cache of letterboxed images for the PeanutGuard pipeline.
+
+Decodes and letterboxes each image once per input size and stores the
+uint8 (S, S, 3) canvases in one raw blob plus a JSON index of per-image
+slot, mtime and scale/padding metadata. Repeated evaluation passes and
+offline experiments then read pixels straight from the memory map instead
+of decoding JPEGs again.
+
+Usage (from the ml/ directory):
+    python -m utils.tensor_cache dataset/images/val dataset/images/test --size 640
+"""
+
+import argparse
+import functools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .preprocess import IMAGE_SUFFIXES, load_image, resize_with_padding
+
+
+LIST_SUFFIX = ".txt"
+
+
+class TensorCache:
+    """
+    Letterboxed-image cache for one input size, keyed by path and mtime.
+    
+    Files (in cache_dir):
+        letterbox_<S>.u8    raw uint8 array of shape (capacity, S, S, 3)
+        letterbox_<S>.json  index: path -> slot, mtime_ns, original_shape,
+                            scale, padding
+    
+    Each slot takes S * S * 3 bytes (1.2 MB at 640), so the blob is sized
+    like the decoded dataset; the OS page cache keeps hot slots in RAM.
+    An entry is only served while the image's mtime matches; update()
+    re-letterboxes changed images in place and appends new ones.
+    """
+    
+    def __init__(self, cache_dir: str, target_size: int = 640):
+        self.cache_dir = Path(cache_dir)
+        self.target_size = target_size
+        self.blob_path = self.cache_dir / f"letterbox_{target_size}.u8"
+        self.index_path = self.cache_dir / f"letterbox_{target_size}.json"
+        self.entries: Dict[str, dict] = {}
+        self.failed: Dict[str, str] = {}
+        self.capacity = 0
+        self._data = None
+        
+        if self.index_path.exists():
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            self.capacity = index["capacity"]
+            self.entries = index["entries"]
+            self._data = self._map("r")
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def __contains__(self, path: str) -> bool:
+        return self.get(path) is not None
+    
+    @property
+    def slot_shape(self) -> Tuple[int, int, int]:
+        return (self.target_size, self.target_size, 3)
+    
+    def _map(self, mode: str) -> Optional[np.memmap]:
+        if self.capacity == 0:
+            return None
+        return np.memmap(self.blob_path, dtype=np.uint8, mode=mode, shape=(self.capacity,) + self.slot_shape)
+    
+    def _fresh_entry(self, path: str) -> Optional[dict]:
+        """Index entry of path if it is cached and unchanged (a deleted file is a miss)."""
+        key = os.path.abspath(path)
+        entry = self.entries.get(key)
+        if entry is None or _mtime_ns(key) != entry["mtime_ns"]:
+            return None
+        return entry
+    
+    def get(self, path: str) -> Optional[Tuple[np.ndarray, dict]]:
+        """
+        Return (canvas, metadata) for a fresh entry, or None on a miss.
+        canvas is a read-only view into the memory map (no copy).
+        """
+        entry = self._fresh_entry(path)
+        if entry is None:
+            return None
+        return self._data[entry["slot"]], self._metadata(entry)
+    
+    def batch(self, image_paths: List[str]) -> Tuple[np.ndarray, List[dict]]:
+        """
+        Letterboxed uint8 (N, S, S, 3) canvases for cached images.
+        
+        When the images occupy consecutive slots (e.g. a sorted directory
+        read in order) the result is a zero-copy slice of the memory map;
+        otherwise the slots are gathered into a new array.
+        """
+        slots, metadata_list = [], []
+        for path in image_paths:
+            entry = self._fresh_entry(path)
+            if entry is None:
+                raise KeyError(f"Image not cached or changed since caching: {path}")
+            slots.append(entry["slot"])
+            metadata_list.append(self._metadata(entry))
+        
+        first = slots[0] if slots else 0
+        if slots == list(range(first, first + len(slots))):
+            return self._data[first:first + len(slots)], metadata_list
+        return self._data[slots], metadata_list
+    
+    def _metadata(self, entry: dict) -> dict:
+        return {
+            "original_shape": tuple(entry["original_shape"]),
+            "scale": entry["scale"],
+            "padding": tuple(entry["padding"]),
+            "target_size": self.target_size,
+        }
+    
+    def update(self, image_paths: Iterable[str], workers: int = 4) -> Dict[str, int]:
+        """
+        Cache new images and refresh changed ones.
+        
+        Unchanged entries are kept as they are; changed images reuse their
+        slot. New images first fill slots left free by images dropped from
+        the index, then are appended in the order given (pass sorted paths
+        to keep sequential reads zero-copy). Images that are missing or
+        fail to decode are skipped, dropped from the index (their slot is
+        reused by a later update) and listed with their error in
+        self.failed; the index is saved once at the end either way.
+        
+        Returns:
+            Counts of reused, rebuilt, added and failed images
+        """
+        counts = {"reused": 0, "rebuilt": 0, "added": 0, "failed": 0}
+        self.failed = {}
+        rebuild, new = [], []
+        for path in image_paths:
+            key = os.path.abspath(path)
+            mtime_ns = _mtime_ns(key)
+            if mtime_ns < 0:
+                self.entries.pop(key, None)
+                self.failed[key] = "file not found"
+                continue
+            entry = self.entries.get(key)
+            if entry is not None and entry["mtime_ns"] == mtime_ns:
+                counts["reused"] += 1
+            elif entry is not None:
+                rebuild.append((key, mtime_ns, entry["slot"], "rebuilt"))
+            else:
+                new.append((key, mtime_ns))
+        
+        if not rebuild and not new:
+            if self.failed:
+                self._save_index()
+            counts["failed"] = len(self.failed)
+            return counts
+        
+        used = {entry["slot"] for entry in self.entries.values()}
+        free = [slot for slot in range(self.capacity) if slot not in used]
+        free += range(self.capacity, self.capacity + max(0, len(new) - len(free)))
+        todo = rebuild + [(key, mtime_ns, slot, "added") for (key, mtime_ns), slot in zip(new, free)]
+        
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._data = None
+        self.capacity = max(self.capacity, max(slot for _, _, slot, _ in todo) + 1)
+        with open(self.blob_path, "ab") as f:
+            f.truncate(self.capacity * int(np.prod(self.slot_shape)))
+        data = self._map("r+")
+        
+        # cv2 decode/resize release the GIL, and workers write disjoint slots
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for key, kind, entry, error in pool.map(functools.partial(self._letterbox_into_slot, data), todo):
+                    if entry is None:
+                        # A failed rebuild may have half-written the slot
+                        self.entries.pop(key, None)
+                        self.failed[key] = error
+                    else:
+                        self.entries[key] = entry
+                        counts[kind] += 1
+        finally:
+            data.flush()
+            # np.memmap has no public close(); release the mapping now
+            # rather than whenever the array is garbage collected
+            data._mmap.close()
+            self._save_index()
+            self._data = self._map("r")
+        counts["failed"] = len(self.failed)
+        return counts
+    
+    def _letterbox_into_slot(self, data: np.memmap, item: tuple) -> tuple:
+        """Letterbox one image into its slot of data; returns (key, kind, entry or None, error)."""
+        key, mtime_ns, slot, kind = item
+        try:
+            img = load_image(key)
+            _, scale, padding = resize_with_padding(img, self.target_size, out=data[slot])
+        except Exception as e:
+            return key, kind, None, f"{type(e).__name__}: {e}"
+        return key, kind, {
+            "slot": slot,
+            "mtime_ns": mtime_ns,
+            "original_shape": list(img.shape[:2]),
+            "scale": scale,
+            "padding": list(padding),
+        }, None
+    
+    def _save_index(self):
+        tmp_path = self.index_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"target_size": self.target_size, "capacity": self.capacity, "entries": self.entries}, f)
+        os.replace(tmp_path, self.index_path)
+
+
+def _mtime_ns(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return -1
+
+
+def read_image_list(list_path: str) -> List[str]:
+    """
+    Image paths from a list file (one per line, as written by utils.split
+    in list mode); relative lines are relative to the list's directory.
+    """
+    list_path = Path(list_path)
+    with open(list_path, "r") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    return [str(path if path.is_absolute() else list_path.parent / path) for path in map(Path, lines)]
+
+
+def find_images(roots: Iterable[str]) -> List[str]:
+    """
+    All image files under the given files/directories, sorted. A .txt
+    file is read as a list of image paths, like a data.yaml split entry.
+    """
+    paths = []
+    for root in map(Path, roots):
+        if root.is_dir():
+            paths.extend(str(p) for p in root.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+        elif root.suffix.lower() == LIST_SUFFIX:
+            paths.extend(read_image_list(str(root)))
+        else:
+            paths.append(str(root))
+    return sorted(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the letterboxed image cache")
+    parser.add_argument("sources", nargs="+", help="Image files or directories")
+    parser.add_argument("--cache-dir", type=str, default="dataset/.cache", help="Cache directory")
+    parser.add_argument("--size", type=int, default=640, help="Target input size")
+    parser.add_argument("--workers", type=int, default=4, help="Decode threads")
+    args = parser.parse_args()
+    
+    cache = TensorCache(args.cache_dir, args.size)
+    counts = cache.update(find_images(args.sources), workers=args.workers)
+    print(f"Cache: {cache.blob_path} ({len(cache)} images)")
+    print(f"  Reused:  {counts['reused']}")
+    print(f"  Rebuilt: {counts['rebuilt']}")
+    print(f"  Added:   {counts['added']}")
+    if counts["failed"]:
+        print(f"  Failed:  {counts['failed']}")
+        for path, error in sorted(cache.failed.items())[:20]:
+            print(f"    {path}: {error}")
+
+
+if __name__ == "__main__":
+    main()
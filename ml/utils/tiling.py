@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Tiled (sliced) inference for high-resolution field images.
+
+Letterboxing a 4000x3000 capture to 640 px shrinks it ~6x, and small
+pests like thrips and aphids fall below the detector's resolution.
+TiledDetector instead cuts the image into overlapping tile_size crops at
+native resolution, runs every tile (plus, optionally, the letterboxed
+full frame for large lesions) through one batched forward pass, shifts
+tile boxes back to image coordinates and merges duplicates from the
+overlaps with class-aware NMS or weighted box fusion.
+
+Tiles with almost no texture (sky, bare soil, plain background) can be
+skipped: per-tile grayscale standard deviation is computed for all tiles
+at once from integral images of a downsampled frame, and tiles below
+skip_std are dropped before the forward pass.
+
+Usage (from the ml/ directory):
+    python -m utils.tiling best.onnx field.jpg --tile 640 --overlap 0.2 --merge wbf
+"""
+
+import argparse
+from typing import Callable, List, Tuple, Union
+
+import cv2
+import numpy as np
+
+from .boxes import non_max_suppression, weighted_box_fusion
+from .onnx_engine import Detections, OnnxDetector
+from .preprocess import BatchBuffer, load_image
+
+
+MERGE_METHODS = ("nms", "wbf")
+MERGE_METRICS = ("iou", "ios")
+
+
+def tile_grid(width: int, height: int, tile_size: int = 640, overlap: float = 0.2) -> np.ndarray:
+    """
+    Overlapping tiles covering a width x height image.
+    
+    Tiles advance by tile_size * (1 - overlap); the last row and column
+    are shifted back to end flush with the image edge, so every tile is
+    full size unless the image itself is smaller than tile_size.
+    
+    Returns:
+        (T, 4) int array of [x1, y1, x2, y2] tiles, row-major
+    """
+    stride = max(1, int(tile_size * (1 - overlap)))
+    
+    def starts(length: int) -> np.ndarray:
+        if length <= tile_size:
+            return np.zeros(1, dtype=np.int64)
+        n = int(np.ceil((length - tile_size) / stride)) + 1
+        return np.minimum(np.arange(n) * stride, length - tile_size)
+    
+    x0, y0 = np.meshgrid(starts(width), starts(height))
+    x0, y0 = x0.ravel(), y0.ravel()
+    return np.stack([x0, y0, np.minimum(x0 + tile_size, width), np.minimum(y0 + tile_size, height)], axis=1)
+
+
+def tile_std(image: np.ndarray, tiles: np.ndarray, step: int = 4) -> np.ndarray:
+    """
+    Grayscale standard deviation of every tile, from one pair of integral
+    images over the image subsampled by step.
+    """
+    gray = cv2.cvtColor(np.ascontiguousarray(image[::step, ::step]), cv2.COLOR_BGR2GRAY)
+    sums, squares = cv2.integral2(gray, sdepth=cv2.CV_64F)
+    
+    h, w = gray.shape
+    x1 = np.minimum(tiles[:, 0] // step, w - 1)
+    y1 = np.minimum(tiles[:, 1] // step, h - 1)
+    x2 = np.clip(-(-tiles[:, 2] // step), x1 + 1, w)
+    y2 = np.clip(-(-tiles[:, 3] // step), y1 + 1, h)
+    area = (x2 - x1) * (y2 - y1)
+    
+    def box_sum(table):
+        return table[y2, x2] - table[y1, x2] - table[y2, x1] + table[y1, x1]
+    
+    mean = box_sum(sums) / area
+    variance = box_sum(squares) / area - mean ** 2
+    return np.sqrt(np.maximum(variance, 0))
+
+
+def merge_detections(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    class_ids: np.ndarray,
+    method: str = "nms",
+    iou_threshold: float = 0.5,
+    metric: str = "ios",
+) -> Detections:
+    """
+    Merge duplicate detections from overlapping tiles with NMS or WBF.
+    
+    The default "ios" metric treats a box truncated at a tile border as a
+    duplicate of the complete box from the neighbouring tile, which plain
+    IoU misses when most of the object lies outside the truncated tile.
+    """
+    if method not in MERGE_METHODS:
+        raise ValueError(f"method must be one of {MERGE_METHODS}, got {method!r}")
+    if len(boxes) == 0:
+        return boxes, scores, class_ids
+    if method == "wbf":
+        return weighted_box_fusion(boxes, scores, class_ids, iou_threshold, metric)
+    keep = non_max_suppression(boxes, scores, iou_threshold, class_ids, len(boxes), metric)
+    return boxes[keep], scores[keep], class_ids[keep]
+
+
+class TiledDetector:
+    """
+    Run a batched detector over overlapping native-resolution tiles.
+    
+    infer_batch takes a preprocessed (N, 3, S, S) batch plus per-image
+    letterbox metadata and returns (boxes, scores, class_ids) per image
+    in original coordinates, e.g. OnnxDetector.infer; S must equal
+    tile_size. Images that fit in one tile skip tiling and are simply
+    letterboxed.
+    
+    Args:
+        infer_batch: Batched detector, see above
+        tile_size: Tile edge in pixels (the model input size)
+        overlap: Fraction of tile_size shared by neighbouring tiles
+        merge: "nms" or "wbf" for cross-tile duplicates
+        merge_iou: Overlap above which detections are duplicates
+        merge_metric: "ios" (default) or "iou" overlap for merging
+        skip_std: Skip tiles whose grayscale std is below this (0 = off)
+        include_full: Also run the letterboxed full frame, for objects
+            larger than a tile
+        max_batch: Largest number of tiles per forward pass, and the
+            size of the input buffer they are filled into (use the
+            model's batch size)
+    
+    Example:
+        detector = OnnxDetector("best.onnx")
+        tiled = TiledDetector(detector.infer, tile_size=detector.imgsz, skip_std=4.0)
+        boxes, scores, class_ids = tiled.predict("drone_4000x3000.jpg")
+    """
+    
+    def __init__(
+        self,
+        infer_batch: Callable[[np.ndarray, List[dict]], List[Detections]],
+        tile_size: int = 640,
+        overlap: float = 0.2,
+        merge: str = "nms",
+        merge_iou: float = 0.5,
+        merge_metric: str = "ios",
+        skip_std: float = 0.0,
+        include_full: bool = True,
+        max_batch: int = 32,
+        pad_color: Tuple[int, int, int] = (114, 114, 114),
+    ):
+        if merge not in MERGE_METHODS:
+            raise ValueError(f"merge must be one of {MERGE_METHODS}, got {merge!r}")
+        if merge_metric not in MERGE_METRICS:
+            raise ValueError(f"merge_metric must be one of {MERGE_METRICS}, got {merge_metric!r}")
+        if not 0 <= overlap < 1:
+            raise ValueError(f"overlap must be in [0, 1), got {overlap}")
+        self.infer_batch = infer_batch
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.merge = merge
+        self.merge_iou = merge_iou
+        self.merge_metric = merge_metric
+        self.skip_std = skip_std
+        self.include_full = include_full
+        self.max_batch = max_batch
+        self.pad_color = pad_color
+        self.last_stats = {}
+    
+    def predict(self, image: Union[str, np.ndarray]) -> Detections:
+        """Detect objects in one image path or BGR array; boxes in image pixels."""
+        if not isinstance(image, np.ndarray):
+            image = load_image(image)
+        h, w = image.shape[:2]
+        if max(h, w) > self.tile_size:
+            grid = tile_grid(w, h, self.tile_size, self.overlap)
+        else:
+            grid = np.zeros((0, 4), dtype=np.int64)
+        tiles = grid
+        if self.skip_std > 0 and len(grid):
+            tiles = grid[tile_std(image, grid) >= self.skip_std]
+        full = self.include_full or len(tiles) == 0
+        
+        # Tiles (then the full frame) go through one reused buffer of at
+        # most max_batch slots, so memory does not grow with the image
+        n_inputs = len(tiles) + int(full)
+        buffer = BatchBuffer(min(n_inputs, self.max_batch), self.tile_size, pad_color=self.pad_color)
+        outputs = []
+        for start in range(0, n_inputs, self.max_batch):
+            metadata_list = [self._fill(buffer, slot, image, tiles, index)
+                             for slot, index in enumerate(range(start, min(start + self.max_batch, n_inputs)))]
+            outputs.extend(self.infer_batch(buffer.view(len(metadata_list)), metadata_list))
+        
+        # Shift tile boxes by their tile origin; the full frame is already global
+        counts = [len(scores) for _boxes, scores, _class_ids in outputs]
+        origins = np.concatenate([tiles[:, :2], np.zeros((int(full), 2), dtype=np.int64)])
+        boxes = np.concatenate([np.reshape(b, (-1, 4)) for b, _s, _c in outputs]).astype(np.float64)
+        boxes += np.tile(np.repeat(origins, counts, axis=0), 2)
+        scores = np.concatenate([s for _b, s, _c in outputs]).astype(np.float64)
+        class_ids = np.concatenate([c for _b, _s, c in outputs]).astype(np.int64)
+        
+        self.last_stats = {
+            "tiles": len(grid),
+            "skipped": len(grid) - len(tiles),
+            "forward_images": n_inputs,
+            "raw_detections": len(boxes),
+        }
+        return merge_detections(boxes, scores, class_ids, self.merge, self.merge_iou, self.merge_metric)
+    
+    def _fill(self, buffer: BatchBuffer, slot: int, image: np.ndarray, tiles: np.ndarray, index: int) -> dict:
+        """Put input index (a tile, or the full frame after the tiles) into slot; returns its metadata."""
+        if index == len(tiles):
+            return buffer.fill(slot, image)
+        x1, y1, x2, y2 = tiles[index]
+        crop = image[y1:y2, x1:x2]
+        if crop.shape[:2] != (self.tile_size, self.tile_size):
+            canvas = np.empty((self.tile_size, self.tile_size, 3), dtype=np.uint8)
+            canvas[:] = self.pad_color
+            canvas[:y2 - y1, :x2 - x1] = crop
+            crop = canvas
+        buffer.put(slot, crop)
+        # Identity letterbox: boxes come back in tile pixels, clipped to the crop
+        return {
+            "original_shape": (int(y2 - y1), int(x2 - x1)),
+            "scale": 1.0,
+            "padding": (0, 0),
+            "target_size": self.tile_size,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiled inference with an exported ONNX model")
+    parser.add_argument("model", help="Exported .onnx model")
+    parser.add_argument("images", nargs="+", help="Image paths")
+    parser.add_argument("--tile", type=int, default=640, help="Tile size (model input size)")
+    parser.add_argument("--overlap", type=float, default=0.2, help="Tile overlap fraction")
+    parser.add_argument("--merge", default="nms", choices=MERGE_METHODS, help="Cross-tile merge method")
+    parser.add_argument("--merge-iou", type=float, default=0.5, help="Overlap for cross-tile duplicates")
+    parser.add_argument("--merge-metric", default="ios", choices=MERGE_METRICS, help="Overlap measure for merging")
+    parser.add_argument("--skip-std", type=float, default=0.0, help="Skip tiles with grayscale std below this")
+    parser.add_argument("--no-full", action="store_true", help="Do not add the letterboxed full frame")
+    parser.add_argument("--conf", type=float, default=0.25, help="Confidence threshold")
+    parser.add_argument("--iou", type=float, default=0.45, help="Per-tile NMS IoU threshold")
+    args = parser.parse_args()
+    
+    detector = OnnxDetector(args.model, conf=args.conf, iou=args.iou, imgsz=args.tile)
+    tiled = TiledDetector(
+        detector.infer,
+        tile_size=detector.imgsz,
+        overlap=args.overlap,
+        merge=args.merge,
+        merge_iou=args.merge_iou,
+        merge_metric=args.merge_metric,
+        skip_std=args.skip_std,
+        include_full=not args.no_full,
+        max_batch=32 if detector.dynamic_batch else 1,
+    )
+    for path in args.images:
+        boxes, scores, class_ids = tiled.predict(path)
+        stats = tiled.last_stats
+        print(f"{path}: {len(boxes)} detections "
+              f"({stats['tiles']} tiles, {stats['skipped']} skipped, {stats['raw_detections']} before merge)")
+        for box, score, cls_id in zip(boxes, scores, class_ids):
+            print(f"  class {cls_id}  {score:.2%}  {np.round(box, 1).tolist()}")
+
+
+if __name__ == "__main__":
+    main()